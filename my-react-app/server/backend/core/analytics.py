@@ -0,0 +1,235 @@
+import asyncio
+import hashlib
+import json
+import time
+from typing import Dict, List, Optional
+
+from bson import ObjectId
+from fastapi import HTTPException
+
+from core import assignments
+from core.cache import TTLCache
+from core.config import ANALYTICS_CACHE_TTL
+from core.gradebook import question_scores
+from db.connection import (
+    class_memberships_collection,
+    classrooms_collection,
+    homeworks_collection,
+    qna_collection,
+    submissions_collection,
+)
+
+HISTOGRAM_BINS = 10
+# Upper/lower groups for the discrimination index (Kelley's 27%)
+GROUP_FRACTION = 0.27
+
+# homework_id -> (stamp, analytics). The stamp is the submission count and
+# latest updated_at; every grade, publish or return bumps updated_at, so a
+# changed grade (from any worker) invalidates the entry on the next read.
+# It also hashes the homework and its questions, so edits to questions or
+# max_points do too.
+_cache = TTLCache(maxsize=256, ttl=ANALYTICS_CACHE_TTL)
+
+
+def _r(value, digits: int = 3):
+    return None if value is None or value != value else round(float(value), digits)
+
+
+def _summary(np, values) -> dict:
+    if not len(values):
+        return {"count": 0}
+    p25, median, p75 = np.percentile(values, [25, 50, 75])
+    return {
+        "count": int(len(values)),
+        "mean": _r(values.mean()),
+        "std": _r(values.std(ddof=1)) if len(values) > 1 else 0.0,
+        "min": _r(values.min()),
+        "p25": _r(p25),
+        "median": _r(median),
+        "p75": _r(p75),
+        "max": _r(values.max()),
+    }
+
+
+def compute_analytics(
+    questions: List[dict],
+    max_points: float,
+    totals: List[Optional[float]],
+    item_scores: List[List[Optional[float]]],
+    choices: List[List[Optional[int]]],
+    classes: List[List[str]],
+) -> dict:
+    """
+    Item analysis over the columnar data of one homework; row i of every
+    argument is submission i. Missing values are NaN/None and are left out
+    per statistic. Runs off the event loop.
+    """
+    import numpy as np
+
+    n, q = len(totals), len(questions)
+    total = np.array([np.nan if t is None else t for t in totals], dtype=float)
+    scored = ~np.isnan(total)
+    result = {"submissions": n, "scored": int(scored.sum())}
+
+    values = total[scored]
+    distribution = _summary(np, values)
+    if len(values):
+        edges = np.linspace(0, max(max_points, float(values.max()), 1.0), HISTOGRAM_BINS + 1)
+        counts, _ = np.histogram(values, bins=edges)
+        distribution["histogram"] = [
+            {"from": _r(edges[i], 2), "to": _r(edges[i + 1], 2), "count": int(c)} for i, c in enumerate(counts)
+        ]
+        distribution["mean_percent"] = _r(100.0 * values.mean() / max_points, 1) if max_points else None
+    result["distribution"] = distribution
+
+    # ---- items ----
+    items = np.full((n, q), np.nan)
+    for i, row in enumerate(item_scores):
+        for j, v in enumerate(row[:q]):
+            if v is not None:
+                items[i, j] = v
+    points = np.array([float(qq.get("points") or 0) for qq in questions])
+
+    # Upper and lower groups by total score
+    order = np.argsort(np.where(scored, total, -np.inf))[::-1][: int(scored.sum())]
+    group = max(int(round(len(order) * GROUP_FRACTION)), 1) if len(order) >= 2 else 0
+    upper, lower = order[:group], order[len(order) - group:] if group else order[:0]
+
+    per_question = []
+    for j, question in enumerate(questions):
+        col = items[:, j]
+        answered = ~np.isnan(col)
+        entry = {
+            "index": j,
+            "type": question.get("type"),
+            "prompt": question.get("prompt", ""),
+            "points": _r(points[j], 2),
+            "scored": int(answered.sum()),
+        }
+        if answered.any() and points[j] > 0:
+            frac = col / points[j]
+            # Difficulty index: mean fraction of the points earned (higher = easier)
+            entry["difficulty"] = _r(np.nanmean(frac))
+            if group:
+                up, lo = frac[upper], frac[lower]
+                if (~np.isnan(up)).any() and (~np.isnan(lo)).any():
+                    entry["discrimination"] = _r(np.nanmean(up) - np.nanmean(lo))
+            # Corrected item-total correlation (item vs. total without it)
+            both = answered & scored
+            if both.sum() > 2:
+                x, rest = col[both], total[both] - col[both]
+                if x.std() > 0 and rest.std() > 0:
+                    entry["item_total_correlation"] = _r(np.corrcoef(x, rest)[0, 1])
+        if question.get("type") == "mcq":
+            options = question.get("options") or []
+            picked = np.array(
+                [c[j] if j < len(c) and c[j] is not None and 0 <= c[j] < len(options) else -1 for c in choices],
+                dtype=np.int64,
+            )
+            counts = np.bincount(picked[picked >= 0], minlength=len(options)) if len(options) else []
+            entry["options"] = [
+                {"index": k, "text": options[k], "count": int(counts[k]), "correct": k == question.get("correctIndex")}
+                for k in range(len(options))
+            ]
+            entry["unanswered"] = int((picked < 0).sum())
+        per_question.append(entry)
+    result["questions"] = per_question
+
+    # ---- classrooms ----
+    by_class: Dict[str, List[int]] = {}
+    for i, labels in enumerate(classes):
+        for label in labels:
+            by_class.setdefault(label, []).append(i)
+    result["classrooms"] = [
+        {"classroom": label, "submissions": len(rows), **_summary(np, total[rows][scored[rows]])}
+        for label, rows in sorted(by_class.items())
+    ]
+    return result
+
+
+def _content_hash(hw: dict, questions: list) -> str:
+    payload = json.dumps([hw, questions], sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+async def _stamp(homework_id: str):
+    count, latest = await asyncio.gather(
+        submissions_collection.count_documents({"homework_id": homework_id}),
+        submissions_collection.find_one(
+            {"homework_id": homework_id}, {"updated_at": 1}, sort=[("updated_at", -1)]
+        ),
+    )
+    return count, (latest or {}).get("updated_at")
+
+
+async def homework_analytics(homework_id: str) -> dict:
+    """Score distribution, item analysis and classroom breakdown, cached until a submission changes."""
+    started = time.perf_counter()
+    try:
+        hw = await homeworks_collection.find_one({"_id": ObjectId(homework_id)})
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid homework id")
+    if not hw:
+        raise HTTPException(status_code=404, detail="Homework not found")
+
+    qna = await qna_collection.find_one({"case_id": hw.get("case_id")}, {"questions": 1})
+    questions = ((qna or {}).get("questions") or []) if hw.get("homework_type") == "Q&A" else []
+
+    stamp = (*await _stamp(homework_id), _content_hash(hw, questions))
+    cached = _cache.get(homework_id)
+    if cached is not None and cached[0] == stamp:
+        return {**cached[1], "cached": True}
+
+    subs = await submissions_collection.find(
+        {"homework_id": homework_id, "$or": [{"status": {"$ne": "draft"}}, {"frozen": True}]},
+        {"user_id": 1, "status": 1, "published": 1, "score": 1, "auto_score": 1, "rubric": 1, "answers": 1},
+    ).to_list(None)
+
+    # Classroom labels for the homework's classes, and each student's among them
+    class_ids = await assignments.homework_class_ids(hw)
+    labels = {}
+    oids = [ObjectId(c) for c in class_ids if ObjectId.is_valid(c)]
+    if oids:
+        async for cls in classrooms_collection.find({"_id": {"$in": oids}}, {"name": 1, "year": 1}):
+            labels[str(cls["_id"])] = assignments.class_label(cls.get("name"), cls.get("year")) or str(cls["_id"])
+    member_of: Dict[str, List[str]] = {}
+    if labels:
+        cursor = class_memberships_collection.find(
+            {"class_id": {"$in": list(labels)}, "user_id": {"$in": [s.get("user_id") for s in subs]}},
+            {"user_id": 1, "class_id": 1},
+        )
+        async for pair in cursor:
+            member_of.setdefault(pair["user_id"], []).append(labels[pair["class_id"]])
+
+    def choices_of(sub):
+        row = [None] * len(questions)
+        for item in sub.get("answers") or []:
+            if isinstance(item, dict) and isinstance(item.get("index"), int) and 0 <= item["index"] < len(questions):
+                try:
+                    row[item["index"]] = int(item.get("value"))
+                except (TypeError, ValueError):
+                    pass
+        return row
+
+    result = await asyncio.to_thread(
+        compute_analytics,
+        questions,
+        float(hw.get("max_points") or 100),
+        [s.get("score") if s.get("score") is not None else s.get("auto_score") for s in subs],
+        [question_scores(s, len(questions)) for s in subs],
+        [choices_of(s) for s in subs],
+        [member_of.get(s.get("user_id"), []) for s in subs],
+    )
+
+    statuses: Dict[str, int] = {}
+    for s in subs:
+        statuses[s.get("status", "submitted")] = statuses.get(s.get("status", "submitted"), 0) + 1
+    result.update({
+        "homework_id": homework_id,
+        "max_points": hw.get("max_points") or 100,
+        "statuses": statuses,
+        "published": sum(1 for s in subs if s.get("published")),
+        "computed_ms": round((time.perf_counter() - started) * 1000, 1),
+    })
+    _cache.set(homework_id, (stamp, result))
+    return {**result, "cached": False}
@@ -0,0 +1,106 @@
+from typing import Iterable, List, Optional
+
+from pymongo import DeleteOne, UpdateOne
+
+from db.connection import classrooms_collection, class_memberships_collection
+
+# One document per (class_id, user_id) pair, both stored as strings:
+#   {"_id": "<class_id>:<user_id>", "class_id": ..., "user_id": ...}
+# Mirrors classroom `members` (and legacy `students`) so "is this student
+# assigned?" is a single indexed lookup instead of loading whole classrooms.
+
+
+def class_label(name: Optional[str], year: Optional[str]) -> Optional[str]:
+    """Display label of a classroom, "Name (Year)"."""
+    if not name:
+        return None
+    return f"{name} ({year})" if year else name
+
+
+def _pair_id(class_id: str, user_id: str) -> str:
+    return f"{class_id}:{user_id}"
+
+
+def _pair(class_id, user_id) -> dict:
+    class_id, user_id = str(class_id), str(user_id)
+    return {"_id": _pair_id(class_id, user_id), "class_id": class_id, "user_id": user_id}
+
+
+async def add_member(class_id, user_id):
+    pair = _pair(class_id, user_id)
+    await class_memberships_collection.update_one({"_id": pair["_id"]}, {"$setOnInsert": pair}, upsert=True)
+
+
+async def remove_member(class_id, user_id):
+    await class_memberships_collection.delete_one({"_id": _pair_id(str(class_id), str(user_id))})
+
+
+async def drop_class(class_id):
+    await class_memberships_collection.delete_many({"class_id": str(class_id)})
+
+
+async def rebuild() -> dict:
+    """
+    Reconcile the index with the classroom documents (run at startup, so
+    the collection is backfilled once and heals after out-of-band edits).
+    """
+    wanted = {}
+    cursor = classrooms_collection.find({}, {"members": 1, "students": 1})
+    async for classroom in cursor:
+        for user_id in list(classroom.get("members") or []) + list(classroom.get("students") or []):
+            pair = _pair(classroom["_id"], user_id)
+            wanted[pair["_id"]] = pair
+
+    existing = set()
+    async for doc in class_memberships_collection.find({}, {"_id": 1}):
+        existing.add(doc["_id"])
+
+    ops = [
+        UpdateOne({"_id": pid}, {"$setOnInsert": pair}, upsert=True)
+        for pid, pair in wanted.items()
+        if pid not in existing
+    ]
+    ops += [DeleteOne({"_id": pid}) for pid in existing - wanted.keys()]
+    if ops:
+        await class_memberships_collection.bulk_write(ops, ordered=False)
+    return {"added": len(wanted.keys() - existing), "removed": len(existing - wanted.keys())}
+
+
+async def homework_class_ids(hw: dict) -> List[str]:
+    """Target classroom ids of a homework, resolving legacy class_name/year docs."""
+    class_ids = [str(x) for x in (hw.get("class_ids") or []) if x]
+    if class_ids:
+        return class_ids
+    if hw.get("class_name"):
+        classroom = await classrooms_collection.find_one(
+            {"name": hw.get("class_name"), "year": hw.get("year")}, {"_id": 1}
+        )
+        if classroom:
+            return [str(classroom["_id"])]
+    return []
+
+
+async def is_member(user_id: str, class_ids: Iterable[str]) -> bool:
+    class_ids = [str(c) for c in class_ids if c]
+    if not user_id or not class_ids:
+        return False
+    found = await class_memberships_collection.find_one(
+        {"user_id": str(user_id), "class_id": {"$in": class_ids}}, {"_id": 1}
+    )
+    return found is not None
+
+
+async def is_assigned(hw: dict, user_id: Optional[str]) -> bool:
+    """Whether a homework's audience includes the given student."""
+    audience_norm = str(hw.get("audience") or "All Students").strip().lower()
+    if audience_norm in ("all students", "all"):
+        return True
+    if audience_norm in ("classrooms", "classroom"):
+        return await is_member(user_id, await homework_class_ids(hw))
+    return False
+
+
+async def user_class_ids(user_id: str) -> List[str]:
+    cursor = class_memberships_collection.find({"user_id": str(user_id)}, {"class_id": 1})
+    return [doc["class_id"] async for doc in cursor]
+
@@ -0,0 +1,254 @@
+import asyncio
+import os
+import re
+import time
+from collections import Counter
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable, Optional
+
+from fastapi import HTTPException, UploadFile
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+from core.config import MAX_UPLOAD_SIZE
+from core.dicom import drop_study
+from core.storage import put_session, put_upload, storage
+from core.uploads import StoredUpload, abort_session, check_owner, get_session, hash_upload
+from db.connection import blobs_collection
+
+# Content-addressed layout: blobs/{sha[:2]}/{sha}{ext}, under whichever
+# storage backend is configured (so URLs may point at /uploads or a bucket).
+BLOB_PREFIX = "blobs"
+BLOB_URL_RE = re.compile(r"/blobs/[0-9a-f]{2}/([0-9a-f]{64})(\.[A-Za-z0-9]+)?$")
+# Rendered DICOM previews reference the study's blob as well
+DICOM_URL_RE = re.compile(r"/api/dicom/([0-9a-f]{64})/")
+
+# Blobs never change, and formats that benefit (SVG, raw DICOM, ...) get a
+# precompressed sidecar where the backend can serve one.
+BLOB_PUT_OPTIONS = {"immutable": True, "precompress": True}
+
+# A blob whose last reference is gone is tombstoned (`deleting`) while its
+# file is removed; uploads of the same bytes wait this long for it to go.
+DELETE_WAIT_SECONDS = 10
+DELETE_POLL_SECONDS = 0.05
+STALE_TOMBSTONE = timedelta(minutes=5)
+
+
+def blob_key(sha256: str, ext: str) -> str:
+    return f"{BLOB_PREFIX}/{sha256[:2]}/{sha256}{ext}"
+
+
+def blob_url(blob: dict) -> str:
+    return storage.public_url(blob["key"])
+
+
+def sha_from_url(url: Optional[str]) -> Optional[str]:
+    """Return the blob hash for a content-addressed upload URL, else None."""
+    if not url or not isinstance(url, str):
+        return None
+    match = BLOB_URL_RE.search(url.split("?", 1)[0]) or DICOM_URL_RE.search(url)
+    return match.group(1) if match else None
+
+
+def normalize_ext(filename: Optional[str]) -> str:
+    _, ext = os.path.splitext(filename or "")
+    return ext.lower() if ext else ""
+
+
+def _with_url(blob: dict) -> dict:
+    blob["sha256"] = blob["_id"]
+    blob["url"] = blob_url(blob)
+    return blob
+
+
+async def add_ref(sha256: str, count: int = 1) -> Optional[dict]:
+    """Take `count` more references on an existing blob; None if it is unknown or being deleted."""
+    blob = await blobs_collection.find_one_and_update(
+        {"_id": sha256, "deleting": {"$ne": True}},
+        {"$inc": {"refcount": count}},
+        return_document=ReturnDocument.AFTER,
+    )
+    return _with_url(blob) if blob else None
+
+
+async def _await_deletion(sha256: str):
+    """Wait until a tombstoned blob with these bytes is gone, so its delete cannot hit a new file."""
+    deadline = time.monotonic() + DELETE_WAIT_SECONDS
+    while True:
+        tombstone = await blobs_collection.find_one({"_id": sha256, "deleting": True})
+        if not tombstone:
+            return
+        if tombstone.get("deleting_at", datetime.min) < datetime.utcnow() - STALE_TOMBSTONE:
+            # Left by a process that died mid-delete: finish it
+            await storage.delete(tombstone["key"])
+            await blobs_collection.delete_one({"_id": sha256, "deleting": True})
+            return
+        if time.monotonic() > deadline:
+            raise HTTPException(status_code=503, detail="The same file is being deleted; try again")
+        await asyncio.sleep(DELETE_POLL_SECONDS)
+
+
+async def _register(
+    sha256: str, key: str, put: Callable[[], Awaitable[StoredUpload]], content_type: Optional[str] = None
+) -> dict:
+    """
+    Write the file with `put` and record the blob. When the same bytes
+    were registered concurrently, take a reference on theirs instead; when
+    that blob is being deleted, its delete may remove the file just
+    written, so wait for it and write again.
+    """
+    while True:
+        await _await_deletion(sha256)
+        stored = await put()
+        blob = {
+            "_id": sha256,
+            "key": key,
+            "size": stored.size,
+            "content_type": content_type or stored.content_type,
+            "refcount": 1,
+            "created_at": datetime.utcnow(),
+        }
+        try:
+            await blobs_collection.insert_one(blob)
+        except DuplicateKeyError:
+            existing = await add_ref(sha256)
+            if existing is None:
+                continue
+            # Keep theirs, drop ours if it landed under a different extension.
+            if existing["key"] != key:
+                await storage.delete(key)
+            return existing
+        return _with_url(blob)
+
+
+async def store_upload(
+    upload: Optional[UploadFile] = None,
+    upload_id: Optional[str] = None,
+    *,
+    max_bytes: Optional[int] = MAX_UPLOAD_SIZE,
+    owner_id: Optional[str] = None,
+) -> dict:
+    """
+    Store a multipart upload or a completed resumable upload as a blob and
+    return the blob document (with `url`). Each call holds one reference,
+    owned by whichever document ends up storing the URL. Duplicate bytes
+    only bump the refcount and are never written again.
+    """
+    if upload_id:
+        session = await get_session(upload_id)
+        check_owner(session, owner_id)
+        if session.get("status") != "complete":
+            raise HTTPException(status_code=409, detail="Upload is not complete")
+
+        sha256 = session["sha256"]
+        existing = await add_ref(sha256)
+        if existing:
+            await abort_session(upload_id)
+            return existing
+
+        key = blob_key(sha256, normalize_ext(session.get("filename")))
+        claimed = False
+
+        async def put_claimed():
+            # The session file is moved into storage, so it can only be put once
+            nonlocal claimed
+            if claimed:
+                raise HTTPException(status_code=409, detail="Upload raced with a deletion of the same file; upload it again")
+            claimed = True
+            return await put_session(upload_id, key, **BLOB_PUT_OPTIONS)
+
+        return await _register(sha256, key, put_claimed)
+
+    if not upload:
+        raise HTTPException(status_code=400, detail="File is required")
+
+    sha256, _ = await hash_upload(upload, max_bytes=max_bytes)
+    existing = await add_ref(sha256)
+    if existing:
+        return existing
+
+    key = blob_key(sha256, normalize_ext(upload.filename))
+
+    async def put_file():
+        await upload.seek(0)
+        return await put_upload(upload, key, max_bytes=max_bytes, **BLOB_PUT_OPTIONS)
+
+    return await _register(sha256, key, put_file, upload.content_type)
+
+
+async def release(sha256: str, count: int = 1) -> bool:
+    """
+    Drop `count` references; the file is deleted with the last one, along
+    with the decoded study if it was a DICOM file.
+    """
+    blob = await blobs_collection.find_one_and_update(
+        {"_id": sha256},
+        {"$inc": {"refcount": -count}},
+        return_document=ReturnDocument.AFTER,
+    )
+    if not blob or blob.get("refcount", 0) > 0:
+        return False
+
+    # Tombstone first, unless somebody re-referenced it in the meantime:
+    # from here on add_ref ignores the blob and new uploads of the same
+    # bytes wait for the doc to go before writing the file again.
+    blob = await blobs_collection.find_one_and_update(
+        {"_id": sha256, "refcount": {"$lte": 0}, "deleting": {"$ne": True}},
+        {"$set": {"deleting": True, "deleting_at": datetime.utcnow()}},
+    )
+    if not blob:
+        return False
+    try:
+        await storage.delete(blob["key"])
+        await drop_study(sha256)
+    finally:
+        await blobs_collection.delete_one({"_id": sha256, "deleting": True})
+    return True
+
+
+async def release_refs(refs: Counter) -> int:
+    """Release the references counted by `blob_refs`; returns how many blobs were freed."""
+    freed = 0
+    for sha, count in refs.items():
+        if count > 0 and await release(sha, count):
+            freed += 1
+    return freed
+
+
+# Fields that repeat the case image instead of owning a reference of their own
+COPY_FIELDS = {"case_image", "annotation_image"}
+
+
+def _refs(value) -> Counter:
+    if isinstance(value, str):
+        sha = sha_from_url(value)
+        return Counter({sha: 1}) if sha else Counter()
+    if isinstance(value, list):
+        total = Counter()
+        for item in value:
+            total += _refs(item)
+        return total
+    if isinstance(value, dict):
+        # Each list item owns its own reference; the other URLs of one
+        # record (a DICOM preview next to its source) are the same one
+        owned, record = Counter(), Counter()
+        for key, item in value.items():
+            if key in COPY_FIELDS:
+                continue
+            if isinstance(item, list):
+                owned += _refs(item)
+            else:
+                record |= _refs(item)
+        return owned + record
+    return Counter()
+
+
+def blob_refs(*docs) -> Counter:
+    """
+    References held by the given documents, per blob hash: one per upload
+    stored in them, so an image stored twice is released twice.
+    """
+    total = Counter()
+    for doc in docs:
+        total += _refs(doc)
+    return total
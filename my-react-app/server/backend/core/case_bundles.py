@@ -0,0 +1,57 @@
+import asyncio
+import logging
+from typing import Optional
+
+from bson import ObjectId
+
+from core.cache import TTLCache
+from core.config import CASE_BUNDLE_TTL
+from db.connection import cases_collection, homeworks_collection, qna_collection, annot_collection
+
+logger = logging.getLogger(__name__)
+
+# case_id -> {"case", "homework", "qna", "annot"}; the same for every student
+# opening the case, so only the assignment check runs per request.
+_bundles = TTLCache(maxsize=512, ttl=CASE_BUNDLE_TTL)
+
+
+async def _find_case(case_id: str) -> Optional[dict]:
+    try:
+        return await cases_collection.find_one({"_id": ObjectId(case_id)})
+    except Exception:
+        return await cases_collection.find_one({"case_id": case_id})
+
+
+async def load_case_bundle(case_id: str) -> dict:
+    """Case, latest homework, Q&A and annotation docs for a case, read concurrently."""
+    cached = _bundles.get(case_id)
+    if cached is not None:
+        return cached
+
+    case, hw, qna, annot = await asyncio.gather(
+        _find_case(case_id),
+        homeworks_collection.find_one({"case_id": case_id}, sort=[("created_at", -1)]),
+        qna_collection.find_one({"case_id": case_id}),
+        annot_collection.find_one({"case_id": case_id}),
+    )
+
+    if case:
+        case["_id"] = str(case["_id"])
+        case.pop("created_at", None)
+    if hw:
+        hw["_id"] = str(hw["_id"])
+        hw.pop("created_at", None)
+    if qna:
+        qna.pop("_id", None)
+    if annot:
+        annot.pop("_id", None)
+
+    bundle = {"case": case, "homework": hw, "qna": qna, "annot": annot}
+    _bundles.set(case_id, bundle)
+    logger.debug("case bundle loaded: case_id=%s homework=%s", case_id, bool(hw))
+    return bundle
+
+
+def invalidate_case_bundle(case_id: Optional[str]):
+    if case_id:
+        _bundles.pop(str(case_id))
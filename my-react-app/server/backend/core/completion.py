@@ -0,0 +1,192 @@
+import logging
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Set
+
+from bson import ObjectId
+from pymongo import DeleteMany, ReplaceOne, UpdateOne
+
+from core import assignments
+from db.connection import (
+    class_memberships_collection,
+    homework_stats_collection,
+    homeworks_collection,
+    submissions_collection,
+)
+
+logger = logging.getLogger(__name__)
+
+# One document per (homework, classroom), plus one for the whole homework:
+#   {"_id": "<homework_id>:<class_id or *>", "homework_id", "class_id",
+#    "counts": {"submitted", "grading", "graded", "published"}, "updated_at"}
+# Single-submission transitions $inc the counters from the document's
+# state before and after the write; bulk writes recount their homeworks.
+# Either can drift if a process dies in between, which rebuild() repairs.
+
+ALL = "*"
+COUNTERS = ("submitted", "grading", "graded", "published")
+# Fields counters_of() and the classroom lookup need from a submission
+PROJECTION = {"homework_id": 1, "user_id": 1, "status": 1, "frozen": 1, "published": 1}
+_HW_PROJECTION = {"class_ids": 1, "class_name": 1, "year": 1}
+
+
+def counters_of(sub: Optional[dict]) -> Set[str]:
+    """The counters a submission contributes to in its current state."""
+    if not sub:
+        return set()
+    status = sub.get("status", "submitted")
+    if status == "draft" and not sub.get("frozen"):
+        # Still being written: not turned in yet
+        return set()
+    counters = {"submitted"}
+    if status in ("grading", "graded"):
+        counters.add(status)
+    if sub.get("published"):
+        counters.add("published")
+    return counters
+
+
+def _stats_id(homework_id: str, class_id: str) -> str:
+    return f"{homework_id}:{class_id}"
+
+
+async def _homework_class_ids(homework_id: str, hw: Optional[dict] = None) -> List[str]:
+    if hw is None:
+        try:
+            hw = await homeworks_collection.find_one({"_id": ObjectId(homework_id)}, _HW_PROJECTION)
+        except Exception:
+            hw = None
+    return await assignments.homework_class_ids(hw) if hw else []
+
+
+async def _classes_by_user(user_ids: Iterable[str], class_ids: Iterable[str]) -> Dict[str, List[str]]:
+    """Which of the homework's classrooms each student is in, in one query."""
+    user_ids, class_ids = list(user_ids), [str(c) for c in class_ids if c]
+    classes: Dict[str, List[str]] = {}
+    if not user_ids or not class_ids:
+        return classes
+    cursor = class_memberships_collection.find(
+        {"user_id": {"$in": user_ids}, "class_id": {"$in": class_ids}}, {"user_id": 1, "class_id": 1}
+    )
+    async for pair in cursor:
+        classes.setdefault(pair["user_id"], []).append(pair["class_id"])
+    return classes
+
+
+async def record_transition(before: Optional[dict], after: Optional[dict], hw: Optional[dict] = None):
+    """
+    Apply one submission's change to the counters. `before` must be the
+    pre-image returned by the write itself (find_one_and_update), so
+    concurrent transitions of the same submission each count once.
+    """
+    added, removed = counters_of(after) - counters_of(before), counters_of(before) - counters_of(after)
+    if not added and not removed:
+        return
+    sub = after or before
+    homework_id, user_id = str(sub["homework_id"]), str(sub.get("user_id"))
+    delta = {f"counts.{c}": 1 for c in added}
+    delta.update({f"counts.{c}": -1 for c in removed})
+
+    classes = await _classes_by_user([user_id], await _homework_class_ids(homework_id, hw))
+    now = datetime.utcnow()
+    ops = [
+        UpdateOne(
+            {"_id": _stats_id(homework_id, class_id)},
+            {
+                "$inc": delta,
+                "$set": {"updated_at": now},
+                "$setOnInsert": {"homework_id": homework_id, "class_id": class_id},
+            },
+            upsert=True,
+        )
+        for class_id in [ALL] + classes.get(user_id, [])
+    ]
+    try:
+        await homework_stats_collection.bulk_write(ops, ordered=False)
+    except Exception:
+        # The submission is already written; the next recount fixes this
+        logger.exception("homework %s: failed to update completion counters", homework_id)
+
+
+async def recount(homework_id: str) -> dict:
+    """Rebuild the counters of one homework from its submissions."""
+    homework_id = str(homework_id)
+    subs = await submissions_collection.find({"homework_id": homework_id}, PROJECTION).to_list(None)
+    classes = await _classes_by_user(
+        {str(s.get("user_id")) for s in subs}, await _homework_class_ids(homework_id)
+    )
+
+    totals: Dict[str, Dict[str, int]] = {ALL: dict.fromkeys(COUNTERS, 0)}
+    for sub in subs:
+        counters = counters_of(sub)
+        if not counters:
+            continue
+        for class_id in [ALL] + classes.get(str(sub.get("user_id")), []):
+            counts = totals.setdefault(class_id, dict.fromkeys(COUNTERS, 0))
+            for c in counters:
+                counts[c] += 1
+
+    now = datetime.utcnow()
+    keys = [_stats_id(homework_id, class_id) for class_id in totals]
+    ops = [
+        ReplaceOne(
+            {"_id": _stats_id(homework_id, class_id)},
+            {"homework_id": homework_id, "class_id": class_id, "counts": counts, "updated_at": now},
+            upsert=True,
+        )
+        for class_id, counts in totals.items()
+    ]
+    ops.append(DeleteMany({"homework_id": homework_id, "_id": {"$nin": keys}}))
+    await homework_stats_collection.bulk_write(ops, ordered=False)
+    return totals[ALL]
+
+
+async def recount_many(homework_ids: Iterable[str]):
+    for homework_id in sorted({str(h) for h in homework_ids if h}):
+        await recount(homework_id)
+
+
+async def rebuild() -> dict:
+    """Reconciliation job: recount every homework and drop counters of deleted ones."""
+    homework_ids = [str(hw["_id"]) async for hw in homeworks_collection.find({}, {"_id": 1})]
+    for homework_id in homework_ids:
+        await recount(homework_id)
+    orphans = await homework_stats_collection.delete_many({"homework_id": {"$nin": homework_ids}})
+    return {"homeworks": len(homework_ids), "orphans_removed": orphans.deleted_count}
+
+
+async def drop(homework_ids: Iterable[str]):
+    await homework_stats_collection.delete_many({"homework_id": {"$in": [str(h) for h in homework_ids]}})
+
+
+async def completion(homework_id: str) -> Optional[dict]:
+    """The stored counters of a homework, overall and per classroom, with enrolment."""
+    try:
+        hw = await homeworks_collection.find_one({"_id": ObjectId(homework_id)}, _HW_PROJECTION)
+    except Exception:
+        return None
+    if not hw:
+        return None
+
+    docs = {d["class_id"]: d async for d in homework_stats_collection.find({"homework_id": homework_id})}
+    if ALL not in docs:
+        # Never counted (e.g. created before counters existed)
+        await recount(homework_id)
+        docs = {d["class_id"]: d async for d in homework_stats_collection.find({"homework_id": homework_id})}
+
+    empty = dict.fromkeys(COUNTERS, 0)
+    classrooms = []
+    for class_id in await assignments.homework_class_ids(hw):
+        doc = docs.get(class_id) or {}
+        classrooms.append({
+            "class_id": class_id,
+            "enrolled": await class_memberships_collection.count_documents({"class_id": class_id}),
+            "counts": {**empty, **(doc.get("counts") or {})},
+            "updated_at": doc.get("updated_at"),
+        })
+    overall = docs.get(ALL) or {}
+    return {
+        "homework_id": homework_id,
+        "counts": {**empty, **(overall.get("counts") or {})},
+        "updated_at": overall.get("updated_at"),
+        "classrooms": classrooms,
+    }
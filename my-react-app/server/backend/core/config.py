@@ -0,0 +1,93 @@
+from pathlib import Path
+from decouple import config
+
+# ===== Logging =====
+# DEBUG enables per-request diagnostics (e.g. homework assignment checks)
+LOG_LEVEL = config("LOG_LEVEL", default="INFO").upper()
+
+# ===== Uploads =====
+UPLOAD_ROOT = Path(config("UPLOAD_ROOT", default="uploads"))
+# In-progress (resumable) uploads live outside the public /uploads mount.
+UPLOAD_TMP_ROOT = Path(config("UPLOAD_TMP_ROOT", default="uploads_tmp"))
+UPLOAD_CHUNK_SIZE = config("UPLOAD_CHUNK_SIZE", default=1024 * 1024, cast=int)
+MAX_UPLOAD_SIZE = config("MAX_UPLOAD_SIZE", default=512 * 1024 * 1024, cast=int)
+# Resumable uploads untouched this long expire with their temp file; the
+# sweeper that removes them runs this often
+UPLOAD_SESSION_TTL_HOURS = config("UPLOAD_SESSION_TTL_HOURS", default=24, cast=float)
+UPLOAD_SWEEP_SECONDS = config("UPLOAD_SWEEP_SECONDS", default=3600, cast=float)
+
+# ===== Storage =====
+# Origin used when building absolute URLs for uploads and API media.
+PUBLIC_BASE_URL = config("PUBLIC_BASE_URL", default="http://127.0.0.1:8000").rstrip("/")
+# "local" keeps files under UPLOAD_ROOT; "s3" uses any S3-compatible store (AWS, MinIO).
+STORAGE_BACKEND = config("STORAGE_BACKEND", default="local").lower()
+S3_BUCKET = config("S3_BUCKET", default="")
+S3_ENDPOINT_URL = config("S3_ENDPOINT_URL", default="") or None
+S3_REGION = config("S3_REGION", default="") or None
+S3_ACCESS_KEY_ID = config("S3_ACCESS_KEY_ID", default="") or None
+S3_SECRET_ACCESS_KEY = config("S3_SECRET_ACCESS_KEY", default="") or None
+# Public (e.g. CDN) origin for the bucket; unset means objects go through /uploads.
+S3_PUBLIC_BASE_URL = config("S3_PUBLIC_BASE_URL", default="") or None
+S3_PRESIGN_EXPIRES = config("S3_PRESIGN_EXPIRES", default=3600, cast=int)
+
+# ===== Caching =====
+# Seconds a case's homework bundle (case + homework + qna + annot) is reused
+CASE_BUNDLE_TTL = config("CASE_BUNDLE_TTL", default=60, cast=float)
+# Upper bound on how long homework analytics are reused; any submission
+# change invalidates them sooner
+ANALYTICS_CACHE_TTL = config("ANALYTICS_CACHE_TTL", default=600, cast=float)
+# Forum author name/photo cards; profile updates invalidate them locally,
+# other workers pick changes up within the TTL
+USER_CARD_CACHE_TTL = config("USER_CARD_CACHE_TTL", default=300, cast=float)
+USER_CARD_CACHE_SIZE = config("USER_CARD_CACHE_SIZE", default=10000, cast=int)
+# Trending forum tags: decay-weighted thread counts over the last
+# TRENDING_TAGS_WINDOW_DAYS, halving every TRENDING_TAGS_HALF_LIFE_DAYS;
+# the in-process snapshot is refreshed in the background this often
+TRENDING_TAGS_WINDOW_DAYS = config("TRENDING_TAGS_WINDOW_DAYS", default=7, cast=int)
+TRENDING_TAGS_HALF_LIFE_DAYS = config("TRENDING_TAGS_HALF_LIFE_DAYS", default=2, cast=float)
+FORUM_TAGS_REFRESH_SECONDS = config("FORUM_TAGS_REFRESH_SECONDS", default=60, cast=float)
+# Each worker rebuilds its forum/case search index this often, picking up
+# writes made by other workers (its own are indexed right away)
+SEARCH_REBUILD_SECONDS = config("SEARCH_REBUILD_SECONDS", default=900, cast=float)
+# Live forum events (SSE): kept this long for clients resuming with
+# Last-Event-ID; each worker checks for other workers' events this often
+FORUM_EVENTS_RETENTION_HOURS = config("FORUM_EVENTS_RETENTION_HOURS", default=24, cast=float)
+FORUM_EVENTS_POLL_SECONDS = config("FORUM_EVENTS_POLL_SECONDS", default=1, cast=float)
+FORUM_EVENTS_HEARTBEAT_SECONDS = config("FORUM_EVENTS_HEARTBEAT_SECONDS", default=15, cast=float)
+# Seconds a request's result is replayed for a repeated Idempotency-Key
+IDEMPOTENCY_TTL = config("IDEMPOTENCY_TTL", default=600, cast=float)
+
+# ===== Homework deadlines =====
+# "Due soon" notification lead time; 0 disables reminders
+HOMEWORK_REMINDER_LEAD_HOURS = config("HOMEWORK_REMINDER_LEAD_HOURS", default=24, cast=float)
+
+# ===== Draft autosave =====
+# Autosave patches are written once the student pauses this many seconds,
+# and never later than DRAFT_SAVE_MAX_DELAY after the first unsaved one
+DRAFT_SAVE_DEBOUNCE = config("DRAFT_SAVE_DEBOUNCE", default=2, cast=float)
+DRAFT_SAVE_MAX_DELAY = config("DRAFT_SAVE_MAX_DELAY", default=10, cast=float)
+
+# ===== Auto-grading =====
+# Similarity (0-1) at which a short answer counts as a typo of the key
+AUTO_GRADE_FUZZY_THRESHOLD = config("AUTO_GRADE_FUZZY_THRESHOLD", default=0.85, cast=float)
+# Estimated Jaccard similarity (0-1) at which two free-text answers are
+# reported as near-duplicates; answers under SIMILARITY_MIN_TOKENS words
+# are too short to judge
+SIMILARITY_THRESHOLD = config("SIMILARITY_THRESHOLD", default=0.7, cast=float)
+SIMILARITY_MIN_TOKENS = config("SIMILARITY_MIN_TOKENS", default=8, cast=int)
+# Bulk grade/publish/return batches larger than this run as background jobs
+BULK_SYNC_LIMIT = config("BULK_SYNC_LIMIT", default=500, cast=int)
+# Running background jobs renew a lease this often; one whose lease is
+# JOB_LEASE_SECONDS old lost its worker and is marked interrupted
+JOB_HEARTBEAT_SECONDS = config("JOB_HEARTBEAT_SECONDS", default=15, cast=float)
+JOB_LEASE_SECONDS = config("JOB_LEASE_SECONDS", default=60, cast=float)
+
+# ===== Exports =====
+# Finished submission archives, reused (with range support) until the
+# homework's files change
+EXPORT_CACHE_ROOT = Path(config("EXPORT_CACHE_ROOT", default="export_cache"))
+
+# ===== DICOM =====
+DICOM_CACHE_ROOT = Path(config("DICOM_CACHE_ROOT", default="dicom_cache"))
+DICOM_WORKERS = config("DICOM_WORKERS", default=2, cast=int)
+DICOM_FRAME_CACHE_SIZE = config("DICOM_FRAME_CACHE_SIZE", default=256, cast=int)
@@ -0,0 +1,376 @@
+import asyncio
+import io
+import json
+import multiprocessing
+import os
+import re
+import shutil
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+
+from fastapi import HTTPException
+
+from core.cache import TTLCache
+from core.config import DICOM_CACHE_ROOT, DICOM_WORKERS, DICOM_FRAME_CACHE_SIZE, PUBLIC_BASE_URL
+from core.storage import storage
+from db.connection import dicom_studies_collection, blobs_collection
+
+DICOM_EXTS = {".dcm", ".dicom"}
+DICOM_CONTENT_TYPES = {"application/dicom", "application/dicom+octet-stream"}
+
+# Common CT window/level presets as (center, width) in Hounsfield units.
+# "default" comes from the file's own WindowCenter/WindowWidth.
+CT_WINDOW_PRESETS = {
+    "soft_tissue": (40, 400),
+    "lung": (-600, 1500),
+    "bone": (400, 1800),
+    "brain": (40, 80),
+}
+
+_pool: Optional[ProcessPoolExecutor] = None
+_ingesting: Dict[str, asyncio.Future] = {}
+
+# (sha256, frame, (center, width)) -> PNG bytes
+_frame_cache = TTLCache(maxsize=DICOM_FRAME_CACHE_SIZE)
+_meta_cache = TTLCache(maxsize=512)
+
+
+def _require_imaging():
+    try:
+        import numpy  # noqa: F401
+        import pydicom  # noqa: F401
+        from PIL import Image  # noqa: F401
+    except ImportError:
+        raise HTTPException(
+            status_code=501,
+            detail="DICOM support requires numpy, pydicom and Pillow on the server",
+        )
+
+
+def get_pool() -> ProcessPoolExecutor:
+    global _pool
+    if _pool is None:
+        # spawn: never fork the event loop / Mongo client into workers
+        _pool = ProcessPoolExecutor(
+            max_workers=DICOM_WORKERS,
+            mp_context=multiprocessing.get_context("spawn"),
+        )
+    return _pool
+
+
+def shutdown_pool():
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
+
+
+def looks_like_dicom(head: bytes, filename: Optional[str] = None, content_type: Optional[str] = None) -> bool:
+    """Part 10 files carry "DICM" after a 128-byte preamble."""
+    if content_type in DICOM_CONTENT_TYPES:
+        return True
+    if head[128:132] == b"DICM":
+        return True
+    ext = os.path.splitext(filename or "")[1].lower()
+    return ext in DICOM_EXTS
+
+
+STUDY_DIR_RE = re.compile(r"^[0-9a-f]{64}$")
+
+
+def study_dir(sha256: str) -> Path:
+    return DICOM_CACHE_ROOT / sha256
+
+
+def frame_url(sha256: str, frame: int = 0, window: str = "default") -> str:
+    return f"{PUBLIC_BASE_URL}/api/dicom/{sha256}/frames/{frame}.png?window={window}"
+
+
+# ====================================================
+# Worker-side helpers (run in the process / thread pool)
+# ====================================================
+
+def _first_value(value) -> Optional[float]:
+    if value is None:
+        return None
+    try:
+        if hasattr(value, "__iter__") and not isinstance(value, (str, bytes)):
+            value = list(value)[0]
+        return float(value)
+    except (TypeError, ValueError, IndexError):
+        return None
+
+
+def _to_png(pixels, center: Optional[float], width: Optional[float], invert: bool) -> bytes:
+    import numpy as np
+    from PIL import Image
+
+    if pixels.ndim == 3:
+        # Colour (RGB) data is already display-ready
+        img = np.clip(pixels, 0, 255).astype(np.uint8)
+    else:
+        data = np.asarray(pixels, dtype=np.float32)
+        if center is None or width is None or width <= 0:
+            lo, hi = np.percentile(data, (0.5, 99.5))
+        else:
+            lo, hi = center - width / 2.0, center + width / 2.0
+        scale = 255.0 / max(hi - lo, 1e-6)
+        img = np.clip((data - lo) * scale, 0, 255).astype(np.uint8)
+        if invert:
+            img = 255 - img
+
+    buf = io.BytesIO()
+    Image.fromarray(img).save(buf, format="PNG", compress_level=3)
+    return buf.getvalue()
+
+
+def ingest_study(src: str, out_dir: str) -> dict:
+    """
+    Decode a DICOM file once: save the modality-LUT-applied stack as an
+    .npy (memory-mapped on later reads) and pre-render frame 0 for every
+    applicable window preset. Runs in the process pool.
+    """
+    import numpy as np
+    import pydicom
+
+    try:
+        from pydicom.pixels import apply_modality_lut
+    except ImportError:  # pydicom < 3
+        from pydicom.pixel_data_handlers.util import apply_modality_lut
+
+    out = Path(out_dir)
+    out.mkdir(parents=True, exist_ok=True)
+
+    ds = pydicom.dcmread(src)
+    arr = ds.pixel_array
+    frames = int(getattr(ds, "NumberOfFrames", 1) or 1)
+    samples = int(getattr(ds, "SamplesPerPixel", 1) or 1)
+    if frames == 1:
+        arr = arr[np.newaxis, ...]
+
+    if samples == 1:
+        arr = apply_modality_lut(arr, ds).astype(np.float32)
+
+    tmp_stack = out / "stack.tmp.npy"
+    np.save(tmp_stack, arr)
+    os.replace(tmp_stack, out / "stack.npy")
+
+    modality = str(getattr(ds, "Modality", "") or "")
+    invert = str(getattr(ds, "PhotometricInterpretation", "")) == "MONOCHROME1"
+    center = _first_value(getattr(ds, "WindowCenter", None))
+    width = _first_value(getattr(ds, "WindowWidth", None))
+    if samples == 1 and (center is None or width is None):
+        lo, hi = np.percentile(arr[0], (0.5, 99.5))
+        center, width = float((lo + hi) / 2.0), float(max(hi - lo, 1.0))
+
+    presets = {"default": [center, width]}
+    if modality == "CT" and samples == 1:
+        presets.update({name: list(cw) for name, cw in CT_WINDOW_PRESETS.items()})
+
+    for name, (c, w) in presets.items():
+        (out / f"preview_{name}.png").write_bytes(_to_png(arr[0], c, w, invert))
+
+    meta = {
+        "frames": int(arr.shape[0]),
+        "rows": int(arr.shape[1]),
+        "columns": int(arr.shape[2]),
+        "samples_per_pixel": samples,
+        "modality": modality,
+        "invert": invert,
+        "presets": presets,
+    }
+    (out / "meta.json").write_text(json.dumps(meta))
+    return meta
+
+
+def render_frame(stack_path: str, frame: int, center, width, invert: bool) -> bytes:
+    import numpy as np
+
+    stack = np.load(stack_path, mmap_mode="r")
+    return _to_png(np.asarray(stack[frame]), center, width, invert)
+
+
+# ====================================================
+# Async API
+# ====================================================
+
+async def _source_path(sha256: str) -> Path:
+    """Local path of the study's blob, downloading it when storage is remote."""
+    blob = await blobs_collection.find_one({"_id": sha256})
+    if not blob:
+        raise HTTPException(status_code=404, detail="DICOM study not found")
+    path = storage.local_path(blob["key"])
+    if path is None:
+        path = study_dir(sha256) / "source.dcm"
+        if not path.exists():
+            await storage.fetch_to(blob["key"], path)
+    return path
+
+
+async def _read_head(key: str, size: int = 132) -> bytes:
+    head = b""
+    async for chunk in storage.iter_bytes(key, 0, size - 1):
+        head += chunk
+    return head[:size]
+
+
+async def ingest(sha256: str, src: Optional[Path] = None) -> dict:
+    """
+    Parse a stored DICOM blob in the worker pool (once per content hash)
+    and record its metadata. Concurrent calls for the same study share
+    one decode.
+    """
+    _require_imaging()
+
+    existing = await get_study(sha256, ensure_decoded=False)
+    if existing and (study_dir(sha256) / "stack.npy").exists():
+        return existing
+
+    pending = _ingesting.get(sha256)
+    if pending:
+        return await asyncio.shield(pending)
+
+    loop = asyncio.get_running_loop()
+    future = loop.create_future()
+    _ingesting[sha256] = future
+    try:
+        src = src or await _source_path(sha256)
+        try:
+            meta = await loop.run_in_executor(
+                get_pool(), ingest_study, str(src.resolve()), str(study_dir(sha256).resolve())
+            )
+        except HTTPException:
+            raise
+        except Exception as e:
+            raise HTTPException(status_code=400, detail=f"Could not decode DICOM pixel data: {e}")
+
+        meta["_id"] = sha256
+        await dicom_studies_collection.replace_one({"_id": sha256}, meta, upsert=True)
+        _meta_cache.set(sha256, meta)
+        future.set_result(meta)
+        return meta
+    except Exception as e:
+        future.set_exception(e)
+        # Nobody else may be awaiting; mark the exception as retrieved.
+        future.exception()
+        raise
+    finally:
+        if not future.done():
+            future.cancel()
+        _ingesting.pop(sha256, None)
+
+
+async def drop_study(sha256: str):
+    """Forget a study whose blob is gone: metadata, cached renders and the decoded stack."""
+    _meta_cache.pop(sha256)
+    for key in _frame_cache.keys():
+        if key[0] == sha256:
+            _frame_cache.pop(key)
+    await dicom_studies_collection.delete_one({"_id": sha256})
+    await asyncio.to_thread(shutil.rmtree, study_dir(sha256), True)
+
+
+async def sweep_orphaned_studies() -> int:
+    """
+    Drop studies whose blob no longer exists (run at startup). Cache dirs
+    are per node, so one left behind on another node by a release there is
+    removed here.
+    """
+    shas = set(await dicom_studies_collection.distinct("_id"))
+    if DICOM_CACHE_ROOT.is_dir():
+        shas.update(p.name for p in DICOM_CACHE_ROOT.iterdir() if p.is_dir() and STUDY_DIR_RE.match(p.name))
+    if not shas:
+        return 0
+    live = set(await blobs_collection.distinct("_id", {"_id": {"$in": list(shas)}}))
+    orphans = shas - live
+    for sha256 in orphans:
+        await drop_study(sha256)
+    return len(orphans)
+
+
+async def get_study(sha256: str, ensure_decoded: bool = True) -> Optional[dict]:
+    meta = _meta_cache.get(sha256)
+    if meta is None:
+        meta = await dicom_studies_collection.find_one({"_id": sha256})
+        if meta:
+            _meta_cache.set(sha256, meta)
+    if meta and ensure_decoded and not (study_dir(sha256) / "stack.npy").exists():
+        # Cache dir is local to this node; rebuild it from the stored blob.
+        meta = await ingest(sha256)
+    return meta
+
+
+def resolve_window(meta: dict, window: Optional[str], center: Optional[float], width: Optional[float]) -> Tuple:
+    if center is not None and width is not None:
+        return round(center, 1), round(width, 1)
+    presets = meta.get("presets") or {}
+    name = window or "default"
+    if name not in presets:
+        raise HTTPException(status_code=400, detail=f"Unknown window preset: {name}")
+    c, w = presets[name]
+    return c, w
+
+
+async def frame_png(sha256: str, frame: int, window_cw: Tuple) -> bytes:
+    """Render one frame lazily; results are kept in an LRU cache."""
+    key = (sha256, frame, tuple(window_cw))
+    cached = _frame_cache.get(key)
+    if cached is not None:
+        return cached
+
+    meta = await get_study(sha256)
+    if not meta:
+        raise HTTPException(status_code=404, detail="DICOM study not found")
+    if frame < 0 or frame >= meta["frames"]:
+        raise HTTPException(status_code=404, detail="Frame out of range")
+
+    png = None
+    if frame == 0:
+        for name, cw in (meta.get("presets") or {}).items():
+            if tuple(cw) == tuple(window_cw):
+                preview = study_dir(sha256) / f"preview_{name}.png"
+                png = await asyncio.to_thread(_read_if_exists, preview)
+                break
+
+    if png is None:
+        _require_imaging()
+        png = await asyncio.to_thread(
+            render_frame,
+            str(study_dir(sha256) / "stack.npy"),
+            frame,
+            window_cw[0],
+            window_cw[1],
+            bool(meta.get("invert")),
+        )
+
+    _frame_cache.set(key, png)
+    return png
+
+
+def _read_if_exists(path: Path) -> Optional[bytes]:
+    try:
+        return path.read_bytes()
+    except FileNotFoundError:
+        return None
+
+
+def study_summary(sha256: str, meta: dict) -> dict:
+    return {
+        "sha256": sha256,
+        "frames": meta.get("frames"),
+        "rows": meta.get("rows"),
+        "columns": meta.get("columns"),
+        "modality": meta.get("modality"),
+        "presets": sorted((meta.get("presets") or {}).keys()),
+        "preview_urls": {name: frame_url(sha256, 0, name) for name in (meta.get("presets") or {})},
+    }
+
+
+async def ingest_blob_if_dicom(blob: dict, filename: Optional[str] = None) -> Optional[dict]:
+    """Ingest a freshly stored blob when it is a DICOM file; None otherwise."""
+    head = await _read_head(blob["key"])
+    if not looks_like_dicom(head, filename, blob.get("content_type")):
+        return None
+    meta = await ingest(blob["sha256"])
+    return study_summary(blob["sha256"], meta)
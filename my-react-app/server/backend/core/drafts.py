@@ -0,0 +1,261 @@
+import asyncio
+import logging
+import time
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+from bson import ObjectId
+from fastapi import HTTPException
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+from core.blobstore import blob_refs, release_refs
+from core.cache import TTLCache
+from core.case_bundles import load_case_bundle
+from core.config import DRAFT_SAVE_DEBOUNCE, DRAFT_SAVE_MAX_DELAY
+from core.scheduler import is_past_due
+from db.connection import submissions_collection
+
+logger = logging.getLogger(__name__)
+
+Key = Tuple[str, str]
+
+# Drafts keep `answers` positional: answers[i] is {"index": i, "value": ...}
+# for question i, so one answer is patched with `$set answers.<i>.value`
+# instead of rewriting the whole array.
+
+
+def positional_answers(answers: Optional[list], total: int) -> List[dict]:
+    by_index = {}
+    for item in answers or []:
+        if isinstance(item, dict) and isinstance(item.get("index"), int):
+            by_index[item["index"]] = item.get("value")
+    return [{"index": i, "value": by_index.get(i)} for i in range(total)]
+
+
+def _is_positional(answers, total: int) -> bool:
+    return (
+        isinstance(answers, list)
+        and len(answers) == total
+        and all(isinstance(a, dict) and a.get("index") == i for i, a in enumerate(answers))
+    )
+
+
+def _conflict(detail: str, revision: Optional[int] = None):
+    raise HTTPException(status_code=409, detail={"message": detail, "revision": revision})
+
+
+@dataclass
+class _Draft:
+    submission_id: ObjectId
+    revision: int                       # revision stored in MongoDB
+    total_questions: int
+    homework: dict
+    sets: Dict[str, object] = field(default_factory=dict)
+    count: int = 0                      # patches merged into `sets`
+    first_at: Optional[float] = None
+    timer: Optional[asyncio.TimerHandle] = None
+    lock: asyncio.Lock = field(default_factory=asyncio.Lock)
+    closed: bool = False
+
+    @property
+    def logical_revision(self) -> int:
+        return self.revision + self.count
+
+
+class DraftAutosaver:
+    """
+    Coalesces autosave patches per (homework, user). Patches are merged in
+    memory and written as one targeted update when the student pauses for
+    DRAFT_SAVE_DEBOUNCE seconds (at most DRAFT_SAVE_MAX_DELAY after the
+    first unsaved patch). Every accepted patch bumps the revision by one;
+    a patch based on an older revision is rejected with 409.
+    """
+
+    def __init__(self):
+        self._drafts: Dict[Key, _Draft] = {}
+        # Flushes that lost a race (another process, or the deadline),
+        # reported to the next patch from that student
+        self._conflicts = TTLCache(maxsize=1024, ttl=600)
+
+    # -------- opening --------
+
+    async def _open(self, hw: dict, case_id: str, user_id: str) -> _Draft:
+        homework_id = str(hw["_id"])
+        bundle = await load_case_bundle(str(hw.get("case_id") or case_id))
+        total = 0
+        if hw.get("homework_type") == "Q&A":
+            total = len((bundle.get("qna") or {}).get("questions") or [])
+        timestamp = datetime.utcnow()
+
+        try:
+            doc = await submissions_collection.find_one_and_update(
+                {"homework_id": homework_id, "user_id": user_id},
+                {"$setOnInsert": {
+                    "case_id": case_id,
+                    "status": "draft",
+                    "revision": 0,
+                    "notes": None,
+                    "files": [],
+                    "answers": positional_answers([], total),
+                    "created_at": timestamp,
+                    "updated_at": timestamp,
+                }},
+                upsert=True,
+                return_document=ReturnDocument.AFTER,
+            )
+        except DuplicateKeyError:
+            doc = await submissions_collection.find_one({"homework_id": homework_id, "user_id": user_id})
+
+        if doc.get("frozen"):
+            _conflict("Draft is frozen", doc.get("revision"))
+        if doc.get("status", "submitted") != "draft":
+            _conflict("Submission already submitted", doc.get("revision"))
+
+        # The question list changed since the draft was started
+        if not _is_positional(doc.get("answers"), total):
+            doc = await submissions_collection.find_one_and_update(
+                {"_id": doc["_id"], "revision": doc.get("revision")},
+                {"$set": {"answers": positional_answers(doc.get("answers"), total)}},
+                return_document=ReturnDocument.AFTER,
+            )
+            if doc is None:
+                _conflict("Draft changed, reload it")
+
+        return _Draft(doc["_id"], doc["revision"], total, hw)
+
+    # -------- patching --------
+
+    async def patch(
+        self,
+        hw: dict,
+        case_id: str,
+        user_id: str,
+        *,
+        base_revision: Optional[int],
+        notes=None,
+        files: Optional[list] = None,
+        answers: Optional[list] = None,
+    ) -> dict:
+        key = (str(hw["_id"]), user_id)
+
+        lost = self._conflicts.pop(key)
+        if lost is not None:
+            _conflict("Unsaved changes were rejected, reload the draft", lost)
+
+        while True:
+            draft = self._drafts.get(key)
+            if draft is None:
+                draft = await self._open(hw, case_id, user_id)
+                draft = self._drafts.setdefault(key, draft)
+            async with draft.lock:
+                if draft.closed:
+                    # Flushed while we waited; start from the stored revision
+                    continue
+                return self._merge(key, draft, base_revision, notes, files, answers)
+
+    def _merge(self, key: Key, draft: _Draft, base_revision, notes, files, answers) -> dict:
+        if is_past_due(draft.homework):
+            raise HTTPException(status_code=400, detail="Deadline passed")
+        if base_revision is not None and base_revision != draft.logical_revision:
+            _conflict("Draft was saved from somewhere else", draft.logical_revision)
+
+        sets = {}
+        if notes is not None:
+            sets["notes"] = notes
+        if files is not None:
+            sets["files"] = files
+        for item in answers or []:
+            if not 0 <= item["index"] < draft.total_questions:
+                raise HTTPException(status_code=400, detail=f"Unknown question index {item['index']}")
+            sets[f"answers.{item['index']}.value"] = item["value"]
+        if not sets:
+            return {"submission_id": str(draft.submission_id), "revision": draft.logical_revision, "pending": draft.count > 0}
+
+        draft.sets.update(sets)
+        draft.count += 1
+        self._schedule(key, draft)
+        return {"submission_id": str(draft.submission_id), "revision": draft.logical_revision, "pending": True}
+
+    def _schedule(self, key: Key, draft: _Draft):
+        now = time.monotonic()
+        if draft.first_at is None:
+            draft.first_at = now
+        if draft.timer:
+            draft.timer.cancel()
+        delay = min(DRAFT_SAVE_DEBOUNCE, max(draft.first_at + DRAFT_SAVE_MAX_DELAY - now, 0))
+        loop = asyncio.get_running_loop()
+        draft.timer = loop.call_later(delay, lambda: loop.create_task(self._flush_logged(key)))
+
+    # -------- flushing --------
+
+    async def flush(self, key: Key) -> Optional[int]:
+        """Write pending patches now; returns the stored revision (None if nothing is open)."""
+        draft = self._drafts.get(key)
+        if draft is None:
+            return None
+        async with draft.lock:
+            if draft.closed:
+                return None
+            if draft.timer:
+                draft.timer.cancel()
+            try:
+                return await self._write(key, draft)
+            finally:
+                # Patches waiting on the lock reopen from the stored document
+                draft.closed = True
+                self._drafts.pop(key, None)
+
+    async def _write(self, key: Key, draft: _Draft) -> Optional[int]:
+        if not draft.count:
+            return draft.revision
+        before = await submissions_collection.find_one_and_update(
+            {
+                "_id": draft.submission_id,
+                "revision": draft.revision,
+                "status": "draft",
+                "frozen": {"$ne": True},
+            },
+            {
+                "$set": {**draft.sets, "updated_at": datetime.utcnow()},
+                "$inc": {"revision": draft.count},
+            },
+            projection={"files": 1},
+        )
+        if before is None:
+            logger.warning("draft %s: %d unsaved patches rejected", draft.submission_id, draft.count)
+            self._conflicts.set(key, draft.revision)
+            return None
+        if "files" in draft.sets:
+            # Files dropped from the list give up the reference their upload took
+            await release_refs(blob_refs(before.get("files")) - blob_refs(draft.sets["files"]))
+        return draft.logical_revision
+
+    async def _flush_logged(self, key: Key):
+        try:
+            await self.flush(key)
+        except Exception:
+            logger.exception("draft %s/%s: flush failed", *key)
+
+    def discard(self, key: Key):
+        """Drop pending patches, e.g. when a full submission replaces the draft."""
+        draft = self._drafts.pop(key, None)
+        if draft:
+            draft.closed = True
+            if draft.timer:
+                draft.timer.cancel()
+        self._conflicts.pop(key)
+
+    def discard_homework(self, homework_id):
+        """Drop the pending patches of every student of a deleted homework."""
+        homework_id = str(homework_id)
+        for key in [k for k in self._drafts if k[0] == homework_id]:
+            self.discard(key)
+
+    async def flush_all(self):
+        for key in list(self._drafts):
+            await self._flush_logged(key)
+
+
+drafts = DraftAutosaver()
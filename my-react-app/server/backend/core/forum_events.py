@@ -0,0 +1,218 @@
+import asyncio
+import json
+import logging
+from datetime import datetime, timedelta
+from typing import AsyncIterator, Iterable, Optional, Set
+
+from pymongo import ReturnDocument
+
+from core.config import FORUM_EVENTS_HEARTBEAT_SECONDS, FORUM_EVENTS_POLL_SECONDS
+from db.connection import counters_collection, forum_events_collection
+
+logger = logging.getLogger(__name__)
+
+# Forum changes as a numbered log, pushed to clients over server-sent events:
+#   forum_events: {"_id": <seq>, "type", "thread_id", "data", "at"}
+# Sequence numbers come from one counter document, so they are ordered
+# across workers and double as SSE event ids: a client reconnecting with
+# Last-Event-ID is replayed what it missed, for as long as the TTL index
+# (FORUM_EVENTS_RETENTION_HOURS) keeps it.
+
+EVENT_THREAD_CREATED = "thread_created"
+EVENT_REPLY_ADDED = "reply_added"
+# Sent instead of a replay the log no longer covers; refetch the listing
+EVENT_RESET = "reset"
+
+COUNTER_ID = "forum_events"
+POLL_BATCH = 500
+# A subscriber this far behind is disconnected; it resumes from the log
+QUEUE_SIZE = 1000
+# How long a skipped sequence number may still be in flight from another
+# worker (allocated, not yet inserted) before it is given up on
+GAP_GRACE = timedelta(seconds=5)
+RETRY_MS = 3000
+
+
+async def publish(event_type: str, data: dict, thread_id=None) -> Optional[int]:
+    """
+    Append an event to the log. The write it describes has already
+    happened, so a failure here is logged rather than raised.
+    """
+    try:
+        counter = await counters_collection.find_one_and_update(
+            {"_id": COUNTER_ID},
+            {"$inc": {"seq": 1}},
+            upsert=True,
+            return_document=ReturnDocument.AFTER,
+        )
+        seq = counter["seq"]
+        await forum_events_collection.insert_one({
+            "_id": seq,
+            "type": event_type,
+            "thread_id": str(thread_id) if thread_id else None,
+            "data": data,
+            "at": datetime.utcnow(),
+        })
+    except Exception:
+        logger.exception("could not publish forum %s event", event_type)
+        return None
+    broker.wake()
+    return seq
+
+
+class Subscription:
+    def __init__(self, threads: Optional[Set[str]], start: int):
+        # None: every thread's replies
+        self.threads = threads
+        # Last sequence number the broker had delivered when this subscribed
+        self.start = start
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=QUEUE_SIZE)
+
+    def wants(self, event: dict) -> bool:
+        if event["type"] != EVENT_REPLY_ADDED or self.threads is None:
+            return True
+        return event.get("thread_id") in self.threads
+
+
+class ForumEventBroker:
+    """
+    One poller per process tails forum_events and fans events out to the
+    local SSE subscribers, so the database sees one query per poll however
+    many clients are connected. Local publishes wake it right away; it only
+    runs while someone is subscribed.
+    """
+
+    def __init__(self, poll_seconds: float):
+        self.poll_seconds = poll_seconds
+        self._subscribers: Set[Subscription] = set()
+        self._last = 0
+        self._wakeup = asyncio.Event()
+        self._lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+
+    def wake(self):
+        self._wakeup.set()
+
+    async def subscribe(self, threads: Optional[Iterable[str]] = None) -> Subscription:
+        async with self._lock:
+            if self._task is None:
+                latest = await forum_events_collection.find_one({}, {"_id": 1}, sort=[("_id", -1)])
+                self._last = latest["_id"] if latest else 0
+                self._task = asyncio.create_task(self._run())
+            sub = Subscription({str(t) for t in threads} if threads else None, self._last)
+            self._subscribers.add(sub)
+            return sub
+
+    def unsubscribe(self, sub: Subscription):
+        self._subscribers.discard(sub)
+
+    async def stop(self):
+        for sub in list(self._subscribers):
+            self._close(sub)
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def _close(self, sub: Subscription):
+        self._subscribers.discard(sub)
+        # Make room for the end-of-stream marker
+        while not sub.queue.empty():
+            sub.queue.get_nowait()
+        sub.queue.put_nowait(None)
+
+    def _deliver(self, event: dict):
+        for sub in list(self._subscribers):
+            if not sub.wants(event):
+                continue
+            if sub.queue.qsize() >= QUEUE_SIZE - 1:
+                self._close(sub)
+            else:
+                sub.queue.put_nowait(event)
+
+    async def _poll(self) -> int:
+        events = await forum_events_collection.find(
+            {"_id": {"$gt": self._last}}
+        ).sort("_id", 1).limit(POLL_BATCH).to_list(POLL_BATCH)
+        now = datetime.utcnow()
+        delivered = 0
+        for event in events:
+            if event["_id"] != self._last + 1 and now - event["at"] < GAP_GRACE:
+                # Another worker has taken an earlier number but not
+                # written its event yet; keep the order and look again
+                break
+            self._last = event["_id"]
+            self._deliver(event)
+            delivered += 1
+        return delivered
+
+    async def _run(self):
+        try:
+            while self._subscribers:
+                self._wakeup.clear()
+                try:
+                    if await self._poll() == POLL_BATCH:
+                        continue
+                except Exception:
+                    logger.exception("forum event poll failed")
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), self.poll_seconds)
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            if self._task is asyncio.current_task():
+                self._task = None
+
+
+def _format(event: dict) -> str:
+    payload = json.dumps({"type": event["type"], **event["data"]}, default=str)
+    return f"id: {event['_id']}\nevent: {event['type']}\ndata: {payload}\n\n"
+
+
+async def _replay(sub: Subscription, after: int) -> AsyncIterator[dict]:
+    query = {"_id": {"$gt": after, "$lte": sub.start}}
+    if sub.threads is not None:
+        query["$or"] = [{"type": {"$ne": EVENT_REPLY_ADDED}}, {"thread_id": {"$in": sorted(sub.threads)}}]
+    async for event in forum_events_collection.find(query).sort("_id", 1):
+        yield event
+
+
+async def stream(sub: Subscription, after: Optional[int], is_disconnected) -> AsyncIterator[str]:
+    """
+    The SSE body of one subscription: a replay of the events after
+    `after` (the client's Last-Event-ID), then live events, with comment
+    heartbeats so proxies keep the connection open.
+    """
+    try:
+        yield f"retry: {RETRY_MS}\n\n"
+        replayed = set()
+        if after is not None and after < sub.start:
+            oldest = await forum_events_collection.find_one({}, {"_id": 1}, sort=[("_id", 1)])
+            if oldest is None or oldest["_id"] > after + 1:
+                yield _format({"_id": sub.start, "type": EVENT_RESET, "data": {"reason": "expired"}})
+            else:
+                async for event in _replay(sub, after):
+                    replayed.add(event["_id"])
+                    yield _format(event)
+
+        while True:
+            try:
+                event = await asyncio.wait_for(sub.queue.get(), FORUM_EVENTS_HEARTBEAT_SECONDS)
+            except asyncio.TimeoutError:
+                if await is_disconnected():
+                    return
+                yield ": keep-alive\n\n"
+                continue
+            if event is None:
+                return
+            if event["_id"] in replayed or (after is not None and event["_id"] <= after):
+                continue
+            yield _format(event)
+    finally:
+        broker.unsubscribe(sub)
+
+
+broker = ForumEventBroker(FORUM_EVENTS_POLL_SECONDS)
@@ -0,0 +1,161 @@
+import asyncio
+import hashlib
+import logging
+from datetime import datetime
+from typing import Dict, Iterable, List
+
+from bson import ObjectId
+from pymongo import ReplaceOne
+
+from db.connection import forum_collection, forum_replies_collection
+from db.transactions import run_in_transaction
+
+logger = logging.getLogger(__name__)
+
+# Replies live in forum_replies, one document each:
+#   {"_id": <reply id>, "thread_id": "<thread id>", "author", "role",
+#    "content", "timestamp"}
+# and the thread keeps only `reply_count` and a `last_reply` summary, so a
+# reply is a small insert instead of a rewrite of an ever-growing thread.
+
+MIGRATION_BATCH_SIZE = 200
+EXCERPT_LENGTH = 200
+# Replies are always read oldest first within a thread
+ORDER = [("timestamp", 1), ("_id", 1)]
+
+
+def to_api(doc: dict) -> dict:
+    """Stored reply -> the shape replies had when embedded in threads."""
+    reply = {k: v for k, v in doc.items() if k not in ("_id", "thread_id")}
+    reply["id"] = str(doc["_id"])
+    return reply
+
+
+def summary(doc: dict) -> dict:
+    """The thread's `last_reply`."""
+    content = doc.get("content") or ""
+    return {
+        "id": str(doc["_id"]),
+        "author": doc.get("author"),
+        "excerpt": content[:EXCERPT_LENGTH],
+        "timestamp": doc.get("timestamp"),
+    }
+
+
+async def add_reply(thread_oid: ObjectId, reply: dict) -> dict:
+    """Store a reply and bump the thread's counters together (one transaction where supported)."""
+    doc = {
+        **{k: v for k, v in reply.items() if k != "id"},
+        "_id": ObjectId(reply["id"]) if ObjectId.is_valid(reply.get("id")) else ObjectId(),
+        "thread_id": str(thread_oid),
+    }
+
+    async def write(session):
+        await forum_replies_collection.insert_one(doc, session=session)
+        await forum_collection.update_one(
+            {"_id": thread_oid},
+            {"$inc": {"reply_count": 1}, "$set": {"last_reply": summary(doc)}},
+            session=session,
+        )
+
+    await run_in_transaction(write)
+    return doc
+
+
+async def replies_by_thread(thread_ids: Iterable[str]) -> Dict[str, List[dict]]:
+    """Every reply of the given threads, oldest first, in one query."""
+    out: Dict[str, List[dict]] = {}
+    thread_ids = [str(t) for t in thread_ids]
+    if not thread_ids:
+        return out
+    cursor = forum_replies_collection.find({"thread_id": {"$in": thread_ids}}).sort(ORDER)
+    async for doc in cursor:
+        out.setdefault(doc["thread_id"], []).append(to_api(doc))
+    return out
+
+
+async def latest_replies(thread_ids: Iterable[str], n: int) -> Dict[str, List[dict]]:
+    """The latest `n` replies of each thread (oldest first), one indexed query per thread."""
+    thread_ids = [str(t) for t in thread_ids]
+    if not n or not thread_ids:
+        return {t: [] for t in thread_ids}
+
+    async def latest(thread_id):
+        docs = await forum_replies_collection.find({"thread_id": thread_id}).sort(
+            [("timestamp", -1), ("_id", -1)]
+        ).limit(n).to_list(n)
+        return [to_api(d) for d in reversed(docs)]
+
+    pages = await asyncio.gather(*(latest(t) for t in thread_ids))
+    return dict(zip(thread_ids, pages))
+
+
+async def page_replies(thread_id: str, after=None, limit: int = 50) -> List[dict]:
+    """Up to limit + 1 replies after the (timestamp, id) cursor, oldest first."""
+    query = {"thread_id": thread_id}
+    if after:
+        timestamp, reply_oid = after
+        query["$or"] = [
+            {"timestamp": {"$gt": timestamp}},
+            {"timestamp": timestamp, "_id": {"$gt": reply_oid}},
+        ]
+    docs = await forum_replies_collection.find(query).sort(ORDER).limit(limit + 1).to_list(limit + 1)
+    return [to_api(d) for d in docs]
+
+
+def _legacy_oid(reply: dict, thread_oid) -> ObjectId:
+    if ObjectId.is_valid(reply.get("id")):
+        return ObjectId(reply["id"])
+    # Stable for a given reply, so a re-run upserts instead of duplicating
+    key = f"{thread_oid}:{reply.get('id')}:{reply.get('timestamp')}:{reply.get('content')}"
+    return ObjectId(hashlib.sha1(key.encode("utf-8")).digest()[:12])
+
+
+async def migrate_embedded_replies(batch_size: int = MIGRATION_BATCH_SIZE) -> dict:
+    """
+    Move replies still embedded in thread documents into forum_replies,
+    a batch of threads at a time (run at startup). Replies are upserted by
+    id, so an interrupted run is simply picked up again next time.
+    """
+    moved_threads = moved_replies = 0
+    while True:
+        threads = await forum_collection.find(
+            {"replies.0": {"$exists": True}}, {"replies": 1, "timestamp": 1}
+        ).limit(batch_size).to_list(batch_size)
+        if not threads:
+            break
+
+        ops = []
+        for thread in threads:
+            for reply in thread["replies"]:
+                if not isinstance(reply, dict):
+                    continue
+                doc = {k: v for k, v in reply.items() if k != "id"}
+                doc["_id"] = _legacy_oid(reply, thread["_id"])
+                doc["thread_id"] = str(thread["_id"])
+                doc.setdefault("timestamp", thread.get("timestamp") or datetime.utcnow())
+                ops.append(ReplaceOne({"_id": doc["_id"]}, doc, upsert=True))
+        if ops:
+            await forum_replies_collection.bulk_write(ops, ordered=False)
+
+        for thread in threads:
+            await recount_thread(thread["_id"], unset_embedded=True)
+        moved_threads += len(threads)
+        moved_replies += len(ops)
+
+    if moved_threads:
+        logger.info("moved %d embedded replies out of %d forum threads", moved_replies, moved_threads)
+    return {"threads": moved_threads, "replies": moved_replies}
+
+
+async def recount_thread(thread_oid: ObjectId, unset_embedded: bool = False):
+    """Recompute a thread's reply_count and last_reply from forum_replies."""
+    thread_id = str(thread_oid)
+    count, last = await asyncio.gather(
+        forum_replies_collection.count_documents({"thread_id": thread_id}),
+        forum_replies_collection.find_one({"thread_id": thread_id}, sort=[("timestamp", -1), ("_id", -1)]),
+    )
+    update = {"$set": {"reply_count": count, "last_reply": summary(last) if last else None}}
+    if unset_embedded:
+        update["$unset"] = {"replies": ""}
+    await forum_collection.update_one({"_id": thread_oid}, update)
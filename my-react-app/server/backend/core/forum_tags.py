@@ -0,0 +1,183 @@
+import asyncio
+import logging
+import math
+import random
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Iterable, List, Optional
+
+from pymongo import ReplaceOne, UpdateOne
+
+from core.config import FORUM_TAGS_REFRESH_SECONDS, TRENDING_TAGS_HALF_LIFE_DAYS, TRENDING_TAGS_WINDOW_DAYS
+from db.connection import forum_collection, forum_tag_days_collection, forum_tags_collection
+
+logger = logging.getLogger(__name__)
+
+# Tag usage, counted as threads are created instead of by scanning the forum:
+#   forum_tags:     {"_id": tag, "count", "last_used"}            (all-time)
+#   forum_tag_days: {"_id": "<tag>|<YYYY-MM-DD>", "tag", "day", "count", "expires_at"}
+# Trending weighs each bucket by exp(-age * ln2 / half-life).
+# Days follow the threads' own `timestamp` (server local time, as
+# routes/forum.py stamps them), so the live path and rebuild() agree.
+# Mongo reads TTL dates as UTC, so buckets expire through a separate UTC
+# `expires_at` once their local day leaves the trending window.
+
+
+def _day(moment: datetime) -> datetime:
+    return datetime(moment.year, moment.month, moment.day)
+
+
+def _expires_at(day: datetime) -> datetime:
+    # A naive datetime's astimezone() takes it as local time
+    start = day.astimezone(timezone.utc).replace(tzinfo=None)
+    return start + timedelta(days=TRENDING_TAGS_WINDOW_DAYS + 1)
+
+
+def _clean(tags: Iterable[str]) -> List[str]:
+    return sorted({t.strip() for t in tags or [] if isinstance(t, str) and t.strip()})
+
+
+async def record_thread_tags(tags: Iterable[str], at: Optional[datetime] = None):
+    """$inc the all-time and day counters of a new thread's tags; `at` is its timestamp."""
+    tags = _clean(tags)
+    if not tags:
+        return
+    at = at or datetime.now()
+    day = _day(at)
+    await asyncio.gather(
+        forum_tags_collection.bulk_write([
+            UpdateOne({"_id": tag}, {"$inc": {"count": 1}, "$max": {"last_used": at}}, upsert=True)
+            for tag in tags
+        ], ordered=False),
+        forum_tag_days_collection.bulk_write([
+            UpdateOne(
+                {"_id": f"{tag}|{day.date().isoformat()}"},
+                {"$inc": {"count": 1}, "$setOnInsert": {"tag": tag, "day": day, "expires_at": _expires_at(day)}},
+                upsert=True,
+            )
+            for tag in tags
+        ], ordered=False),
+    )
+    tag_stats.note(tags)
+
+
+async def rebuild() -> dict:
+    """Recount both collections from the threads (startup backfill, or repair)."""
+    totals, days = {}, {}
+    since = _day(datetime.now()) - timedelta(days=TRENDING_TAGS_WINDOW_DAYS)
+    async for thread in forum_collection.find({"tags.0": {"$exists": True}}, {"tags": 1, "timestamp": 1}):
+        ts = thread.get("timestamp") if isinstance(thread.get("timestamp"), datetime) else None
+        for tag in _clean(thread.get("tags")):
+            total = totals.setdefault(tag, {"_id": tag, "count": 0, "last_used": ts})
+            total["count"] += 1
+            if ts and (total["last_used"] is None or ts > total["last_used"]):
+                total["last_used"] = ts
+            if ts and ts >= since:
+                key = f"{tag}|{_day(ts).date().isoformat()}"
+                bucket = {"_id": key, "tag": tag, "day": _day(ts), "expires_at": _expires_at(_day(ts)), "count": 0}
+                days.setdefault(key, bucket)["count"] += 1
+
+    for collection, docs in ((forum_tags_collection, totals), (forum_tag_days_collection, days)):
+        await collection.delete_many({"_id": {"$nin": list(docs)}})
+        if docs:
+            await collection.bulk_write(
+                [ReplaceOne({"_id": k}, doc, upsert=True) for k, doc in docs.items()], ordered=False
+            )
+    tag_stats.invalidate()
+    return {"tags": len(totals), "buckets": len(days)}
+
+
+async def _stamp_expiry():
+    """Give day buckets written before `expires_at` existed their expiry."""
+    ops = [
+        UpdateOne({"_id": bucket["_id"]}, {"$set": {"expires_at": _expires_at(bucket["day"])}})
+        async for bucket in forum_tag_days_collection.find({"expires_at": {"$exists": False}}, {"day": 1})
+    ]
+    if ops:
+        await forum_tag_days_collection.bulk_write(ops, ordered=False)
+
+
+async def backfill_if_empty() -> Optional[dict]:
+    if await forum_tags_collection.estimated_document_count():
+        await _stamp_expiry()
+        return None
+    if not await forum_collection.find_one({"tags.0": {"$exists": True}}, {"_id": 1}):
+        return None
+    return await rebuild()
+
+
+class TagStats:
+    """
+    In-process snapshot of all tags and their trending scores. Reads never
+    touch Mongo while the snapshot is fresh; a stale one is still served
+    while a single background refresh replaces it.
+    """
+
+    def __init__(self, refresh_seconds: float):
+        self.refresh_seconds = refresh_seconds
+        self._all: List[str] = []
+        self._totals: dict = {}
+        self._scores: dict = {}
+        self._loaded_at: Optional[float] = None
+        self._refreshing: Optional[asyncio.Task] = None
+
+    def invalidate(self):
+        self._loaded_at = None
+
+    def note(self, tags: List[str]):
+        """Reflect a thread created by this process right away."""
+        if self._loaded_at is None:
+            return
+        known = set(self._all)
+        if not known.issuperset(tags):
+            self._all = sorted(known.union(tags))
+        for tag in tags:
+            self._totals[tag] = self._totals.get(tag, 0) + 1
+            self._scores[tag] = self._scores.get(tag, 0.0) + 1.0
+
+    async def _load(self):
+        now = datetime.now()
+        decay = math.log(2) / TRENDING_TAGS_HALF_LIFE_DAYS
+        since = _day(now) - timedelta(days=TRENDING_TAGS_WINDOW_DAYS)
+        totals = {d["_id"]: d.get("count", 0) async for d in forum_tags_collection.find({}, {"count": 1})}
+        scores = {}
+        async for bucket in forum_tag_days_collection.find({"day": {"$gte": since}}, {"tag": 1, "day": 1, "count": 1}):
+            # Age at the middle of the day, so today's threads are not worth more than 1
+            age_days = max((now - bucket["day"]).total_seconds() / 86400 - 0.5, 0.0)
+            scores[bucket["tag"]] = scores.get(bucket["tag"], 0.0) + bucket["count"] * math.exp(-decay * age_days)
+        self._all, self._totals, self._scores = sorted(totals), totals, scores
+        self._loaded_at = time.monotonic()
+
+    async def _refresh(self):
+        try:
+            await self._load()
+        except Exception:
+            logger.exception("forum tag stats refresh failed")
+        finally:
+            self._refreshing = None
+
+    async def _ensure(self):
+        if self._loaded_at is None:
+            await self._load()
+        elif time.monotonic() - self._loaded_at > self.refresh_seconds and self._refreshing is None:
+            self._refreshing = asyncio.create_task(self._refresh())
+
+    async def all_tags(self) -> List[str]:
+        await self._ensure()
+        return list(self._all)
+
+    async def trending(self, limit: int = 5) -> List[str]:
+        """
+        Highest decayed scores first, then (for a quiet forum) all-time
+        counts; equal scores come in random order.
+        """
+        await self._ensure()
+        ranked = [
+            (round(self._scores.get(tag, 0.0), 6), count, random.random(), tag)
+            for tag, count in self._totals.items()
+        ]
+        ranked.sort(reverse=True)
+        return [tag for *_, tag in ranked[:limit]]
+
+
+tag_stats = TagStats(FORUM_TAGS_REFRESH_SECONDS)
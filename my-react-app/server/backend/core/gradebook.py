@@ -0,0 +1,156 @@
+from typing import AsyncIterator, Dict, List, Optional
+
+from bson import ObjectId
+
+from core import assignments
+from db.connection import (
+    class_memberships_collection,
+    classrooms_collection,
+    submissions_collection,
+    users_collection,
+)
+
+# Rows are joined to users and classrooms one cursor batch at a time, so
+# an export holds at most BATCH_SIZE submissions (and their users) in memory.
+BATCH_SIZE = 500
+
+
+def gradebook_header(questions: List[dict], include_answers: bool = False) -> List[str]:
+    header = [
+        "student_id", "first_name", "last_name", "email", "classrooms",
+        "status", "published", "score", "max_points", "percent",
+        "submitted_at", "graded_at",
+    ]
+    for i, q in enumerate(questions):
+        label = f"Q{i + 1} ({q.get('type')}, {q.get('points', 0)} pts)"
+        header.append(f"{label} score")
+        if include_answers:
+            header.append(f"{label} answer")
+    return header
+
+
+def question_scores(sub: dict, total: int) -> List[Optional[float]]:
+    """Per-question scores from rubric items (auto items carry questionIndex, manual ones "q<i>")."""
+    scores: List[Optional[float]] = [None] * total
+    for item in sub.get("rubric") or []:
+        if not isinstance(item, dict):
+            continue
+        index = item.get("questionIndex")
+        if index is None and str(item.get("criterionId", "")).startswith("q"):
+            try:
+                index = int(str(item["criterionId"])[1:])
+            except ValueError:
+                index = None
+        if isinstance(index, int) and 0 <= index < total:
+            scores[index] = item.get("score")
+    return scores
+
+
+def _answer_texts(sub: dict, questions: List[dict]) -> List[Optional[str]]:
+    texts: List[Optional[str]] = [None] * len(questions)
+    for item in sub.get("answers") or []:
+        if not isinstance(item, dict):
+            continue
+        index, value = item.get("index"), item.get("value")
+        if not isinstance(index, int) or not 0 <= index < len(questions) or value is None:
+            continue
+        options = questions[index].get("options") or []
+        if questions[index].get("type") == "mcq" and isinstance(value, int) and 0 <= value < len(options):
+            value = options[value]
+        texts[index] = str(value)
+    return texts
+
+
+async def _join_batch(batch: List[dict], labels: Dict[str, str]):
+    user_oids = []
+    for sub in batch:
+        try:
+            user_oids.append(ObjectId(sub.get("user_id")))
+        except Exception:
+            continue
+    users = {
+        str(u["_id"]): u
+        async for u in users_collection.find(
+            {"_id": {"$in": user_oids}}, {"firstName": 1, "lastName": 1, "email": 1}
+        )
+    }
+    classes: Dict[str, List[str]] = {}
+    if labels:
+        cursor = class_memberships_collection.find(
+            {"user_id": {"$in": [sub.get("user_id") for sub in batch]}, "class_id": {"$in": list(labels)}},
+            {"user_id": 1, "class_id": 1},
+        )
+        async for pair in cursor:
+            classes.setdefault(pair["user_id"], []).append(labels[pair["class_id"]])
+    return users, classes
+
+
+async def iter_gradebook_rows(
+    hw: dict,
+    questions: List[dict],
+    *,
+    class_id: Optional[str] = None,
+    include_answers: bool = False,
+) -> AsyncIterator[list]:
+    """One row per submitted (or deadline-frozen) submission, ordered by student id."""
+    class_ids = await assignments.homework_class_ids(hw)
+    labels = {}
+    oids = [ObjectId(c) for c in class_ids if ObjectId.is_valid(c)]
+    if oids:
+        async for cls in classrooms_collection.find({"_id": {"$in": oids}}, {"name": 1, "year": 1}):
+            labels[str(cls["_id"])] = assignments.class_label(cls.get("name"), cls.get("year")) or str(cls["_id"])
+
+    query = {
+        "homework_id": str(hw["_id"]),
+        "$or": [{"status": {"$ne": "draft"}}, {"frozen": True}],
+    }
+    if class_id:
+        members = class_memberships_collection.find({"class_id": class_id}, {"user_id": 1})
+        query["user_id"] = {"$in": [m["user_id"] async for m in members]}
+
+    max_points = hw.get("max_points") or 100
+    cursor = submissions_collection.find(query, {
+        "user_id": 1, "status": 1, "published": 1, "score": 1, "rubric": 1, "answers": 1,
+        "submitted_at": 1, "updated_at": 1, "graded_at": 1,
+    }).sort("user_id", 1).batch_size(BATCH_SIZE)
+
+    batch: List[dict] = []
+
+    async def flush():
+        users, classes = await _join_batch(batch, labels)
+        out = []
+        for sub in batch:
+            user = users.get(sub.get("user_id")) or {}
+            score = sub.get("score")
+            row = [
+                sub.get("user_id"),
+                user.get("firstName"),
+                user.get("lastName"),
+                user.get("email"),
+                "; ".join(sorted(classes.get(sub.get("user_id"), []))),
+                sub.get("status"),
+                bool(sub.get("published")),
+                score,
+                max_points,
+                round(100.0 * score / max_points, 1) if isinstance(score, (int, float)) else None,
+                sub.get("submitted_at") or sub.get("updated_at"),
+                sub.get("graded_at"),
+            ]
+            scores = question_scores(sub, len(questions))
+            if include_answers:
+                for s, a in zip(scores, _answer_texts(sub, questions)):
+                    row += [s, a]
+            else:
+                row += scores
+            out.append(row)
+        batch.clear()
+        return out
+
+    async for sub in cursor:
+        batch.append(sub)
+        if len(batch) >= BATCH_SIZE:
+            for row in await flush():
+                yield row
+    if batch:
+        for row in await flush():
+            yield row
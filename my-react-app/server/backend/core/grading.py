@@ -0,0 +1,250 @@
+import asyncio
+import difflib
+import logging
+import re
+import time
+import unicodedata
+from datetime import datetime
+from typing import List, Optional
+
+from bson import ObjectId
+from fastapi import HTTPException
+from pymongo import UpdateOne
+
+from core import completion
+from core.config import AUTO_GRADE_FUZZY_THRESHOLD
+from db.connection import homeworks_collection, qna_collection, submissions_collection
+
+logger = logging.getLogger(__name__)
+
+GRADED_BY = "auto"
+
+_PUNCT_RE = re.compile(r"[^\w\s]")
+_SPACE_RE = re.compile(r"\s+")
+
+
+def normalize_answer(value) -> str:
+    """Case-, width-, punctuation- and whitespace-insensitive form of a short answer."""
+    if value is None:
+        return ""
+    text = unicodedata.normalize("NFKC", str(value)).casefold()
+    text = _PUNCT_RE.sub(" ", text)
+    return _SPACE_RE.sub(" ", text).strip()
+
+
+def _expected_answers(question: dict) -> List[str]:
+    expected = question.get("expectedAnswer")
+    values = expected if isinstance(expected, list) else [expected]
+    return [n for n in (normalize_answer(v) for v in values) if n]
+
+
+def short_answer_matches(given: str, expected: List[str], threshold: float) -> bool:
+    if not given:
+        return False
+    if given in expected:
+        return True
+    for target in expected:
+        # Fuzzy credit only once there is enough text for a typo to be one
+        if min(len(given), len(target)) < 4:
+            continue
+        if difflib.SequenceMatcher(None, given, target, autojunk=False).ratio() >= threshold:
+            return True
+    return False
+
+
+def _as_choice(value) -> int:
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return -1
+
+
+def auto_gradable(question: dict) -> bool:
+    qtype = question.get("type")
+    if qtype == "mcq":
+        return isinstance(question.get("correctIndex"), int)
+    if qtype == "short":
+        return bool(_expected_answers(question))
+    return False
+
+
+def score_answers(questions: List[dict], answer_rows: List[list], threshold: float = AUTO_GRADE_FUZZY_THRESHOLD):
+    """
+    Score every submission of a homework at once. `answer_rows[i]` is the
+    `answers` list of submission i. Returns (earned, correct, columns):
+    (N, K) float and bool matrices over the K auto-gradable questions,
+    whose question indexes are `columns`. Runs off the event loop.
+    """
+    import numpy as np
+
+    columns = [i for i, q in enumerate(questions) if auto_gradable(q)]
+    n, k = len(answer_rows), len(columns)
+    correct = np.zeros((n, k), dtype=bool)
+    if not n or not k:
+        return np.zeros((n, k)), correct, columns
+
+    # Columnar layout: one array per question, one row per submission
+    slot = {q_index: j for j, q_index in enumerate(columns)}
+    raw = [[None] * n for _ in range(k)]
+    for i, answers in enumerate(answer_rows):
+        for item in answers or []:
+            if not isinstance(item, dict):
+                continue
+            j = slot.get(item.get("index"))
+            if j is not None:
+                raw[j][i] = item.get("value")
+
+    mcq = [j for j, q_index in enumerate(columns) if questions[q_index]["type"] == "mcq"]
+    if mcq:
+        chosen = np.array([[_as_choice(raw[j][i]) for j in mcq] for i in range(n)], dtype=np.int64).reshape(n, len(mcq))
+        key = np.array([questions[columns[j]]["correctIndex"] for j in mcq], dtype=np.int64)
+        correct[:, mcq] = chosen == key
+
+    for j, q_index in enumerate(columns):
+        if questions[q_index]["type"] != "short":
+            continue
+        expected = _expected_answers(questions[q_index])
+        # Students converge on few distinct answers; match each one once
+        given = np.array([normalize_answer(v) for v in raw[j]], dtype=object)
+        unique, inverse = np.unique(given, return_inverse=True)
+        hits = np.fromiter(
+            (short_answer_matches(u, expected, threshold) for u in unique), dtype=bool, count=len(unique)
+        )
+        correct[:, j] = hits[inverse]
+
+    points = np.array([float(questions[q_index].get("points") or 0) for q_index in columns])
+    return correct * points, correct, columns
+
+
+def _rubric(questions, earned_row, correct_row, columns) -> List[dict]:
+    return [
+        {
+            "criterionId": f"q{q_index}",
+            "questionIndex": q_index,
+            "type": questions[q_index]["type"],
+            "score": float(earned_row[j]),
+            "maxScore": float(questions[q_index].get("points") or 0),
+            "correct": bool(correct_row[j]),
+            "auto": True,
+        }
+        for j, q_index in enumerate(columns)
+    ]
+
+
+async def auto_grade_homework(homework_id: str, *, regrade: bool = False) -> dict:
+    """
+    Auto-grade the MCQ and short-answer questions of every submitted (or
+    deadline-frozen) submission of a homework, with one bulk_write.
+    Submissions whose homework also has essays, or questions without an
+    answer key, get `auto_score` and status "grading" and wait for the
+    instructor; the rest are graded outright (not published). Manual grades
+    are never overwritten; `regrade` redoes earlier unpublished auto grades.
+    """
+    started = time.perf_counter()
+    try:
+        hw = await homeworks_collection.find_one({"_id": ObjectId(homework_id)})
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid homework id")
+    if not hw:
+        raise HTTPException(status_code=404, detail="Homework not found")
+
+    qna = await qna_collection.find_one({"case_id": hw.get("case_id")}, {"questions": 1})
+    questions = ((qna or {}).get("questions") or []) if hw.get("homework_type") == "Q&A" else []
+    if not any(auto_gradable(q) for q in questions):
+        # Annotation and essay-only homeworks stay fully manual
+        return {
+            "homework_id": str(hw["_id"]),
+            "graded": 0,
+            "needs_review": 0,
+            "auto_questions": [],
+            "manual_questions": list(range(len(questions))),
+            "elapsed_ms": 0.0,
+        }
+
+    targets = [{"status": "submitted"}, {"status": "draft", "frozen": True}]
+    if regrade:
+        targets.append({"graded_by": GRADED_BY, "published": {"$ne": True}})
+    subs = await submissions_collection.find(
+        {"homework_id": str(hw["_id"]), "$or": targets}, {"answers": 1}
+    ).to_list(None)
+
+    earned, correct, columns = await asyncio.to_thread(
+        score_answers, questions, [s.get("answers") for s in subs]
+    )
+    manual = sorted(set(range(len(questions))) - set(columns))
+    complete = not manual
+
+    graded_at = datetime.utcnow()
+    ops = []
+    totals = earned.sum(axis=1)
+    for i, sub in enumerate(subs):
+        total = float(totals[i])
+        fields = {
+            "auto_score": total,
+            "rubric": _rubric(questions, earned[i], correct[i], columns),
+            "graded_by": GRADED_BY,
+            "auto_graded_at": graded_at,
+            "updated_at": graded_at,
+        }
+        if complete:
+            fields.update({"score": int(round(total)), "status": "graded", "graded_at": graded_at})
+        else:
+            fields["status"] = "grading"
+        ops.append(UpdateOne({"_id": sub["_id"]}, {"$set": fields}))
+    if ops:
+        await submissions_collection.bulk_write(ops, ordered=False)
+        await completion.recount(str(hw["_id"]))
+
+    elapsed_ms = round((time.perf_counter() - started) * 1000, 1)
+    logger.info(
+        "auto-graded homework %s: %d submissions, %d auto / %d manual questions in %sms",
+        homework_id, len(subs), len(columns), len(manual), elapsed_ms,
+    )
+    return {
+        "homework_id": str(hw["_id"]),
+        "graded": len(subs) if complete else 0,
+        "needs_review": 0 if complete else len(subs),
+        "auto_questions": [int(c) for c in columns],
+        "manual_questions": manual,
+        "elapsed_ms": elapsed_ms,
+    }
+
+
+# ====================================================
+# Grading queue (homeworks closed by the scheduler)
+# ====================================================
+
+async def grade_if_queued(homework_id: str) -> Optional[dict]:
+    """Auto-grade a homework the due-date scheduler queued at close, once."""
+    claimed = await homeworks_collection.find_one_and_update(
+        {"_id": ObjectId(homework_id), "grading_status": "queued"},
+        {"$set": {"grading_status": "running", "grading_started_at": datetime.utcnow()}},
+        {"_id": 1},
+    )
+    if not claimed:
+        return None
+    try:
+        summary = await auto_grade_homework(homework_id)
+    except Exception:
+        logger.exception("homework %s: queued auto-grading failed", homework_id)
+        await homeworks_collection.update_one(
+            {"_id": claimed["_id"]}, {"$set": {"grading_status": "failed"}}
+        )
+        return None
+    await homeworks_collection.update_one(
+        {"_id": claimed["_id"]},
+        {"$set": {
+            "grading_status": (
+                "manual" if not summary["auto_questions"]
+                else "needs_review" if summary["manual_questions"] else "graded"
+            ),
+            "auto_graded_at": datetime.utcnow(),
+        }},
+    )
+    return summary
+
+
+async def grade_queued():
+    """Work through homeworks left queued (e.g. closed while the app was down)."""
+    async for hw in homeworks_collection.find({"grading_status": "queued"}, {"_id": 1}):
+        await grade_if_queued(str(hw["_id"]))
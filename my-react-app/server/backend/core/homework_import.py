@@ -0,0 +1,327 @@
+import csv
+import io
+import json
+import re
+from collections import Counter
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+from bson import ObjectId
+from fastapi import HTTPException
+from pydantic import ValidationError
+
+from core.assignments import class_label
+from core.blobstore import add_ref, blob_refs, release
+from core.scheduler import normalize_due
+from db.connection import (
+    annot_collection,
+    cases_collection,
+    classrooms_collection,
+    homeworks_collection,
+    qna_collection,
+)
+from db.transactions import run_in_transaction
+from models.models import BulkHomeworkRow
+
+MAX_MANIFEST_BYTES = 5 * 1024 * 1024
+MAX_MANIFEST_ROWS = 1000
+
+LABEL_RE = re.compile(r"^(?P<name>.+?)\s*\((?P<year>[^()]+)\)$")
+
+
+# ====================================================
+# Manifest parsing
+# ====================================================
+
+def parse_manifest(raw: bytes, filename: Optional[str] = None, content_type: Optional[str] = None) -> List[dict]:
+    """Rows of a JSON (list or {"rows": [...]}) or CSV manifest."""
+    if len(raw) > MAX_MANIFEST_BYTES:
+        raise HTTPException(status_code=413, detail="Manifest too large")
+    try:
+        text = raw.decode("utf-8-sig")
+    except UnicodeDecodeError:
+        raise HTTPException(status_code=400, detail="Manifest must be UTF-8")
+
+    is_csv = (filename or "").lower().endswith(".csv") or (content_type or "").startswith("text/csv")
+    if is_csv:
+        reader = csv.DictReader(io.StringIO(text))
+        # Empty cells mean "not given", not empty strings
+        rows = [{k.strip(): v for k, v in row.items() if k and v not in (None, "")} for row in reader]
+    else:
+        try:
+            data = json.loads(text)
+        except json.JSONDecodeError as e:
+            raise HTTPException(status_code=400, detail=f"Invalid JSON manifest: {e}")
+        rows = data.get("rows") if isinstance(data, dict) else data
+        if not isinstance(rows, list) or not all(isinstance(r, dict) for r in rows):
+            raise HTTPException(status_code=400, detail="Manifest must be a list of row objects")
+
+    if not rows:
+        raise HTTPException(status_code=400, detail="Manifest has no rows")
+    if len(rows) > MAX_MANIFEST_ROWS:
+        raise HTTPException(status_code=400, detail=f"Manifest has more than {MAX_MANIFEST_ROWS} rows")
+    return rows
+
+
+def _validation_messages(exc: ValidationError) -> List[str]:
+    return [f"{'.'.join(str(p) for p in err['loc'])}: {err['msg']}" for err in exc.errors()]
+
+
+# ====================================================
+# Lookups done once per import
+# ====================================================
+
+async def resolve_classes(keys) -> Dict[str, Tuple[str, Optional[str]]]:
+    """Map classroom ids and "Name (Year)" labels to (id, label) with one query."""
+    oids, names = [], set()
+    for key in keys:
+        try:
+            oids.append(ObjectId(key))
+            continue
+        except Exception:
+            pass
+        match = LABEL_RE.match(key)
+        names.add(match.group("name").strip() if match else key)
+
+    resolved = {}
+    if not oids and not names:
+        return resolved
+    cursor = classrooms_collection.find(
+        {"$or": [{"_id": {"$in": oids}}, {"name": {"$in": sorted(names)}}]},
+        {"name": 1, "year": 1},
+    )
+    async for cls in cursor:
+        entry = (str(cls["_id"]), class_label(cls.get("name"), cls.get("year")))
+        resolved[entry[0]] = entry
+        if entry[1]:
+            resolved[entry[1]] = entry
+        # A bare name only resolves when it is unambiguous
+        name = cls.get("name")
+        resolved[name] = entry if name not in resolved else None
+    return {k: v for k, v in resolved.items() if v}
+
+
+async def existing_cases(case_ids) -> Dict[str, dict]:
+    oids = []
+    for cid in case_ids:
+        try:
+            oids.append(ObjectId(cid))
+        except Exception:
+            continue
+    found = {}
+    if oids:
+        async for case in cases_collection.find({"_id": {"$in": oids}}, {"image_url": 1}):
+            found[str(case["_id"])] = case
+    return found
+
+
+# ====================================================
+# Import
+# ====================================================
+
+def _build(row: BulkHomeworkRow, classes: dict, cases: dict, shared_image_url: Optional[str], timestamp):
+    """Documents for one row, or raise ValueError with the reason."""
+    due_at_utc = normalize_due(row.due_at)
+    if due_at_utc is None:
+        raise ValueError("due_at: invalid date")
+
+    audience = "Classrooms" if row.audience.strip().lower() in ("classroom", "classrooms") else "All Students"
+    class_ids, class_labels = [], []
+    if audience == "Classrooms":
+        if not row.classes:
+            raise ValueError("classes: required when audience is classrooms")
+        unknown = [c for c in row.classes if c not in classes]
+        if unknown:
+            raise ValueError(f"classes: unknown classroom(s) {', '.join(unknown)}")
+        for key in row.classes:
+            cid, label = classes[key]
+            if cid not in class_ids:
+                class_ids.append(cid)
+                if label:
+                    class_labels.append(label)
+
+    case_doc = None
+    if row.case_id:
+        if row.case_id not in cases:
+            raise ValueError("case_id: case not found")
+        case_id = row.case_id
+        image_url = cases[row.case_id].get("image_url") or ""
+    else:
+        if not row.title:
+            raise ValueError("title: required when no case_id is given")
+        image_url = row.image_url or shared_image_url or ""
+        case_oid = ObjectId()
+        case_id = str(case_oid)
+        case_doc = {
+            "_id": case_oid,
+            "title": row.title,
+            "description": row.description,
+            "case_type": row.case_type or "Cardiology",
+            "homework_type": row.homework_type,
+            "visibility": row.visibility,
+            "created_at": timestamp,
+        }
+        if image_url:
+            case_doc["image_url"] = image_url
+
+    questions = [q.model_dump() for q in row.questions]
+    max_points = row.max_points
+    if max_points is None:
+        max_points = sum(q["points"] for q in questions) if questions else 100
+
+    hw_doc = {
+        "_id": ObjectId(),
+        "case_id": case_id,
+        "homework_type": row.homework_type,
+        "focus": row.focus,
+        "audience": audience,
+        "visibility": row.visibility,
+        "due_at": row.due_at,
+        "due_at_utc": due_at_utc,
+        "status": "active",
+        "max_points": int(max_points),
+        "created_at": timestamp,
+    }
+    if audience == "Classrooms":
+        hw_doc["class_ids"] = class_ids
+        if class_labels:
+            hw_doc["class_labels"] = class_labels
+        if row.password:
+            hw_doc["password"] = row.password
+    if row.instructions is not None:
+        hw_doc["instructions"] = row.instructions
+
+    qna_doc = annot_doc = None
+    if row.homework_type == "Q&A":
+        qna_doc = {
+            "_id": ObjectId(),
+            "case_id": case_id,
+            "instructions": row.instructions,
+            "case_image": image_url,
+            "total_questions": len(questions),
+            "questions": questions,
+        }
+    else:
+        annot_doc = {
+            "_id": ObjectId(),
+            "case_id": case_id,
+            "annotation_image": image_url,
+            "reference_images": row.reference_images,
+        }
+    return case_doc, hw_doc, qna_doc, annot_doc
+
+
+async def _insert_all(batches, session):
+    for collection, docs in batches:
+        if docs:
+            await collection.insert_many(docs, ordered=True, session=session)
+
+
+async def import_homeworks(
+    raw_rows: List[dict],
+    *,
+    shared_blob: Optional[dict] = None,
+    dry_run: bool = False,
+) -> dict:
+    """
+    Validate every row, then write all valid rows in one transaction with
+    insert_many per collection. `shared_blob` is a case image uploaded
+    with the manifest and used by every new case that has no image_url;
+    its bytes are stored once and only gain references.
+    """
+    timestamp = datetime.utcnow()
+    results: List[dict] = []
+    parsed: List[Tuple[int, BulkHomeworkRow]] = []
+
+    for index, raw in enumerate(raw_rows):
+        try:
+            parsed.append((index, BulkHomeworkRow.model_validate(raw)))
+        except ValidationError as e:
+            results.append({"row": index, "ok": False, "errors": _validation_messages(e)})
+
+    classes = await resolve_classes({c for _, row in parsed for c in row.classes})
+    cases = await existing_cases({row.case_id for _, row in parsed if row.case_id})
+    shared_url = shared_blob["url"] if shared_blob else None
+
+    built = []
+    for index, row in parsed:
+        try:
+            docs = _build(row, classes, cases, shared_url, timestamp)
+        except ValueError as e:
+            results.append({"row": index, "ok": False, "errors": [str(e)]})
+            continue
+        built.append((index, docs))
+
+    case_docs = [d[0] for _, d in built if d[0]]
+    hw_docs = [d[1] for _, d in built]
+    qna_docs = [d[2] for _, d in built if d[2]]
+    annot_docs = [d[3] for _, d in built if d[3]]
+
+    # Same counting as the release on delete, so imported docs net out to zero
+    uses = blob_refs(case_docs, qna_docs, annot_docs)
+    shared_sha = shared_blob["sha256"] if shared_blob else None
+
+    if dry_run or not built:
+        if shared_sha:
+            await release(shared_sha)
+        written = False
+    else:
+        # Take the blob references before writing: a crash in between leaks
+        # a reference instead of freeing bytes that documents point at.
+        # URLs named in the manifest may already be owned elsewhere, so each
+        # new owner gets its own reference; the shared upload already holds one.
+        taken = Counter()
+        for sha, count in uses.items():
+            extra = count - 1 if sha == shared_sha else count
+            if extra > 0 and await add_ref(sha, extra):
+                taken[sha] = extra
+        if shared_sha and not uses.get(shared_sha):
+            await release(shared_sha)
+
+        batches = [
+            (cases_collection, case_docs),
+            (homeworks_collection, hw_docs),
+            (qna_collection, qna_docs),
+            (annot_collection, annot_docs),
+        ]
+
+        async def write(session):
+            if session is not None:
+                await _insert_all(batches, session)
+                return
+            # No transaction support: undo whatever landed on failure
+            try:
+                await _insert_all(batches, None)
+            except Exception:
+                for collection, docs in batches:
+                    if docs:
+                        await collection.delete_many({"_id": {"$in": [d["_id"] for d in docs]}})
+                raise
+
+        try:
+            await run_in_transaction(write)
+        except Exception:
+            for sha, count in taken.items():
+                await release(sha, count)
+            if shared_sha and uses.get(shared_sha):
+                await release(shared_sha)
+            raise
+        written = True
+
+    for index, (case_doc, hw_doc, _, _) in built:
+        results.append({
+            "row": index,
+            "ok": True,
+            "case_id": hw_doc["case_id"],
+            "homework_id": str(hw_doc["_id"]) if written else None,
+            "new_case": case_doc is not None,
+        })
+    results.sort(key=lambda r: r["row"])
+
+    return {
+        "dry_run": dry_run,
+        "created": len(built) if written else 0,
+        "failed": sum(1 for r in results if not r["ok"]),
+        "results": results,
+        "homeworks": [(hw["_id"], hw["case_id"], hw["due_at_utc"]) for hw in hw_docs] if written else [],
+    }
@@ -0,0 +1,78 @@
+import asyncio
+import hashlib
+import json
+from typing import Awaitable, Callable, Dict, Optional, Tuple, TypeVar
+
+from fastapi import HTTPException
+from fastapi.encoders import jsonable_encoder
+
+from core.cache import TTLCache
+from core.config import IDEMPOTENCY_TTL
+
+T = TypeVar("T")
+
+HEADER = "Idempotency-Key"
+MAX_KEY_LENGTH = 255
+
+# (scope, key) -> (fingerprint, result). Per process: it absorbs client
+# retries and double clicks; unique indexes still guard the data itself.
+_results = TTLCache(maxsize=4096, ttl=IDEMPOTENCY_TTL)
+_inflight: Dict[Tuple[str, str], Tuple[str, asyncio.Future]] = {}
+
+
+def fingerprint(*parts) -> str:
+    """Stable hash of the request, so a reused key with a different body is caught."""
+    raw = json.dumps(jsonable_encoder(parts), sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(raw.encode()).hexdigest()
+
+
+def _check(stored: str, given: str):
+    if stored != given:
+        raise HTTPException(status_code=422, detail="Idempotency key was already used for a different request")
+
+
+async def run_once(
+    scope: str,
+    key: Optional[str],
+    request_fingerprint: str,
+    work: Callable[[], Awaitable[T]],
+) -> T:
+    """
+    Run `work` once per (scope, key). Repeats within IDEMPOTENCY_TTL get the
+    first result; repeats that arrive while it is still running wait for it.
+    Failures are not remembered, so the client can retry with the same key.
+    """
+    if not key:
+        return await work()
+    if len(key) > MAX_KEY_LENGTH:
+        raise HTTPException(status_code=400, detail="Idempotency key too long")
+
+    cache_key = (scope, key)
+    cached = _results.get(cache_key)
+    if cached is not None:
+        _check(cached[0], request_fingerprint)
+        return cached[1]
+
+    pending = _inflight.get(cache_key)
+    if pending is not None:
+        _check(pending[0], request_fingerprint)
+        return await asyncio.shield(pending[1])
+
+    future = asyncio.get_running_loop().create_future()
+    # Nobody may be waiting; mark the outcome as retrieved either way
+    future.add_done_callback(lambda f: f.cancelled() or f.exception())
+    _inflight[cache_key] = (request_fingerprint, future)
+    try:
+        result = await work()
+    except asyncio.CancelledError:
+        future.cancel()
+        raise
+    except Exception as e:
+        future.set_exception(e)
+        raise
+    else:
+        _results.set(cache_key, (request_fingerprint, result))
+        future.set_result(result)
+        return result
+    finally:
+        _inflight.pop(cache_key, None)
@@ -0,0 +1,123 @@
+import asyncio
+import logging
+import os
+import socket
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable, Dict, Optional
+
+from bson import ObjectId
+from fastapi import HTTPException
+from fastapi.encoders import jsonable_encoder
+
+from core.config import JOB_HEARTBEAT_SECONDS, JOB_LEASE_SECONDS
+from db.connection import jobs_collection
+
+logger = logging.getLogger(__name__)
+
+# One document per job: {"_id", "kind", "params", "status", "result",
+# "error", "worker", "lease_until", "created_at", "finished_at"}. The work
+# itself runs as a task in the process that accepted it; the document is
+# what clients poll. That process renews `lease_until` while the job runs,
+# so any worker can tell a job whose process died from one still running
+# elsewhere.
+
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}"
+LEASE = timedelta(seconds=JOB_LEASE_SECONDS)
+
+_tasks: Dict[ObjectId, asyncio.Task] = {}
+
+
+async def start_job(kind: str, params: dict, work: Callable[[], Awaitable[dict]]) -> str:
+    job_id = ObjectId()
+    await jobs_collection.insert_one({
+        "_id": job_id,
+        "kind": kind,
+        "params": jsonable_encoder(params),
+        "status": "running",
+        "worker": WORKER_ID,
+        "lease_until": datetime.utcnow() + LEASE,
+        "created_at": datetime.utcnow(),
+    })
+
+    async def run():
+        try:
+            result = await work()
+        except Exception as e:
+            logger.exception("job %s (%s) failed", job_id, kind)
+            detail = e.detail if isinstance(e, HTTPException) else str(e)
+            update = {"status": "failed", "error": jsonable_encoder(detail)}
+        else:
+            update = {"status": "done", "result": jsonable_encoder(result)}
+        update["finished_at"] = datetime.utcnow()
+        await jobs_collection.update_one({"_id": job_id}, {"$set": update})
+
+    task = asyncio.create_task(run())
+    _tasks[job_id] = task
+    task.add_done_callback(lambda _: _tasks.pop(job_id, None))
+    return str(job_id)
+
+
+async def get_job(job_id: str) -> Optional[dict]:
+    try:
+        job = await jobs_collection.find_one({"_id": ObjectId(job_id)})
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid job id")
+    if job:
+        job["job_id"] = str(job.pop("_id"))
+    return job
+
+
+async def renew_leases():
+    if _tasks:
+        await jobs_collection.update_many(
+            {"_id": {"$in": list(_tasks)}, "status": "running"},
+            {"$set": {"lease_until": datetime.utcnow() + LEASE}},
+        )
+
+
+async def mark_interrupted() -> int:
+    """Running jobs whose lease ran out died with their process."""
+    now = datetime.utcnow()
+    result = await jobs_collection.update_many(
+        {"status": "running", "$or": [
+            {"lease_until": {"$lt": now}},
+            # Jobs from before leases
+            {"lease_until": {"$exists": False}},
+        ]},
+        {"$set": {"status": "interrupted", "finished_at": now}},
+    )
+    return result.modified_count
+
+
+class JobHeartbeat:
+    """Renews this process's leases and interrupts jobs whose worker is gone."""
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self._task: Optional[asyncio.Task] = None
+
+    async def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        while True:
+            try:
+                await renew_leases()
+                interrupted = await mark_interrupted()
+                if interrupted:
+                    logger.warning("%d jobs lost their worker and were marked interrupted", interrupted)
+            except Exception:
+                logger.exception("job heartbeat failed")
+            await asyncio.sleep(self.interval)
+
+
+job_heartbeat = JobHeartbeat(JOB_HEARTBEAT_SECONDS)
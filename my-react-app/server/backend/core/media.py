@@ -0,0 +1,227 @@
+import asyncio
+import gzip
+import mimetypes
+import os
+import re
+from email.utils import formatdate
+from pathlib import Path
+from typing import AsyncIterator, Optional, Tuple
+
+from fastapi import HTTPException, Request
+from fastapi.responses import Response, StreamingResponse
+
+from core.cache import TTLCache
+from core.config import UPLOAD_CHUNK_SIZE
+from core.uploads import hash_file
+
+IMMUTABLE_CACHE = "public, max-age=31536000, immutable"
+REVALIDATE_CACHE = "public, no-cache"
+
+# Precompressed sidecars, in order of preference: file.ext.br, file.ext.gz
+ENCODINGS = (("br", ".br"), ("gzip", ".gz"))
+COMPRESSIBLE_EXTS = {".svg", ".dcm", ".json", ".txt", ".csv", ".bmp", ".tif", ".tiff"}
+
+SHA256_NAME_RE = re.compile(r"^([0-9a-f]{64})(\.[A-Za-z0-9]+)?$")
+RANGE_RE = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+# (path, size, mtime_ns) -> sha256, so a file is hashed once per version
+_etag_cache = TTLCache(maxsize=4096)
+
+
+def resolve_under(root: Path, rel_path: str) -> Path:
+    """Join `rel_path` onto `root`, refusing anything that escapes it."""
+    base = root.resolve()
+    target = (base / rel_path).resolve()
+    if target != base and base not in target.parents:
+        raise HTTPException(status_code=404, detail="File not found")
+    return target
+
+
+def content_hash_from_name(path: Path) -> Optional[str]:
+    """Content-addressed files carry their SHA-256 in the filename."""
+    match = SHA256_NAME_RE.match(path.name)
+    return match.group(1) if match else None
+
+
+async def content_etag(path: Path, stat: os.stat_result) -> str:
+    sha256 = content_hash_from_name(path)
+    if sha256:
+        return sha256
+    key = (str(path), stat.st_size, stat.st_mtime_ns)
+    cached = _etag_cache.get(key)
+    if cached is None:
+        cached = (await asyncio.to_thread(hash_file, path)).hexdigest()
+        _etag_cache.set(key, cached)
+    return cached
+
+
+def _stat(path: Path) -> Optional[os.stat_result]:
+    try:
+        st = path.stat()
+    except (FileNotFoundError, NotADirectoryError):
+        return None
+    return st if path.is_file() else None
+
+
+def etag_matches(header: Optional[str], etag: str) -> bool:
+    """Weak comparison, as required for If-None-Match."""
+    if not header:
+        return False
+    if header.strip() == "*":
+        return True
+    candidates = [tag.strip() for tag in header.split(",")]
+    return any(tag.removeprefix("W/") == etag for tag in candidates)
+
+
+def parse_range(header: Optional[str], size: int) -> Optional[Tuple[int, int]]:
+    """
+    Parse a single `bytes=` range into an inclusive (start, end).
+    Returns None when the header should be ignored (absent, malformed or
+    multi-range); raises 416 when it cannot be satisfied.
+    """
+    if not header:
+        return None
+    match = RANGE_RE.match(header.strip())
+    if not match:
+        return None
+    first, last = match.groups()
+    if not first and not last:
+        return None
+    if not first:
+        length = int(last)
+        if length == 0:
+            raise HTTPException(status_code=416, headers={"Content-Range": f"bytes */{size}"})
+        return max(size - length, 0), size - 1
+    start = int(first)
+    end = min(int(last), size - 1) if last else size - 1
+    if start >= size or start > end:
+        raise HTTPException(status_code=416, headers={"Content-Range": f"bytes */{size}"})
+    return start, end
+
+
+def _read_at(handle, offset: int, length: int) -> bytes:
+    handle.seek(offset)
+    return handle.read(length)
+
+
+async def iter_file(path: Path, start: int = 0, end: Optional[int] = None) -> AsyncIterator[bytes]:
+    """Yield bytes [start, end] of `path` with reads offloaded to a thread."""
+    handle = await asyncio.to_thread(open, path, "rb")
+    try:
+        if end is None:
+            end = (await asyncio.to_thread(os.fstat, handle.fileno())).st_size - 1
+        offset = start
+        while offset <= end:
+            chunk = await asyncio.to_thread(_read_at, handle, offset, min(UPLOAD_CHUNK_SIZE, end - offset + 1))
+            if not chunk:
+                break
+            offset += len(chunk)
+            yield chunk
+    finally:
+        await asyncio.to_thread(handle.close)
+
+
+def _pick_encoding(request: Request, path: Path) -> Tuple[Path, Optional[str]]:
+    accepted = request.headers.get("accept-encoding", "")
+    tokens = {part.split(";", 1)[0].strip().lower() for part in accepted.split(",")}
+    for encoding, suffix in ENCODINGS:
+        if encoding in tokens:
+            variant = path.with_name(path.name + suffix)
+            if variant.is_file():
+                return variant, encoding
+    return path, None
+
+
+async def media_response(
+    request: Request,
+    path: Path,
+    *,
+    immutable: bool = False,
+    media_type: Optional[str] = None,
+) -> Response:
+    """
+    Serve a file with a strong content-hash ETag, If-None-Match/304,
+    single byte-range requests and precompressed .br/.gz sidecars.
+    Content-addressed files are cached as immutable; everything else is
+    cached but revalidated on each use.
+    """
+    st = await asyncio.to_thread(_stat, path)
+    if st is None:
+        raise HTTPException(status_code=404, detail="File not found")
+
+    media_type = media_type or mimetypes.guess_type(path.name)[0] or "application/octet-stream"
+    sha256 = await content_etag(path, st)
+
+    body_path, encoding = await asyncio.to_thread(_pick_encoding, request, path)
+    body_st = st
+    if encoding:
+        body_st = await asyncio.to_thread(_stat, body_path)
+        if body_st is None:
+            body_path, encoding, body_st = path, None, st
+
+    etag = f'"{sha256}-{encoding}"' if encoding else f'"{sha256}"'
+
+    headers = {
+        "ETag": etag,
+        "Cache-Control": IMMUTABLE_CACHE if immutable else REVALIDATE_CACHE,
+        "Last-Modified": formatdate(st.st_mtime, usegmt=True),
+        "Accept-Ranges": "bytes",
+        "Vary": "Accept-Encoding",
+    }
+    if encoding:
+        headers["Content-Encoding"] = encoding
+
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+
+    size = body_st.st_size
+    byte_range = None
+    if_range = request.headers.get("if-range")
+    if not if_range or if_range.strip() == etag:
+        try:
+            byte_range = parse_range(request.headers.get("range"), size)
+        except HTTPException as exc:
+            exc.headers = {**headers, **(exc.headers or {})}
+            raise
+
+    status_code = 200
+    start, end = 0, size - 1
+    if byte_range:
+        start, end = byte_range
+        status_code = 206
+        headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+    headers["Content-Length"] = str(end - start + 1 if size else 0)
+
+    if request.method == "HEAD" or size == 0:
+        return Response(status_code=status_code, headers=headers, media_type=media_type)
+
+    return StreamingResponse(
+        iter_file(body_path, start, end),
+        status_code=status_code,
+        headers=headers,
+        media_type=media_type,
+    )
+
+
+def write_gzip_variant(path: Path, min_saving: float = 0.1) -> Optional[Path]:
+    """
+    Write `path.gz` next to a compressible file when it saves at least
+    `min_saving` of the size. Blocking; call from a worker thread.
+    """
+    if path.suffix.lower() not in COMPRESSIBLE_EXTS:
+        return None
+    variant = path.with_name(path.name + ".gz")
+    tmp = variant.with_name(variant.name + ".tmp")
+    with open(path, "rb") as src, open(tmp, "wb") as raw:
+        # mtime=0 keeps the compressed bytes deterministic
+        with gzip.GzipFile(fileobj=raw, mode="wb", compresslevel=6, mtime=0) as dst:
+            while True:
+                chunk = src.read(UPLOAD_CHUNK_SIZE)
+                if not chunk:
+                    break
+                dst.write(chunk)
+    if tmp.stat().st_size > path.stat().st_size * (1 - min_saving):
+        tmp.unlink()
+        return None
+    os.replace(tmp, variant)
+    return variant
@@ -0,0 +1,254 @@
+import asyncio
+import heapq
+import itertools
+import logging
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional, Tuple
+
+from bson import ObjectId
+from pymongo import ReturnDocument, UpdateOne
+from pymongo.errors import DuplicateKeyError
+
+from core import completion
+from core.case_bundles import invalidate_case_bundle
+from core.config import HOMEWORK_REMINDER_LEAD_HOURS
+from core.grading import grade_if_queued, grade_queued
+from db.connection import homeworks_collection, submissions_collection, homework_events_collection
+from ws_manager import ws_manager
+
+logger = logging.getLogger(__name__)
+
+EVENT_REMIND = "due_soon"
+EVENT_CLOSE = "closed"
+
+# Never sleep longer than this, so wall-clock jumps are picked up
+MAX_SLEEP = 300
+
+
+def normalize_due(value) -> Optional[datetime]:
+    """Parse a due date (ISO string or datetime) into a naive UTC datetime."""
+    if value is None or value == "":
+        return None
+    if isinstance(value, datetime):
+        dt = value
+    else:
+        try:
+            dt = datetime.fromisoformat(str(value).strip().replace("Z", "+00:00"))
+        except ValueError:
+            return None
+    if dt.tzinfo is not None:
+        dt = dt.astimezone(timezone.utc).replace(tzinfo=None)
+    return dt
+
+
+def is_past_due(hw: dict, at: Optional[datetime] = None) -> bool:
+    """True once a homework is closed, even if the close event has not fired yet."""
+    if hw.get("status") == "closed":
+        return True
+    due = hw.get("due_at_utc")
+    return due is not None and due <= (at or datetime.utcnow())
+
+
+class DueDateScheduler:
+    """
+    Min-heap of upcoming homework deadlines. The homework documents are
+    the persistent state (status + indexed due_at_utc), so the heap is
+    rebuilt on startup and missed deadlines fire immediately. A reminder
+    is claimed in homework_events first, so it is sent once even with
+    several app processes. A close is guarded by the conditional status
+    update itself; its follow-up work is repeatable and re-run on startup
+    if a process died before finishing it (`close_pending`).
+    """
+
+    def __init__(self):
+        self._heap: List[Tuple[datetime, int, str, str, datetime]] = []
+        self._due: Dict[str, datetime] = {}
+        self._seq = itertools.count()
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self._grading = set()
+
+    # -------- scheduling --------
+
+    def schedule(self, homework_id, due: Optional[datetime]):
+        homework_id = str(homework_id)
+        if due is None:
+            self.unschedule(homework_id)
+            return
+        self._due[homework_id] = due
+        if HOMEWORK_REMINDER_LEAD_HOURS > 0:
+            remind_at = due - timedelta(hours=HOMEWORK_REMINDER_LEAD_HOURS)
+            if remind_at > datetime.utcnow():
+                heapq.heappush(self._heap, (remind_at, next(self._seq), homework_id, EVENT_REMIND, due))
+        heapq.heappush(self._heap, (due, next(self._seq), homework_id, EVENT_CLOSE, due))
+        self._wakeup.set()
+
+    def unschedule(self, homework_id):
+        # Stale heap entries are skipped when popped
+        self._due.pop(str(homework_id), None)
+
+    def __len__(self) -> int:
+        return len(self._due)
+
+    def _spawn(self, coro):
+        # Keep a reference so the task is not garbage collected mid-run
+        task = asyncio.create_task(coro)
+        self._grading.add(task)
+        task.add_done_callback(self._grading.discard)
+
+    # -------- lifecycle --------
+
+    async def start(self):
+        await self._backfill()
+        cursor = homeworks_collection.find(
+            {"status": "active", "due_at_utc": {"$ne": None}},
+            {"due_at_utc": 1},
+        ).sort("due_at_utc", 1)
+        async for hw in cursor:
+            self.schedule(hw["_id"], hw["due_at_utc"])
+        # Closes interrupted after the status flip; before grading, so
+        # their drafts are frozen first
+        async for hw in homeworks_collection.find({"status": "closed", "close_pending": True}):
+            try:
+                await _finish_close(hw)
+            except Exception:
+                logger.exception("homework %s: finishing interrupted close failed", hw["_id"])
+        self._task = asyncio.create_task(self._run())
+        # Homeworks that closed while no process was running
+        self._spawn(grade_queued())
+        logger.info("due-date scheduler started with %d homework deadlines", len(self))
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _backfill(self):
+        """Give older homework docs a status and the normalized due_at_utc field."""
+        await homeworks_collection.update_many({"status": {"$exists": False}}, {"$set": {"status": "active"}})
+        ops = []
+        cursor = homeworks_collection.find(
+            {"due_at_utc": {"$exists": False}, "due_at": {"$nin": [None, ""]}},
+            {"due_at": 1},
+        )
+        async for hw in cursor:
+            ops.append(UpdateOne({"_id": hw["_id"]}, {"$set": {"due_at_utc": normalize_due(hw["due_at"])}}))
+        if ops:
+            await homeworks_collection.bulk_write(ops, ordered=False)
+
+    async def _run(self):
+        while True:
+            self._wakeup.clear()
+            now = datetime.utcnow()
+            while self._heap and self._heap[0][0] <= now:
+                _, _, homework_id, event, due = heapq.heappop(self._heap)
+                if self._due.get(homework_id) != due:
+                    continue
+                if event == EVENT_CLOSE:
+                    self._due.pop(homework_id, None)
+                try:
+                    closed = await fire(homework_id, event, due)
+                except Exception:
+                    logger.exception("homework %s: %s event failed", homework_id, event)
+                    continue
+                if closed:
+                    # Grading can take a while; keep firing other deadlines
+                    self._spawn(grade_if_queued(homework_id))
+
+            timeout = MAX_SLEEP
+            if self._heap:
+                timeout = min(MAX_SLEEP, max((self._heap[0][0] - datetime.utcnow()).total_seconds(), 0))
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+
+# ====================================================
+# Lifecycle events
+# ====================================================
+
+async def _claim(homework_id: str, event: str, due: datetime) -> bool:
+    """Record an event; False if it was already recorded."""
+    try:
+        await homework_events_collection.insert_one({
+            "_id": f"{homework_id}:{event}:{due.isoformat()}",
+            "homework_id": homework_id,
+            "event": event,
+            "due_at_utc": due,
+            "fired_at": datetime.utcnow(),
+        })
+    except DuplicateKeyError:
+        return False
+    return True
+
+
+async def _notify(hw: dict, event: str):
+    await ws_manager.broadcast(str(hw.get("case_id")), {
+        "type": "homework",
+        "action": event,
+        "homeworkId": str(hw["_id"]),
+        "dueAt": hw.get("due_at"),
+    })
+
+
+async def _finish_close(hw: dict):
+    """
+    Work that follows the status flip. Every step is safe to repeat, so an
+    interrupted close is simply run again; `close_pending` is cleared last.
+    """
+    homework_id = str(hw["_id"])
+    invalidate_case_bundle(hw.get("case_id"))
+
+    # Late-submission snapshot: drafts stop being editable at the deadline
+    frozen = await submissions_collection.update_many(
+        {"homework_id": homework_id, "status": "draft", "frozen": {"$ne": True}},
+        {"$set": {"frozen": True, "frozen_at": hw.get("closed_at") or datetime.utcnow()}},
+    )
+    logger.info(
+        "homework %s closed at deadline; %d drafts frozen, grading queued",
+        homework_id, frozen.modified_count,
+    )
+    # Frozen drafts count as turned in; a full recount, so repeating it is harmless
+    await completion.recount(homework_id)
+    await _notify(hw, EVENT_CLOSE)
+
+    await homeworks_collection.update_one({"_id": hw["_id"]}, {"$unset": {"close_pending": ""}})
+    if hw.get("due_at_utc"):
+        await _claim(homework_id, EVENT_CLOSE, hw["due_at_utc"])
+
+
+async def fire(homework_id: str, event: str, due: datetime) -> bool:
+    """Run one lifecycle event; True when it closed the homework."""
+    oid = ObjectId(homework_id)
+    if event == EVENT_REMIND:
+        if not await _claim(homework_id, event, due):
+            return False
+        hw = await homeworks_collection.find_one({"_id": oid, "status": "active", "due_at_utc": due})
+        if hw:
+            await _notify(hw, event)
+        return False
+
+    # The conditional flip runs once per deadline, whichever process gets it
+    hw = await homeworks_collection.find_one_and_update(
+        {"_id": oid, "status": "active", "due_at_utc": due},
+        {"$set": {
+            "status": "closed",
+            "closed_at": datetime.utcnow(),
+            "grading_status": "queued",
+            "close_pending": True,
+        }},
+        return_document=ReturnDocument.AFTER,
+    )
+    if not hw:
+        # Deleted, rescheduled or already closed
+        return False
+    await _finish_close(hw)
+    return True
+
+
+scheduler = DueDateScheduler()
@@ -0,0 +1,447 @@
+import asyncio
+import bisect
+import logging
+import math
+import re
+import unicodedata
+from collections import Counter
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from bson import ObjectId
+
+from core.config import SEARCH_REBUILD_SECONDS
+from db.connection import cases_collection, forum_collection, forum_replies_collection, homeworks_collection
+
+logger = logging.getLogger(__name__)
+
+# In-process inverted index over forum threads and cases, ranked with
+# BM25. Mongo text indexes rank by their own term score and cannot match
+# prefixes, so each worker keeps its own index instead: built at startup,
+# updated right after writes made by this process and rebuilt every
+# SEARCH_REBUILD_SECONDS to pick up the other workers' writes.
+#
+# Documents are keyed "thread:<id>" / "case:<id>". Fields are weighted by
+# repeating their terms (a title word counts FIELD_WEIGHTS["title"] times).
+
+KIND_THREAD = "thread"
+KIND_CASE = "case"
+KINDS = (KIND_THREAD, KIND_CASE)
+
+K1 = 1.2
+B = 0.75
+FIELD_WEIGHTS = {"title": 3, "tags": 2, "case_type": 2, "body": 1}
+# Terms a trailing prefix may expand to (the most common ones win)
+MAX_EXPANSIONS = 30
+EXCERPT_LENGTH = 200
+
+_TOKEN_RE = re.compile(r"\w+")
+STOPWORDS = frozenset(
+    "a an and are as at be by for from has have in is it its of on or that the this to was were will with".split()
+)
+
+_tasks = set()
+
+
+def _words(text) -> List[str]:
+    return _TOKEN_RE.findall(unicodedata.normalize("NFKC", str(text)).casefold()) if text else []
+
+
+def _keep(term: str) -> bool:
+    return term not in STOPWORDS and (len(term) > 1 or term.isdigit())
+
+
+def tokenize(text) -> List[str]:
+    return [t for t in _words(text) if _keep(t)]
+
+
+def split_prefix(q: str) -> Tuple[List[str], Optional[str]]:
+    """
+    Finished query words, and the word still being typed (None once the
+    query ends in a space). The unfinished word may be a single letter or
+    look like a stopword; it is only ever used as a prefix.
+    """
+    words = _words(q)
+    if not words or not (q[-1].isalnum() or q[-1] == "_"):
+        return [w for w in words if _keep(w)], None
+    return [w for w in words[:-1] if _keep(w)], words[-1]
+
+
+def _weighted_terms(fields: Dict[str, Iterable[str]]) -> Counter:
+    terms = Counter()
+    for field, texts in fields.items():
+        weight = FIELD_WEIGHTS[field]
+        for text in texts:
+            for term in tokenize(text):
+                terms[term] += weight
+    return terms
+
+
+def _excerpt(text) -> str:
+    return " ".join(str(text or "").split())[:EXCERPT_LENGTH]
+
+
+def thread_entry(thread: dict, replies: List[str]) -> dict:
+    tags = [t for t in thread.get("tags") or [] if isinstance(t, str)]
+    return {
+        "kind": KIND_THREAD,
+        "id": str(thread["_id"]),
+        "title": thread.get("title") or "",
+        "excerpt": _excerpt(thread.get("content")),
+        "timestamp": thread.get("timestamp"),
+        "facets": {"tags": tags},
+        "terms": _weighted_terms({
+            "title": [thread.get("title")],
+            "tags": tags,
+            "body": [thread.get("content"), *replies],
+        }),
+    }
+
+
+def case_entry(case: dict) -> dict:
+    case_type = case.get("case_type")
+    return {
+        "kind": KIND_CASE,
+        "id": str(case["_id"]),
+        "title": case.get("title") or "",
+        "excerpt": _excerpt(case.get("description")),
+        "timestamp": case.get("created_at"),
+        "facets": {"case_type": [case_type] if case_type else []},
+        "terms": _weighted_terms({
+            "title": [case.get("title")],
+            "case_type": [case_type],
+            "body": [case.get("description")],
+        }),
+    }
+
+
+def is_private(case: dict, homework: Optional[dict]) -> bool:
+    """Same rule as the case list: the homework's visibility wins over the case's."""
+    visibility = homework.get("visibility") if homework else case.get("visibility", "public")
+    return str(visibility or "public").strip().lower() == "private"
+
+
+class InvertedIndex:
+    """term -> {doc key: weighted tf}, plus a sorted term list for prefixes."""
+
+    def __init__(self):
+        self.docs: Dict[str, dict] = {}
+        self.postings: Dict[str, Dict[str, int]] = {}
+        self.terms: List[str] = []
+        self.total_length = 0
+
+    def put(self, entry: dict):
+        key = f"{entry['kind']}:{entry['id']}"
+        self.remove(key)
+        terms = entry.pop("terms")
+        entry["length"] = sum(terms.values())
+        entry["term_list"] = list(terms)
+        self.docs[key] = entry
+        self.total_length += entry["length"]
+        for term, tf in terms.items():
+            posting = self.postings.get(term)
+            if posting is None:
+                posting = self.postings[term] = {}
+                bisect.insort(self.terms, term)
+            posting[key] = tf
+
+    def remove(self, key: str):
+        entry = self.docs.pop(key, None)
+        if entry is None:
+            return
+        self.total_length -= entry["length"]
+        for term in entry["term_list"]:
+            posting = self.postings.get(term)
+            if posting is None:
+                continue
+            posting.pop(key, None)
+            if not posting:
+                del self.postings[term]
+                i = bisect.bisect_left(self.terms, term)
+                if i < len(self.terms) and self.terms[i] == term:
+                    del self.terms[i]
+
+    def expand(self, prefix: str, limit: int = MAX_EXPANSIONS) -> List[str]:
+        """Indexed terms starting with `prefix` (the `limit` most frequent ones)."""
+        start = bisect.bisect_left(self.terms, prefix)
+        end = bisect.bisect_left(self.terms, prefix + "\U0010ffff")
+        matches = self.terms[start:end]
+        if len(matches) > limit:
+            matches = sorted(matches, key=lambda t: -len(self.postings[t]))[:limit]
+        return matches
+
+    def _idf(self, term: str) -> float:
+        n, df = len(self.docs), len(self.postings.get(term, ()))
+        return math.log(1 + (n - df + 0.5) / (df + 0.5))
+
+    def score(self, groups: List[List[str]]) -> Dict[str, float]:
+        """
+        BM25 over query term groups. A group is one query word, or the
+        expansions of a trailing prefix; a document scores its best
+        matching term of each group.
+        """
+        if not self.docs:
+            return {}
+        avg_length = self.total_length / len(self.docs) or 1.0
+        scores: Dict[str, float] = {}
+        for group in groups:
+            best: Dict[str, float] = {}
+            for term in group:
+                idf = self._idf(term)
+                for key, tf in self.postings.get(term, {}).items():
+                    norm = K1 * (1 - B + B * self.docs[key]["length"] / avg_length)
+                    value = idf * tf * (K1 + 1) / (tf + norm)
+                    if value > best.get(key, 0.0):
+                        best[key] = value
+            for key, value in best.items():
+                scores[key] = scores.get(key, 0.0) + value
+        return scores
+
+
+def _query_groups(index: InvertedIndex, q: str, prefix: bool) -> List[List[str]]:
+    # "chest pa" searches for chest + any word starting with "pa"
+    if not prefix:
+        return [[w] for w in tokenize(q)]
+    words, partial = split_prefix(q)
+    groups = [[w] for w in words]
+    if partial:
+        expansions = index.expand(partial)
+        if expansions:
+            groups.append(expansions)
+        elif _keep(partial):
+            groups.append([partial])
+    return groups
+
+
+def _facet_counts(index: InvertedIndex, keys: Iterable[str]) -> Dict[str, Dict[str, int]]:
+    counts: Dict[str, Counter] = {"kind": Counter(), "tags": Counter(), "case_type": Counter()}
+    for key in keys:
+        entry = index.docs[key]
+        counts["kind"][entry["kind"]] += 1
+        for facet, values in entry["facets"].items():
+            counts[facet].update(values)
+    return {facet: dict(c.most_common()) for facet, c in counts.items()}
+
+
+def _matches_facets(entry: dict, tags: List[str], case_types: List[str]) -> bool:
+    if tags and not set(tags).intersection(entry["facets"].get("tags", ())):
+        return False
+    if case_types and not set(case_types).intersection(entry["facets"].get("case_type", ())):
+        return False
+    return True
+
+
+async def _load_entries() -> List[dict]:
+    replies: Dict[str, List[str]] = {}
+    async for reply in forum_replies_collection.find({}, {"thread_id": 1, "content": 1}):
+        replies.setdefault(reply["thread_id"], []).append(reply.get("content") or "")
+    homeworks: Dict[str, dict] = {}
+    async for hw in homeworks_collection.find({}, {"case_id": 1, "visibility": 1}).sort("_id", 1):
+        homeworks.setdefault(str(hw.get("case_id")), hw)
+
+    threads = await forum_collection.find(
+        {}, {"title": 1, "content": 1, "tags": 1, "timestamp": 1}
+    ).to_list(None)
+    cases = await cases_collection.find(
+        {}, {"title": 1, "description": 1, "case_type": 1, "visibility": 1, "created_at": 1}
+    ).to_list(None)
+
+    def build():
+        entries = [thread_entry(t, replies.get(str(t["_id"]), [])) for t in threads]
+        entries += [case_entry(c) for c in cases if not is_private(c, homeworks.get(str(c["_id"])))]
+        return entries
+
+    return await asyncio.to_thread(build)
+
+
+class SearchIndex:
+    """
+    The process-wide index and its lifecycle. Writes made while a rebuild
+    is loading are remembered and replayed onto the new index, so the swap
+    never loses them.
+    """
+
+    def __init__(self, rebuild_seconds: float):
+        self.rebuild_seconds = rebuild_seconds
+        self._index = InvertedIndex()
+        self._ready = asyncio.Event()
+        self._rebuilding = False
+        self._dirty = set()
+        self._task: Optional[asyncio.Task] = None
+
+    # -------- lifecycle --------
+
+    async def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        while True:
+            try:
+                await self.rebuild()
+            except Exception:
+                logger.exception("search index rebuild failed")
+                # Serve whatever is indexed rather than block searches
+                self._ready.set()
+            await asyncio.sleep(self.rebuild_seconds)
+
+    async def rebuild(self) -> dict:
+        self._rebuilding = True
+        self._dirty = set()
+        try:
+            entries = await _load_entries()
+        finally:
+            self._rebuilding = False
+
+        index = InvertedIndex()
+        for entry in entries:
+            index.put(entry)
+        self._index = index
+        self._ready.set()
+
+        dirty, self._dirty = self._dirty, set()
+        for kind, item_id in dirty:
+            await self.refresh(kind, item_id)
+        logger.info("search index rebuilt: %d documents, %d terms", len(index.docs), len(index.terms))
+        return {"documents": len(index.docs), "terms": len(index.terms)}
+
+    # -------- incremental updates --------
+
+    async def refresh(self, kind: str, item_id):
+        """Re-read one thread or case and update (or drop) its entry."""
+        item_id = str(item_id)
+        if self._rebuilding:
+            self._dirty.add((kind, item_id))
+        entry = None
+        if ObjectId.is_valid(item_id):
+            if kind == KIND_THREAD:
+                entry = await self._load_thread(item_id)
+            else:
+                entry = await self._load_case(item_id)
+        if entry:
+            self._index.put(entry)
+        else:
+            self._index.remove(f"{kind}:{item_id}")
+
+    def refresh_soon(self, kind: str, item_id):
+        """refresh() in the background, so the request does not wait on it."""
+        task = asyncio.create_task(self._refresh_logged(kind, item_id))
+        _tasks.add(task)
+        task.add_done_callback(_tasks.discard)
+
+    def remove(self, kind: str, item_id):
+        item_id = str(item_id)
+        if self._rebuilding:
+            self._dirty.add((kind, item_id))
+        self._index.remove(f"{kind}:{item_id}")
+
+    async def _refresh_logged(self, kind: str, item_id):
+        try:
+            await self.refresh(kind, item_id)
+        except Exception:
+            logger.exception("search index update failed for %s %s", kind, item_id)
+
+    @staticmethod
+    async def _load_thread(thread_id: str) -> Optional[dict]:
+        thread = await forum_collection.find_one(
+            {"_id": ObjectId(thread_id)}, {"title": 1, "content": 1, "tags": 1, "timestamp": 1}
+        )
+        if not thread:
+            return None
+        replies = [
+            r.get("content") or ""
+            async for r in forum_replies_collection.find({"thread_id": thread_id}, {"content": 1})
+        ]
+        return thread_entry(thread, replies)
+
+    @staticmethod
+    async def _load_case(case_id: str) -> Optional[dict]:
+        case, homework = await asyncio.gather(
+            cases_collection.find_one({"_id": ObjectId(case_id)}),
+            homeworks_collection.find_one({"case_id": case_id}, {"visibility": 1}, sort=[("_id", 1)]),
+        )
+        if not case or is_private(case, homework):
+            return None
+        return case_entry(case)
+
+    # -------- queries --------
+
+    async def search(
+        self,
+        q: str,
+        kind: Optional[str] = None,
+        tags: Optional[List[str]] = None,
+        case_types: Optional[List[str]] = None,
+        prefix: bool = True,
+        offset: int = 0,
+        limit: int = 20,
+    ) -> dict:
+        """
+        Ranked matches of `q`, with facet counts over every match of the
+        query and kind (before the tag / case type filters, so the other
+        choices stay visible).
+        """
+        await self._ready.wait()
+        index = self._index
+        scores = index.score(_query_groups(index, q, prefix))
+        if kind:
+            scores = {k: s for k, s in scores.items() if index.docs[k]["kind"] == kind}
+        facets = _facet_counts(index, scores)
+
+        ranked: List[Tuple[float, str]] = sorted(
+            ((-s, k) for k, s in scores.items() if _matches_facets(index.docs[k], tags or [], case_types or [])),
+        )
+        page = ranked[offset:offset + limit]
+        items = []
+        for neg_score, key in page:
+            entry = index.docs[key]
+            items.append({
+                "kind": entry["kind"],
+                "id": entry["id"],
+                "title": entry["title"],
+                "excerpt": entry["excerpt"],
+                "timestamp": entry["timestamp"],
+                **entry["facets"],
+                "score": round(-neg_score, 4),
+            })
+        next_offset = offset + limit if offset + limit < len(ranked) else None
+        return {"items": items, "total": len(ranked), "facets": facets, "next_offset": next_offset}
+
+    async def suggest(self, q: str, kind: Optional[str] = None, limit: int = 10) -> List[str]:
+        """
+        Completions of the last word of `q`, most common first among the
+        documents that match the words before it.
+        """
+        await self._ready.wait()
+        index = self._index
+        head, last = split_prefix(q)
+        if not last:
+            return []
+
+        candidates = None
+        for word in head:
+            keys = set(index.postings.get(word, ()))
+            candidates = keys if candidates is None else candidates & keys
+        if kind:
+            pool = candidates if candidates is not None else index.docs
+            candidates = {k for k in pool if index.docs[k]["kind"] == kind}
+
+        ranked = []
+        for term in index.expand(last, limit=max(MAX_EXPANSIONS, limit)):
+            posting = index.postings[term]
+            df = len(posting) if candidates is None else len(candidates.intersection(posting))
+            if df:
+                ranked.append((-df, term))
+        ranked.sort()
+        prefix_text = " ".join(head)
+        return [f"{prefix_text} {term}".strip() for _, term in ranked[:limit]]
+
+
+search_index = SearchIndex(SEARCH_REBUILD_SECONDS)
@@ -0,0 +1,355 @@
+import asyncio
+import hashlib
+import logging
+import time
+import zlib
+from datetime import datetime
+from itertools import combinations
+from typing import Dict, List, Tuple
+
+from bson import Binary, ObjectId
+from fastapi import HTTPException
+from pymongo import DeleteMany, ReplaceOne
+
+from core.config import SIMILARITY_MIN_TOKENS, SIMILARITY_THRESHOLD
+from core.grading import normalize_answer
+from db.connection import (
+    answer_signatures_collection,
+    homeworks_collection,
+    jobs_collection,
+    qna_collection,
+    similarity_pairs_collection,
+    submissions_collection,
+    users_collection,
+)
+
+logger = logging.getLogger(__name__)
+
+# Near-duplicate free-text answers, per homework and question.
+#
+# Each answer is reduced to a MinHash signature over its word 3-grams; the
+# signature is cut into bands and answers sharing any band hash are
+# candidates, so only those pairs are compared instead of all n^2.
+#
+#   answer_signatures: {"_id": "<homework_id>:<q>:<user_id>", "homework_id",
+#       "question_index", "user_id", "signature", "bands", "updated_at"}
+#   similarity_pairs:  {"_id": "<homework_id>:<q>:<user_a>:<user_b>",
+#       "homework_id", "question_index", "users", "similarity", "updated_at"}
+#
+# A full run (background job) rebuilds both for a homework; each submit
+# re-indexes just that student's answers.
+
+JOB_KIND = "answer_similarity"
+QUESTION_TYPES = ("short", "essay")
+SHINGLE_SIZE = 3
+NUM_PERM = 128
+# 16 bands of 8 rows: pairs around Jaccard 0.7 become candidates
+BANDS = 16
+ROWS = NUM_PERM // BANDS
+# Buckets holding more answers than this (e.g. a pasted model answer) are
+# compared against their first member only, to stay near-linear
+MAX_BUCKET_PAIRS = 50
+
+_PRIME = (1 << 61) - 1
+# Fixed seed: stored signatures must stay comparable across restarts
+_SEED = 0x5EED
+_params = None
+
+_tasks = set()
+
+
+def _permutations():
+    global _params
+    if _params is None:
+        import numpy as np
+
+        rng = np.random.default_rng(_SEED)
+        _params = (
+            rng.integers(1, 1 << 31, size=NUM_PERM, dtype=np.uint64),
+            rng.integers(0, 1 << 31, size=NUM_PERM, dtype=np.uint64),
+        )
+    return _params
+
+
+def shingles(text) -> List[int]:
+    """crc32 of each word 3-gram of the normalized answer; [] if too short to judge."""
+    tokens = normalize_answer(text).split()
+    if len(tokens) < SIMILARITY_MIN_TOKENS:
+        return []
+    grams = {" ".join(tokens[i:i + SHINGLE_SIZE]) for i in range(len(tokens) - SHINGLE_SIZE + 1)}
+    return [zlib.crc32(g.encode("utf-8")) for g in grams]
+
+
+def minhash(hashes: List[int]):
+    """NUM_PERM-long uint64 signature: min of (a*x + b) mod p over the shingles."""
+    import numpy as np
+
+    a, b = _permutations()
+    x = np.asarray(hashes, dtype=np.uint64)
+    # a, b < 2^31 and x < 2^32, so a*x + b cannot overflow uint64
+    return ((np.outer(a, x) + b[:, None]) % _PRIME).min(axis=1)
+
+
+def band_keys(signature) -> List[str]:
+    return [
+        f"{i}:{hashlib.blake2b(signature[i * ROWS:(i + 1) * ROWS].tobytes(), digest_size=8).hexdigest()}"
+        for i in range(BANDS)
+    ]
+
+
+def estimate(sig_a, sig_b) -> float:
+    """Estimated Jaccard similarity: share of agreeing signature slots."""
+    return float((sig_a == sig_b).mean())
+
+
+def _from_binary(data: bytes):
+    import numpy as np
+
+    return np.frombuffer(data, dtype=np.uint64)
+
+
+def _signatures(questions: List[dict], rows: List[Tuple[str, list]]) -> Dict[int, Dict[str, object]]:
+    """question index -> {user_id: signature} for every answer long enough to compare."""
+    targets = {i for i, q in enumerate(questions) if q.get("type") in QUESTION_TYPES}
+    out: Dict[int, Dict[str, object]] = {}
+    for user_id, answers in rows:
+        for item in answers or []:
+            if not isinstance(item, dict) or item.get("index") not in targets:
+                continue
+            hashes = shingles(item.get("value"))
+            if hashes:
+                out.setdefault(item["index"], {})[user_id] = minhash(hashes)
+    return out
+
+
+def _similar_pairs(signatures: Dict[str, object]) -> Dict[Tuple[str, str], float]:
+    """LSH over one question's signatures; verified pairs above the threshold."""
+    buckets: Dict[str, List[str]] = {}
+    for user_id, sig in signatures.items():
+        for key in band_keys(sig):
+            buckets.setdefault(key, []).append(user_id)
+
+    pairs: Dict[Tuple[str, str], float] = {}
+    for members in buckets.values():
+        if len(members) < 2:
+            continue
+        if len(members) > MAX_BUCKET_PAIRS:
+            candidates = ((members[0], other) for other in members[1:])
+        else:
+            candidates = combinations(members, 2)
+        for a, b in candidates:
+            pair = (a, b) if a < b else (b, a)
+            if pair in pairs:
+                continue
+            score = estimate(signatures[a], signatures[b])
+            if score >= SIMILARITY_THRESHOLD:
+                pairs[pair] = score
+    return pairs
+
+
+def _pair_doc(homework_id: str, q: int, pair: Tuple[str, str], score: float, now: datetime) -> dict:
+    return {
+        "_id": f"{homework_id}:{q}:{pair[0]}:{pair[1]}",
+        "homework_id": homework_id,
+        "question_index": q,
+        "users": list(pair),
+        "similarity": round(score, 3),
+        "updated_at": now,
+    }
+
+
+def _signature_doc(homework_id: str, q: int, user_id: str, sig, now: datetime) -> dict:
+    return {
+        "_id": f"{homework_id}:{q}:{user_id}",
+        "homework_id": homework_id,
+        "question_index": q,
+        "user_id": user_id,
+        "signature": Binary(sig.tobytes()),
+        "bands": band_keys(sig),
+        "updated_at": now,
+    }
+
+
+async def _load(homework_id: str):
+    try:
+        hw = await homeworks_collection.find_one({"_id": ObjectId(homework_id)}, {"case_id": 1, "homework_type": 1})
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid homework id")
+    if not hw:
+        raise HTTPException(status_code=404, detail="Homework not found")
+    if hw.get("homework_type") != "Q&A":
+        return hw, []
+    qna = await qna_collection.find_one({"case_id": hw.get("case_id")}, {"questions": 1})
+    return hw, (qna or {}).get("questions") or []
+
+
+def _turned_in(query: dict) -> dict:
+    return {**query, "$or": [{"status": {"$ne": "draft"}}, {"frozen": True}]}
+
+
+async def analyze_homework(homework_id: str) -> dict:
+    """Rebuild the signatures and similar pairs of a whole homework (job body)."""
+    started = time.perf_counter()
+    _, questions = await _load(homework_id)
+    subs = await submissions_collection.find(
+        _turned_in({"homework_id": homework_id}), {"user_id": 1, "answers": 1}
+    ).to_list(None)
+
+    def compute():
+        signatures = _signatures(questions, [(str(s.get("user_id")), s.get("answers")) for s in subs])
+        return signatures, {q: _similar_pairs(sigs) for q, sigs in signatures.items()}
+
+    signatures, pairs = await asyncio.to_thread(compute)
+
+    now = datetime.utcnow()
+    sig_docs = [
+        _signature_doc(homework_id, q, user_id, sig, now)
+        for q, sigs in signatures.items()
+        for user_id, sig in sigs.items()
+    ]
+    pair_docs = [
+        _pair_doc(homework_id, q, pair, score, now)
+        for q, found in pairs.items()
+        for pair, score in found.items()
+    ]
+    for collection, docs in ((answer_signatures_collection, sig_docs), (similarity_pairs_collection, pair_docs)):
+        ops = [ReplaceOne({"_id": d["_id"]}, d, upsert=True) for d in docs]
+        ops.append(DeleteMany({"homework_id": homework_id, "_id": {"$nin": [d["_id"] for d in docs]}}))
+        await collection.bulk_write(ops, ordered=False)
+
+    elapsed_ms = round((time.perf_counter() - started) * 1000, 1)
+    logger.info(
+        "similarity for homework %s: %d answers, %d pairs in %sms",
+        homework_id, len(sig_docs), len(pair_docs), elapsed_ms,
+    )
+    return {
+        "homework_id": homework_id,
+        "submissions": len(subs),
+        "answers_indexed": len(sig_docs),
+        "pairs": len(pair_docs),
+        "elapsed_ms": elapsed_ms,
+    }
+
+
+async def index_submission(homework_id: str, user_id: str):
+    """Re-index one student's answers and refresh the pairs they are part of."""
+    _, questions = await _load(homework_id)
+    if not any(q.get("type") in QUESTION_TYPES for q in questions):
+        return
+    sub = await submissions_collection.find_one(
+        _turned_in({"homework_id": homework_id, "user_id": user_id}), {"answers": 1}
+    )
+    signatures = await asyncio.to_thread(
+        _signatures, questions, [(user_id, sub.get("answers"))] if sub else []
+    )
+
+    now = datetime.utcnow()
+    sig_ops, pair_ops = [], []
+    for q, question in enumerate(questions):
+        if question.get("type") not in QUESTION_TYPES:
+            continue
+        sig_id = f"{homework_id}:{q}:{user_id}"
+        scope = {"homework_id": homework_id, "question_index": q}
+        pair_ops.append(DeleteMany({**scope, "users": user_id}))
+        sig = (signatures.get(q) or {}).get(user_id)
+        if sig is None:
+            sig_ops.append(DeleteMany({"_id": sig_id}))
+            continue
+        doc = _signature_doc(homework_id, q, user_id, sig, now)
+        sig_ops.append(ReplaceOne({"_id": sig_id}, doc, upsert=True))
+        cursor = answer_signatures_collection.find(
+            {**scope, "bands": {"$in": doc["bands"]}, "user_id": {"$ne": user_id}},
+            {"user_id": 1, "signature": 1},
+        )
+        async for other in cursor:
+            score = estimate(sig, _from_binary(other["signature"]))
+            if score >= SIMILARITY_THRESHOLD:
+                pair = tuple(sorted((user_id, other["user_id"])))
+                pair_ops.append(ReplaceOne(
+                    {"_id": f"{homework_id}:{q}:{pair[0]}:{pair[1]}"},
+                    _pair_doc(homework_id, q, pair, score, now),
+                    upsert=True,
+                ))
+    if sig_ops:
+        await answer_signatures_collection.bulk_write(sig_ops, ordered=False)
+    if pair_ops:
+        # Ordered: the student's old pairs go before the fresh ones are written
+        await similarity_pairs_collection.bulk_write(pair_ops, ordered=True)
+
+
+def index_submission_soon(homework_id: str, user_id: str):
+    """Fire-and-forget index_submission after a submit; failures only log."""
+    async def run():
+        try:
+            await index_submission(homework_id, user_id)
+        except Exception:
+            logger.exception("similarity: failed to index %s for homework %s", user_id, homework_id)
+
+    task = asyncio.create_task(run())
+    _tasks.add(task)
+    task.add_done_callback(_tasks.discard)
+
+
+async def drop(homework_ids):
+    homework_ids = [str(h) for h in homework_ids]
+    await answer_signatures_collection.delete_many({"homework_id": {"$in": homework_ids}})
+    await similarity_pairs_collection.delete_many({"homework_id": {"$in": homework_ids}})
+
+
+def _clusters(pairs: List[dict]) -> List[dict]:
+    """Connected groups of students per question (union-find over the pairs)."""
+    parent: Dict[Tuple[int, str], Tuple[int, str]] = {}
+
+    def find(node):
+        parent.setdefault(node, node)
+        while parent[node] != node:
+            parent[node] = parent[parent[node]]
+            node = parent[node]
+        return node
+
+    for p in pairs:
+        q = p["question_index"]
+        a, b = find((q, p["users"][0])), find((q, p["users"][1]))
+        if a != b:
+            parent[a] = b
+
+    groups: Dict[Tuple[int, str], dict] = {}
+    for p in pairs:
+        root = find((p["question_index"], p["users"][0]))
+        group = groups.setdefault(root, {"question_index": p["question_index"], "users": set(), "pairs": 0, "max_similarity": 0.0})
+        group["users"].update(p["users"])
+        group["pairs"] += 1
+        group["max_similarity"] = max(group["max_similarity"], p["similarity"])
+    clusters = [{**g, "users": sorted(g["users"])} for g in groups.values()]
+    clusters.sort(key=lambda g: (-g["max_similarity"], -len(g["users"]), g["question_index"]))
+    return clusters
+
+
+async def similarity_report(homework_id: str) -> dict:
+    """Stored pairs and clusters of a homework, with student names, for the review screen."""
+    await _load(homework_id)
+    pairs = await similarity_pairs_collection.find(
+        {"homework_id": homework_id}, {"_id": 0, "homework_id": 0}
+    ).sort("similarity", -1).to_list(None)
+
+    user_ids = {u for p in pairs for u in p["users"]}
+    oids = [ObjectId(u) for u in user_ids if ObjectId.is_valid(u)]
+    names = {
+        str(u["_id"]): " ".join(x for x in (u.get("firstName"), u.get("lastName")) if x)
+        async for u in users_collection.find({"_id": {"$in": oids}}, {"firstName": 1, "lastName": 1})
+    }
+    last_run = await jobs_collection.find_one(
+        {"kind": JOB_KIND, "params.homework_id": homework_id},
+        {"status": 1, "result": 1, "created_at": 1, "finished_at": 1},
+        sort=[("created_at", -1)],
+    )
+    if last_run:
+        last_run["job_id"] = str(last_run.pop("_id"))
+    return {
+        "homework_id": homework_id,
+        "threshold": SIMILARITY_THRESHOLD,
+        "students": {u: names.get(u) or u for u in sorted(user_ids)},
+        "clusters": _clusters(pairs),
+        "pairs": pairs,
+        "last_run": last_run,
+    }
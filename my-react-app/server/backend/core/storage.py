@@ -0,0 +1,322 @@
+import asyncio
+import os
+import shutil
+from abc import ABC, abstractmethod
+from pathlib import Path
+from typing import AsyncIterator, Optional
+from urllib.parse import quote, unquote
+from uuid import uuid4
+
+from fastapi import HTTPException, Request, UploadFile
+from fastapi.responses import RedirectResponse, Response
+
+from core.cache import TTLCache
+from core.config import (
+    UPLOAD_ROOT,
+    UPLOAD_TMP_ROOT,
+    MAX_UPLOAD_SIZE,
+    UPLOAD_CHUNK_SIZE,
+    PUBLIC_BASE_URL,
+    STORAGE_BACKEND,
+    S3_BUCKET,
+    S3_ENDPOINT_URL,
+    S3_REGION,
+    S3_ACCESS_KEY_ID,
+    S3_SECRET_ACCESS_KEY,
+    S3_PUBLIC_BASE_URL,
+    S3_PRESIGN_EXPIRES,
+)
+from core.media import ENCODINGS, IMMUTABLE_CACHE, media_response, resolve_under, write_gzip_variant
+from core.uploads import StoredUpload, claim_upload, save_upload, unlink_quietly
+
+
+class StorageBackend(ABC):
+    """
+    Where uploaded bytes live. Keys are "/"-separated paths relative to the
+    store root, e.g. "blobs/ab/<sha256>.png" or "<userId>/profile_photos/x.png".
+    Every stored key is reachable at `public_url(key)`, which goes through the
+    /uploads route unless the backend has its own public endpoint.
+    Drivers implement the abstract methods; the rest have defaults.
+    """
+
+    name = "base"
+
+    @abstractmethod
+    async def put_file(
+        self,
+        key: str,
+        src: Path,
+        *,
+        content_type: Optional[str] = None,
+        immutable: bool = False,
+        precompress: bool = False,
+    ):
+        """Move a local (temp) file into the store under `key`."""
+
+    @abstractmethod
+    async def delete(self, key: str):
+        """Remove `key`; a missing key is not an error."""
+
+    @abstractmethod
+    async def exists(self, key: str) -> bool:
+        """Whether `key` holds an object."""
+
+    @abstractmethod
+    def iter_bytes(self, key: str, start: int = 0, end: Optional[int] = None) -> AsyncIterator[bytes]:
+        """Stream bytes `start`..`end` (inclusive) of the object; drivers write it as an async generator."""
+
+    @abstractmethod
+    async def fetch_to(self, key: str, dest: Path):
+        """Copy the object to a local file (e.g. for decoding)."""
+
+    async def download_url(self, key: str, expires: Optional[int] = None) -> str:
+        """A URL clients can fetch the bytes from directly."""
+        return self.public_url(key)
+
+    def local_path(self, key: str) -> Optional[Path]:
+        """Filesystem path for backends that have one, else None."""
+        return None
+
+    def public_url(self, key: str) -> str:
+        return f"{PUBLIC_BASE_URL}/uploads/{quote(key)}"
+
+
+# ====================================================
+# Local filesystem
+# ====================================================
+
+class LocalStorage(StorageBackend):
+    name = "local"
+
+    def __init__(self, root: Path):
+        self.root = root
+        self.root.mkdir(parents=True, exist_ok=True)
+
+    def local_path(self, key: str) -> Path:
+        return resolve_under(self.root, key)
+
+    def _put(self, key: str, src: Path, precompress: bool):
+        dest = self.local_path(key)
+        dest.parent.mkdir(parents=True, exist_ok=True)
+        shutil.move(str(src), str(dest))
+        if precompress:
+            write_gzip_variant(dest)
+
+    async def put_file(self, key, src, *, content_type=None, immutable=False, precompress=False):
+        await asyncio.to_thread(self._put, key, src, precompress)
+
+    def _delete(self, key: str):
+        path = self.local_path(key)
+        for candidate in [path] + [path.with_name(path.name + suffix) for _, suffix in ENCODINGS]:
+            try:
+                candidate.unlink()
+            except FileNotFoundError:
+                pass
+
+    async def delete(self, key: str):
+        await asyncio.to_thread(self._delete, key)
+
+    async def exists(self, key: str) -> bool:
+        return await asyncio.to_thread(self.local_path(key).is_file)
+
+    async def iter_bytes(self, key, start=0, end=None):
+        from core.media import iter_file
+
+        async for chunk in iter_file(self.local_path(key), start, end):
+            yield chunk
+
+    async def fetch_to(self, key: str, dest: Path):
+        dest.parent.mkdir(parents=True, exist_ok=True)
+        await asyncio.to_thread(shutil.copyfile, self.local_path(key), dest)
+
+
+# ====================================================
+# S3-compatible object storage (AWS S3, MinIO, ...)
+# ====================================================
+
+class S3Storage(StorageBackend):
+    """
+    boto3 is synchronous, so every call is offloaded to a worker thread.
+    Path-style addressing keeps MinIO and other S3 stand-ins working.
+    """
+
+    name = "s3"
+
+    def __init__(
+        self,
+        bucket: str,
+        endpoint_url: Optional[str] = None,
+        region: Optional[str] = None,
+        access_key_id: Optional[str] = None,
+        secret_access_key: Optional[str] = None,
+        public_base_url: Optional[str] = None,
+        presign_expires: int = 3600,
+    ):
+        try:
+            import boto3
+            from botocore.config import Config
+        except ImportError:
+            raise RuntimeError("STORAGE_BACKEND=s3 requires boto3 to be installed")
+
+        self.bucket = bucket
+        self.public_base_url = public_base_url.rstrip("/") if public_base_url else None
+        self.presign_expires = presign_expires
+        self._client = boto3.client(
+            "s3",
+            endpoint_url=endpoint_url,
+            region_name=region,
+            aws_access_key_id=access_key_id,
+            aws_secret_access_key=secret_access_key,
+            config=Config(signature_version="s3v4", s3={"addressing_style": "path"}),
+        )
+        # Re-use a presigned URL for half its lifetime so browsers can cache it
+        self._presigned = TTLCache(maxsize=4096, ttl=max(presign_expires // 2, 1))
+
+    def public_url(self, key: str) -> str:
+        if self.public_base_url:
+            return f"{self.public_base_url}/{quote(key)}"
+        return super().public_url(key)
+
+    async def put_file(self, key, src, *, content_type=None, immutable=False, precompress=False):
+        extra = {}
+        if content_type:
+            extra["ContentType"] = content_type
+        if immutable:
+            extra["CacheControl"] = IMMUTABLE_CACHE
+        # upload_file switches to multipart for large files on its own
+        await asyncio.to_thread(self._client.upload_file, str(src), self.bucket, key, ExtraArgs=extra)
+        await asyncio.to_thread(os.remove, src)
+
+    async def delete(self, key: str):
+        await asyncio.to_thread(self._client.delete_object, Bucket=self.bucket, Key=key)
+        self._presigned.pop(key)
+
+    async def exists(self, key: str) -> bool:
+        from botocore.exceptions import ClientError
+
+        try:
+            await asyncio.to_thread(self._client.head_object, Bucket=self.bucket, Key=key)
+        except ClientError as e:
+            if e.response.get("Error", {}).get("Code") in ("404", "NoSuchKey", "NotFound"):
+                return False
+            raise
+        return True
+
+    async def iter_bytes(self, key, start=0, end=None):
+        params = {"Bucket": self.bucket, "Key": key}
+        if start or end is not None:
+            params["Range"] = f"bytes={start}-{'' if end is None else end}"
+        response = await asyncio.to_thread(self._client.get_object, **params)
+        body = response["Body"]
+        try:
+            while True:
+                chunk = await asyncio.to_thread(body.read, UPLOAD_CHUNK_SIZE)
+                if not chunk:
+                    break
+                yield chunk
+        finally:
+            body.close()
+
+    async def fetch_to(self, key: str, dest: Path):
+        dest.parent.mkdir(parents=True, exist_ok=True)
+        await asyncio.to_thread(self._client.download_file, self.bucket, key, str(dest))
+
+    async def download_url(self, key: str, expires: Optional[int] = None) -> str:
+        if expires is None:
+            cached = self._presigned.get(key)
+            if cached:
+                return cached
+        url = self._client.generate_presigned_url(
+            "get_object",
+            Params={"Bucket": self.bucket, "Key": key},
+            ExpiresIn=expires or self.presign_expires,
+        )
+        if expires is None:
+            self._presigned.set(key, url)
+        return url
+
+
+def create_storage() -> StorageBackend:
+    if STORAGE_BACKEND == "s3":
+        if not S3_BUCKET:
+            raise RuntimeError("STORAGE_BACKEND=s3 requires S3_BUCKET")
+        return S3Storage(
+            S3_BUCKET,
+            endpoint_url=S3_ENDPOINT_URL,
+            region=S3_REGION,
+            access_key_id=S3_ACCESS_KEY_ID,
+            secret_access_key=S3_SECRET_ACCESS_KEY,
+            public_base_url=S3_PUBLIC_BASE_URL,
+            presign_expires=S3_PRESIGN_EXPIRES,
+        )
+    return LocalStorage(UPLOAD_ROOT)
+
+
+storage = create_storage()
+
+
+# ====================================================
+# Helpers shared by the routes
+# ====================================================
+
+def _staging_path() -> Path:
+    UPLOAD_TMP_ROOT.mkdir(parents=True, exist_ok=True)
+    return UPLOAD_TMP_ROOT / f"{uuid4().hex}.staged"
+
+
+async def _put_staged(stored: StoredUpload, key: str, **put_kwargs) -> StoredUpload:
+    try:
+        await storage.put_file(key, stored.path, content_type=stored.content_type, **put_kwargs)
+    except BaseException:
+        await asyncio.to_thread(unlink_quietly, stored.path)
+        raise
+    stored.key = key
+    stored.path = storage.local_path(key)
+    return stored
+
+
+async def put_upload(
+    upload: UploadFile,
+    key: str,
+    *,
+    max_bytes: Optional[int] = MAX_UPLOAD_SIZE,
+    **put_kwargs,
+) -> StoredUpload:
+    """Stream an UploadFile into the configured store under `key`."""
+    stored = await save_upload(upload, _staging_path(), max_bytes=max_bytes)
+    return await _put_staged(stored, key, **put_kwargs)
+
+
+async def put_session(upload_id: str, key: str, **put_kwargs) -> StoredUpload:
+    """Move a completed resumable upload into the configured store."""
+    stored = await claim_upload(upload_id, _staging_path())
+    return await _put_staged(stored, key, **put_kwargs)
+
+
+def key_from_url(url: Optional[str]) -> Optional[str]:
+    """Storage key for a URL built by `public_url` (absolute or relative)."""
+    if not url or not isinstance(url, str):
+        return None
+    path = url.split("?", 1)[0]
+    remote_base = getattr(storage, "public_base_url", None)
+    if remote_base and path.startswith(remote_base + "/"):
+        return unquote(path[len(remote_base) + 1:])
+    if path.startswith(PUBLIC_BASE_URL + "/"):
+        path = path[len(PUBLIC_BASE_URL):]
+    if path.startswith("/uploads/"):
+        return unquote(path[len("/uploads/"):])
+    return None
+
+
+async def serve_key(request: Request, key: str, *, immutable: bool = False) -> Response:
+    """
+    Local files are streamed with ETag/range support; remote objects are
+    answered with a redirect to a presigned URL so the bytes never pass
+    through this process.
+    """
+    local = storage.local_path(key)
+    if local is not None:
+        return await media_response(request, local, immutable=immutable)
+    if not await storage.exists(key):
+        raise HTTPException(status_code=404, detail="File not found")
+    return RedirectResponse(await storage.download_url(key), status_code=307)
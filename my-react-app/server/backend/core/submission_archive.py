@@ -0,0 +1,219 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import re
+import uuid
+from collections import Counter
+from datetime import datetime
+from pathlib import Path, PurePosixPath
+from typing import AsyncIterator, Dict, List, Optional
+
+from bson import ObjectId
+from fastapi import HTTPException, Request
+from fastapi.responses import Response
+
+from core.config import EXPORT_CACHE_ROOT
+from core.media import media_response
+from core.storage import key_from_url, storage
+from db.connection import submissions_collection, users_collection
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = 200
+
+_UNSAFE_RE = re.compile(r'[\x00-\x1f<>:"/\\|?*]+')
+
+
+def _safe(part: str, fallback: str) -> str:
+    cleaned = _UNSAFE_RE.sub("_", part or "").strip(" .")
+    return cleaned[:100] or fallback
+
+
+def _query(homework_id: str) -> dict:
+    # Same population as the gradebook: submitted or frozen at the deadline
+    return {
+        "homework_id": homework_id,
+        "files.0": {"$exists": True},
+        "$or": [{"status": {"$ne": "draft"}}, {"frozen": True}],
+    }
+
+
+def _cursor(homework_id: str):
+    return submissions_collection.find(
+        _query(homework_id), {"user_id": 1, "files": 1, "updated_at": 1}
+    ).sort("user_id", 1).batch_size(BATCH_SIZE)
+
+
+async def archive_fingerprint(homework_id: str) -> str:
+    """
+    Stamp of the archive's contents: how many submissions it holds and the
+    latest updated_at among them, from one aggregate. Every write to a
+    submission bumps updated_at, and one leaving the archive changes the count.
+    """
+    stats = await submissions_collection.aggregate([
+        {"$match": _query(homework_id)},
+        {"$group": {"_id": None, "count": {"$sum": 1}, "latest": {"$max": "$updated_at"}}},
+    ]).to_list(1)
+    count, latest = (stats[0]["count"], stats[0]["latest"]) if stats else (0, None)
+    stamp = [homework_id, count, latest.isoformat() if isinstance(latest, datetime) else None]
+    return hashlib.sha256(json.dumps(stamp).encode()).hexdigest()
+
+
+async def _folders(batch: List[dict]) -> Dict[str, str]:
+    """Per-student folder names, "Last_First-<user_id>", resolved in one query per batch."""
+    oids = [ObjectId(s["user_id"]) for s in batch if ObjectId.is_valid(s.get("user_id"))]
+    users = {
+        str(u["_id"]): u
+        async for u in users_collection.find({"_id": {"$in": oids}}, {"firstName": 1, "lastName": 1})
+    }
+    folders = {}
+    for sub in batch:
+        user_id = str(sub.get("user_id"))
+        user = users.get(user_id) or {}
+        name = "_".join(p for p in (user.get("lastName"), user.get("firstName")) if p)
+        folders[user_id] = _safe(f"{name}-{user_id}" if name else user_id, "unknown")
+    return folders
+
+
+async def _once(data: bytes) -> AsyncIterator[bytes]:
+    yield data
+
+
+async def _stored(key: Optional[str]) -> bool:
+    """
+    Whether the archive can stream `key`. A key that escapes the store root
+    (e.g. a recorded "/uploads/../x") is refused like an absent file: the
+    response has already started, so raising here would truncate the ZIP.
+    """
+    if not key:
+        return False
+    try:
+        return await storage.exists(key)
+    except HTTPException:
+        return False
+
+
+async def iter_archive_entries(homework_id: str):
+    """(path in zip, mtime, chunks) for every submission file, grouped by student."""
+    missing = []
+
+    async def entries_for(batch):
+        folders = await _folders(batch)
+        for sub in batch:
+            folder = folders[str(sub.get("user_id"))]
+            seen = set()
+            for item in sub.get("files") or []:
+                if not isinstance(item, dict):
+                    continue
+                key = key_from_url(item.get("url"))
+                name = _safe(PurePosixPath(item.get("name") or key or "").name, "file")
+                stem, suffix = os.path.splitext(name)
+                n = 1
+                while name.lower() in seen:
+                    n += 1
+                    name = f"{stem} ({n}){suffix}"
+                seen.add(name.lower())
+                if not await _stored(key):
+                    missing.append(f"{folder}/{name}\t{item.get('url')}")
+                    continue
+                yield f"{folder}/{name}", sub.get("updated_at"), storage.iter_bytes(key)
+
+    batch: List[dict] = []
+    async for sub in _cursor(homework_id):
+        batch.append(sub)
+        if len(batch) >= BATCH_SIZE:
+            async for entry in entries_for(batch):
+                yield entry
+            batch = []
+    if batch:
+        async for entry in entries_for(batch):
+            yield entry
+
+    if missing:
+        report = "Files listed on a submission but no longer in storage:\n" + "\n".join(missing) + "\n"
+        yield "MISSING.txt", None, _once(report.encode("utf-8"))
+
+
+# ====================================================
+# Cached artifacts
+# ====================================================
+
+def _cache_dir(homework_id: str) -> Path:
+    return EXPORT_CACHE_ROOT / "submissions" / _safe(homework_id, "homework")
+
+
+def cached_archive(homework_id: str, fingerprint: str) -> Optional[Path]:
+    path = _cache_dir(homework_id) / f"{fingerprint}.zip"
+    return path if path.is_file() else None
+
+
+# Cached archives with downloads in flight; never pruned under a reader
+_serving: Counter = Counter()
+
+
+def _prune(directory: Path, keep: Path):
+    for old in directory.glob("*.zip"):
+        if old != keep and not _serving[old]:
+            old.unlink(missing_ok=True)
+
+
+def _release(path: Path):
+    _serving[path] -= 1
+    if _serving[path] <= 0:
+        del _serving[path]
+
+
+class _ServingArchive(Response):
+    """Sends `inner`, holding the cached file until it is done (or the client goes)."""
+
+    def __init__(self, inner: Response, path: Path):
+        self.inner = inner
+        self.path = path
+        self.status_code = inner.status_code
+        self.raw_headers = inner.raw_headers
+        self.background = inner.background
+
+    async def __call__(self, scope, receive, send):
+        self.inner.background = self.background
+        try:
+            await self.inner(scope, receive, send)
+        finally:
+            _release(self.path)
+
+
+async def serve_cached_archive(request: Request, path: Path, headers: dict) -> Response:
+    _serving[path] += 1
+    try:
+        response = await media_response(request, path, media_type="application/zip")
+    except BaseException:
+        _release(path)
+        raise
+    response.headers.update(headers)
+    return _ServingArchive(response, path)
+
+
+async def tee_to_cache(chunks: AsyncIterator[bytes], homework_id: str, fingerprint: str) -> AsyncIterator[bytes]:
+    """
+    Pass the archive through while writing a copy next to it; the copy is
+    only published once complete, so an aborted download leaves nothing.
+    """
+    directory = _cache_dir(homework_id)
+    await asyncio.to_thread(directory.mkdir, parents=True, exist_ok=True)
+    final = directory / f"{fingerprint}.zip"
+    partial = directory / f".{fingerprint}.{uuid.uuid4().hex}.part"
+    handle = await asyncio.to_thread(open, partial, "wb")
+    done = False
+    try:
+        async for chunk in chunks:
+            await asyncio.to_thread(handle.write, chunk)
+            yield chunk
+        done = True
+    finally:
+        await asyncio.to_thread(handle.close)
+        if done:
+            await asyncio.to_thread(os.replace, partial, final)
+            await asyncio.to_thread(_prune, directory, final)
+        else:
+            partial.unlink(missing_ok=True)
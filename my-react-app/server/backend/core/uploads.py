@@ -0,0 +1,385 @@
+import asyncio
+import hashlib
+import logging
+import os
+import shutil
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import AsyncIterator, Dict, Optional, Tuple
+from uuid import uuid4
+
+from fastapi import HTTPException, UploadFile
+from starlette.requests import ClientDisconnect
+
+from core.config import (
+    MAX_UPLOAD_SIZE,
+    UPLOAD_CHUNK_SIZE,
+    UPLOAD_SESSION_TTL_HOURS,
+    UPLOAD_SWEEP_SECONDS,
+    UPLOAD_TMP_ROOT,
+)
+from db.connection import upload_sessions_collection
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class StoredUpload:
+    path: Path
+    size: int
+    sha256: str
+    content_type: Optional[str] = None
+    filename: Optional[str] = None
+    # Storage key once the file has been handed to core.storage
+    key: Optional[str] = None
+
+
+def _too_large(max_bytes: int) -> HTTPException:
+    limit_mb = max_bytes / (1024 * 1024)
+    return HTTPException(status_code=413, detail=f"File too large (max {limit_mb:g}MB)")
+
+
+def _write_chunk(handle, hasher, chunk: bytes):
+    # Runs in a worker thread: hashing large chunks releases the GIL too.
+    handle.write(chunk)
+    if hasher is not None:
+        hasher.update(chunk)
+
+
+async def iter_upload(upload: UploadFile, chunk_size: int = UPLOAD_CHUNK_SIZE) -> AsyncIterator[bytes]:
+    """Yield an UploadFile in fixed-size chunks instead of one `read()`."""
+    while True:
+        chunk = await upload.read(chunk_size)
+        if not chunk:
+            break
+        yield chunk
+
+
+async def stream_to_file(
+    chunks: AsyncIterator[bytes],
+    dest: Path,
+    *,
+    max_bytes: Optional[int] = MAX_UPLOAD_SIZE,
+    append: bool = False,
+    hasher=None,
+    start_size: int = 0,
+) -> int:
+    """
+    Write `chunks` to `dest` through a thread-offloaded writer.
+    The size limit is enforced while streaming, so oversized bodies are
+    rejected without ever being held in memory. Returns bytes written.
+    """
+    dest.parent.mkdir(parents=True, exist_ok=True)
+    handle = await asyncio.to_thread(open, dest, "ab" if append else "wb")
+    written = 0
+    try:
+        async for chunk in chunks:
+            written += len(chunk)
+            if max_bytes is not None and start_size + written > max_bytes:
+                raise _too_large(max_bytes)
+            await asyncio.to_thread(_write_chunk, handle, hasher, chunk)
+    finally:
+        await asyncio.to_thread(handle.close)
+    return written
+
+
+async def save_upload(
+    upload: UploadFile,
+    dest: Path,
+    *,
+    max_bytes: Optional[int] = MAX_UPLOAD_SIZE,
+) -> StoredUpload:
+    """
+    Stream an UploadFile to `dest`, hashing it on the fly.
+    The file is written to a temp name first and renamed into place, so a
+    rejected or interrupted upload never replaces an existing file.
+    """
+    hasher = hashlib.sha256()
+    tmp_path = dest.with_name(f".{dest.name}.{uuid4().hex}.part")
+    try:
+        size = await stream_to_file(iter_upload(upload), tmp_path, max_bytes=max_bytes, hasher=hasher)
+        await asyncio.to_thread(os.replace, tmp_path, dest)
+    except BaseException:
+        await asyncio.to_thread(unlink_quietly, tmp_path)
+        raise
+
+    return StoredUpload(
+        path=dest,
+        size=size,
+        sha256=hasher.hexdigest(),
+        content_type=upload.content_type,
+        filename=upload.filename,
+    )
+
+
+async def hash_upload(upload: UploadFile, *, max_bytes: Optional[int] = MAX_UPLOAD_SIZE) -> Tuple[str, int]:
+    """
+    Hash an UploadFile without writing it anywhere, then rewind it.
+    Lets callers detect duplicates before touching the disk.
+    """
+    hasher = hashlib.sha256()
+    size = 0
+    async for chunk in iter_upload(upload):
+        size += len(chunk)
+        if max_bytes is not None and size > max_bytes:
+            raise _too_large(max_bytes)
+        await asyncio.to_thread(hasher.update, chunk)
+    await upload.seek(0)
+    return hasher.hexdigest(), size
+
+
+def unlink_quietly(path: Path):
+    try:
+        path.unlink()
+    except FileNotFoundError:
+        pass
+
+
+def hash_file(path: Path, hasher=None, limit: Optional[int] = None):
+    """Feed the first `limit` bytes of `path` (all if None) into `hasher`."""
+    hasher = hasher or hashlib.sha256()
+    remaining = limit
+    with open(path, "rb") as f:
+        while remaining is None or remaining > 0:
+            size = UPLOAD_CHUNK_SIZE if remaining is None else min(UPLOAD_CHUNK_SIZE, remaining)
+            chunk = f.read(size)
+            if not chunk:
+                break
+            hasher.update(chunk)
+            if remaining is not None:
+                remaining -= len(chunk)
+    return hasher
+
+
+# ====================================================
+# Resumable uploads (tus-style offsets)
+# ====================================================
+
+# Hash state of in-flight sessions, keyed by upload id -> (offset, hasher).
+# Lost on restart; the prefix is then re-hashed from disk once.
+_session_hashers: Dict[str, Tuple[int, object]] = {}
+_session_locks: Dict[str, asyncio.Lock] = {}
+
+SESSION_TTL = timedelta(hours=UPLOAD_SESSION_TTL_HOURS)
+
+
+def incoming_path(upload_id: str) -> Path:
+    return UPLOAD_TMP_ROOT / f"{upload_id}.part"
+
+
+def _file_size(path: Path) -> int:
+    try:
+        return path.stat().st_size
+    except FileNotFoundError:
+        return 0
+
+
+async def create_session(
+    length: int,
+    filename: Optional[str] = None,
+    content_type: Optional[str] = None,
+    owner_id: Optional[str] = None,
+    max_bytes: Optional[int] = MAX_UPLOAD_SIZE,
+) -> dict:
+    if length < 0:
+        raise HTTPException(status_code=400, detail="Invalid Upload-Length")
+    if max_bytes is not None and length > max_bytes:
+        raise _too_large(max_bytes)
+
+    upload_id = uuid4().hex
+    timestamp = datetime.utcnow()
+    session = {
+        "_id": upload_id,
+        "length": length,
+        "offset": 0,
+        "filename": Path(filename).name if filename else None,
+        "content_type": content_type,
+        "owner_id": owner_id,
+        "status": "pending",
+        "created_at": timestamp,
+        "updated_at": timestamp,
+        "expires_at": timestamp + SESSION_TTL,
+    }
+    UPLOAD_TMP_ROOT.mkdir(parents=True, exist_ok=True)
+    await asyncio.to_thread(incoming_path(upload_id).touch)
+    await upload_sessions_collection.insert_one(session)
+    return session
+
+
+def _expired(session: dict, now: datetime) -> bool:
+    expires_at = session.get("expires_at") or (session.get("updated_at") or now) + SESSION_TTL
+    return expires_at <= now
+
+
+async def get_session(upload_id: str) -> dict:
+    session = await upload_sessions_collection.find_one({"_id": upload_id})
+    if not session or _expired(session, datetime.utcnow()):
+        raise HTTPException(status_code=404, detail="Upload not found")
+    # The bytes on disk are the source of truth for the offset.
+    session["offset"] = await asyncio.to_thread(_file_size, incoming_path(upload_id))
+    return session
+
+
+def check_owner(session: dict, owner_id: Optional[str]):
+    """Sessions started with a user id are only usable by that user."""
+    owner = session.get("owner_id")
+    if owner and str(owner_id or "") != str(owner):
+        raise HTTPException(status_code=403, detail="Upload belongs to another user")
+
+
+async def _resume_hasher(upload_id: str, offset: int):
+    cached = _session_hashers.get(upload_id)
+    if cached and cached[0] == offset:
+        return cached[1]
+    return await asyncio.to_thread(hash_file, incoming_path(upload_id), None, offset)
+
+
+async def append_to_session(
+    upload_id: str, offset: int, chunks: AsyncIterator[bytes], owner_id: Optional[str] = None
+) -> dict:
+    """
+    Append a PATCH body at `offset`. Bytes that arrived before a client
+    disconnect are kept, so the client resumes from the new offset.
+    """
+    lock = _session_locks.setdefault(upload_id, asyncio.Lock())
+    async with lock:
+        session = await get_session(upload_id)
+        check_owner(session, owner_id)
+        current = session["offset"]
+        if offset != current:
+            raise HTTPException(status_code=409, detail=f"Upload-Offset mismatch (server has {current})")
+        if session.get("status") == "complete":
+            return session
+
+        part = incoming_path(upload_id)
+        hasher = await _resume_hasher(upload_id, current)
+        try:
+            await stream_to_file(
+                chunks, part, max_bytes=session["length"], append=True, hasher=hasher, start_size=current
+            )
+        except ClientDisconnect:
+            pass
+        except BaseException:
+            _session_hashers.pop(upload_id, None)
+            raise
+        finally:
+            new_offset = await asyncio.to_thread(_file_size, part)
+
+        _session_hashers[upload_id] = (new_offset, hasher)
+        now = datetime.utcnow()
+        # Progress keeps a session alive
+        update_doc = {"offset": new_offset, "updated_at": now, "expires_at": now + SESSION_TTL}
+        if new_offset == session["length"]:
+            update_doc["status"] = "complete"
+            update_doc["sha256"] = hasher.hexdigest()
+            _session_hashers.pop(upload_id, None)
+            _session_locks.pop(upload_id, None)
+
+        await upload_sessions_collection.update_one({"_id": upload_id}, {"$set": update_doc})
+        session.update(update_doc)
+        return session
+
+
+async def claim_upload(upload_id: str, dest: Path) -> StoredUpload:
+    """Move a completed resumable upload to its final location."""
+    session = await get_session(upload_id)
+    if session.get("status") != "complete":
+        raise HTTPException(status_code=409, detail="Upload is not complete")
+
+    await move_file(incoming_path(upload_id), dest)
+    await upload_sessions_collection.delete_one({"_id": upload_id})
+
+    return StoredUpload(
+        path=dest,
+        size=session["length"],
+        sha256=session["sha256"],
+        content_type=session.get("content_type"),
+        filename=session.get("filename"),
+    )
+
+
+async def abort_session(upload_id: str):
+    await upload_sessions_collection.delete_one({"_id": upload_id})
+    await asyncio.to_thread(unlink_quietly, incoming_path(upload_id))
+    _session_hashers.pop(upload_id, None)
+    _session_locks.pop(upload_id, None)
+
+
+async def move_file(src: Path, dest: Path):
+    dest.parent.mkdir(parents=True, exist_ok=True)
+    # os.replace is atomic on one filesystem; shutil.move copes across mounts.
+    await asyncio.to_thread(shutil.move, str(src), str(dest))
+
+
+# ====================================================
+# Expiry
+# ====================================================
+
+def _stale_files(cutoff: float, live_ids: set):
+    """Temp files not written to since `cutoff`, minus the parts of live sessions."""
+    if not UPLOAD_TMP_ROOT.is_dir():
+        return []
+    stale = []
+    for path in UPLOAD_TMP_ROOT.iterdir():
+        if not path.is_file() or path.name.endswith(".part") and path.stem in live_ids:
+            continue
+        try:
+            if path.stat().st_mtime < cutoff:
+                stale.append(path)
+        except FileNotFoundError:
+            continue
+    return stale
+
+
+async def sweep_expired() -> dict:
+    """
+    Drop expired sessions with their parts, then any temp file left older
+    than the TTL: parts whose session is gone, staging files of requests
+    that died mid-write.
+    """
+    now = datetime.utcnow()
+    expired = await upload_sessions_collection.find({"$or": [
+        {"expires_at": {"$lte": now}},
+        {"expires_at": {"$exists": False}, "updated_at": {"$lte": now - SESSION_TTL}},
+    ]}, {"_id": 1}).to_list(None)
+    for session in expired:
+        await abort_session(session["_id"])
+
+    live_ids = set(await upload_sessions_collection.distinct("_id"))
+    cutoff = (datetime.now() - SESSION_TTL).timestamp()
+    stale = await asyncio.to_thread(_stale_files, cutoff, live_ids)
+    for path in stale:
+        await asyncio.to_thread(unlink_quietly, path)
+    if expired or stale:
+        logger.info("upload sweep: %d expired sessions, %d stale temp files removed", len(expired), len(stale))
+    return {"sessions": len(expired), "files": len(stale)}
+
+
+class UploadSweeper:
+    def __init__(self, interval: float):
+        self.interval = interval
+        self._task: Optional[asyncio.Task] = None
+
+    async def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        while True:
+            try:
+                await sweep_expired()
+            except Exception:
+                logger.exception("upload sweep failed")
+            await asyncio.sleep(self.interval)
+
+
+upload_sweeper = UploadSweeper(UPLOAD_SWEEP_SECONDS)
@@ -0,0 +1,53 @@
+from typing import Dict, Iterable, Optional
+
+from bson import ObjectId
+
+from core.cache import TTLCache
+from core.config import PUBLIC_BASE_URL, USER_CARD_CACHE_SIZE, USER_CARD_CACHE_TTL
+from db.connection import users_collection
+
+# user_id -> {"user_id", "name", "avatarUrl"}, or None for an unknown user,
+# so a deleted author is not looked up again on every page load. Profile
+# and photo updates drop the entry; the TTL bounds staleness across workers.
+_cards = TTLCache(maxsize=USER_CARD_CACHE_SIZE, ttl=USER_CARD_CACHE_TTL)
+_MISSING = object()
+
+PROJECTION = {"firstName": 1, "lastName": 1, "profile_photo": 1}
+
+
+def avatar_url(user: dict) -> Optional[str]:
+    if not user.get("profile_photo"):
+        return None
+    return f"{PUBLIC_BASE_URL}/api/user/profile-photo/{user['profile_photo']}"
+
+
+def user_card(user: dict) -> dict:
+    return {
+        "user_id": str(user["_id"]),
+        "name": f"{user.get('firstName', '')} {user.get('lastName', '')}".strip(),
+        "avatarUrl": avatar_url(user),
+    }
+
+
+async def get_cards(user_ids: Iterable[str]) -> Dict[str, Optional[dict]]:
+    """Cards for many users: cache hits first, the rest in one $in query."""
+    cards: Dict[str, Optional[dict]] = {}
+    misses = []
+    for user_id in {str(u) for u in user_ids if u}:
+        card = _cards.get(user_id, _MISSING)
+        if card is _MISSING:
+            misses.append(user_id)
+        else:
+            cards[user_id] = card
+
+    oids = [ObjectId(u) for u in misses if ObjectId.is_valid(u)]
+    if oids:
+        async for user in users_collection.find({"_id": {"$in": oids}}, PROJECTION):
+            cards[str(user["_id"])] = user_card(user)
+    for user_id in misses:
+        _cards.set(user_id, cards.setdefault(user_id, None))
+    return cards
+
+
+def invalidate_user_card(user_id):
+    _cards.pop(str(user_id))
@@ -0,0 +1,67 @@
+import zipfile
+from datetime import datetime
+from pathlib import PurePosixPath
+from typing import AsyncIterator, List, Optional, Tuple
+
+# Already-compressed formats: deflating them again costs CPU for ~0% gain
+STORED_EXTS = {
+    ".png", ".jpg", ".jpeg", ".gif", ".webp", ".heic", ".avif",
+    ".mp4", ".mov", ".webm", ".mp3", ".m4a",
+    ".zip", ".gz", ".bz2", ".xz", ".7z", ".rar",
+    ".pdf", ".docx", ".xlsx", ".pptx",
+}
+
+# Earliest timestamp a ZIP entry can carry
+_EPOCH = datetime(1980, 1, 1)
+
+
+class ZipSink:
+    """Write-only, unseekable file for ZipFile; output is drained as it is produced."""
+
+    def __init__(self):
+        self._chunks: List[bytes] = []
+
+    def write(self, data) -> int:
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def compress_type_for(name: str) -> int:
+    if PurePosixPath(name).suffix.lower() in STORED_EXTS:
+        return zipfile.ZIP_STORED
+    return zipfile.ZIP_DEFLATED
+
+
+async def iter_zip(
+    entries: AsyncIterator[Tuple[str, Optional[datetime], AsyncIterator[bytes]]],
+) -> AsyncIterator[bytes]:
+    """
+    Build a ZIP on the fly from (archive name, mtime, byte chunks) entries, yielding
+    output as each chunk is written. Writing to an unseekable sink makes
+    zipfile emit data descriptors, so nothing is buffered or seeked back.
+    Entries without an mtime get a fixed one, so the same input gives the
+    same bytes.
+    """
+    sink = ZipSink()
+    with zipfile.ZipFile(sink, mode="w") as zf:
+        async for name, mtime, chunks in entries:
+            info = zipfile.ZipInfo(name, date_time=(mtime or _EPOCH).timetuple()[:6])
+            info.compress_type = compress_type_for(name)
+            with zf.open(info, mode="w", force_zip64=True) as member:
+                async for chunk in chunks:
+                    member.write(chunk)
+                    out = sink.drain()
+                    if out:
+                        yield out
+            out = sink.drain()
+            if out:
+                yield out
+    yield sink.drain()
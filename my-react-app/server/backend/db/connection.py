@@ -10,12 +10,26 @@ approvals_collection = db["approvals"]
 annotations_collection = db["annotations"]
 versions_collection = db["annotation_versions"]
 forum_collection = db["forum"]
+forum_replies_collection = db["forum_replies"]
+forum_tags_collection = db["forum_tags"]
+forum_tag_days_collection = db["forum_tag_days"]
+forum_events_collection = db["forum_events"]
 
 # ===== Other collections =====
 homeworks_collection = db["homeworks"]
 submissions_collection = db["submissions"]
+submissions_archive_collection = db["submissions_archive"]
 classrooms_collection = db["classrooms"]
 cases_collection = db["cases"]
 qna_collection = db["qna"]
 annot_collection = db["annot"]
-
+upload_sessions_collection = db["upload_sessions"]
+blobs_collection = db["blobs"]
+dicom_studies_collection = db["dicom_studies"]
+class_memberships_collection = db["class_memberships"]
+homework_events_collection = db["homework_events"]
+jobs_collection = db["jobs"]
+homework_stats_collection = db["homework_stats"]
+answer_signatures_collection = db["answer_signatures"]
+similarity_pairs_collection = db["similarity_pairs"]
+counters_collection = db["counters"]
@@ -0,0 +1,93 @@
+import logging
+
+from pymongo import ASCENDING, DESCENDING
+from pymongo.errors import OperationFailure
+
+from core.config import FORUM_EVENTS_RETENTION_HOURS
+
+from db.connection import (
+    answer_signatures_collection,
+    class_memberships_collection,
+    forum_collection,
+    forum_events_collection,
+    forum_replies_collection,
+    forum_tag_days_collection,
+    homework_stats_collection,
+    homeworks_collection,
+    similarity_pairs_collection,
+    submissions_collection,
+    upload_sessions_collection,
+)
+
+logger = logging.getLogger(__name__)
+
+DUPLICATE_KEY = 11000
+
+
+async def ensure_indexes():
+    """Create the indexes hot queries rely on (no-op when they exist)."""
+    # Assignment checks: "is user X in any of these classes?"
+    await class_memberships_collection.create_index(
+        [("user_id", ASCENDING), ("class_id", ASCENDING)], unique=True
+    )
+    await class_memberships_collection.create_index("class_id")
+
+    # Due-date scheduler: active homeworks ordered by deadline
+    await homeworks_collection.create_index([("status", ASCENDING), ("due_at_utc", ASCENDING)])
+
+    # A student's own submissions (dashboard, /submissions/mine)
+    await submissions_collection.create_index([("user_id", ASCENDING), ("homework_id", ASCENDING)])
+
+    # Latest change per homework (analytics cache validation)
+    await submissions_collection.create_index([("homework_id", ASCENDING), ("updated_at", DESCENDING)])
+
+    # Forum listing: newest first, keyset on (timestamp, _id); the tags
+    # variant is multikey and serves tag-filtered pages
+    await forum_collection.create_index([("timestamp", DESCENDING), ("_id", DESCENDING)])
+    await forum_collection.create_index([("tags", ASCENDING), ("timestamp", DESCENDING), ("_id", DESCENDING)])
+    # Trending tags: the window query on day; buckets expire on their UTC
+    # expires_at (a TTL on the local-time day would be off by the UTC offset)
+    day_index = (await forum_tag_days_collection.index_information()).get("day_1")
+    if day_index and "expireAfterSeconds" in day_index:
+        await forum_tag_days_collection.drop_index("day_1")
+    await forum_tag_days_collection.create_index("day")
+    await forum_tag_days_collection.create_index("expires_at", expireAfterSeconds=0)
+    # Live-update log: old events expire once no reconnect can need them
+    await forum_events_collection.create_index(
+        "at", expireAfterSeconds=int(FORUM_EVENTS_RETENTION_HOURS * 3600)
+    )
+    # A thread's replies in order (paging, latest-N previews, counts)
+    await forum_replies_collection.create_index(
+        [("thread_id", ASCENDING), ("timestamp", ASCENDING), ("_id", ASCENDING)]
+    )
+
+    # Resumable uploads: Mongo drops expired sessions even if no sweeper
+    # runs; the sweeper then finds their orphaned part files
+    await upload_sessions_collection.create_index("expires_at", expireAfterSeconds=0)
+
+    # Completion counters of a homework (read endpoint, recount cleanup)
+    await homework_stats_collection.create_index("homework_id")
+
+    # Answer similarity: LSH bucket lookup (multikey on bands) and the pairs
+    # a student is part of
+    await answer_signatures_collection.create_index(
+        [("homework_id", ASCENDING), ("question_index", ASCENDING), ("bands", ASCENDING)]
+    )
+    await similarity_pairs_collection.create_index(
+        [("homework_id", ASCENDING), ("question_index", ASCENDING), ("users", ASCENDING)]
+    )
+
+    # One submission per student and homework; the submit path upserts on it.
+    # Duplicates from the old read-then-insert path are merged by an
+    # explicit migration, never here.
+    try:
+        await submissions_collection.create_index(
+            [("homework_id", ASCENDING), ("user_id", ASCENDING)], unique=True
+        )
+    except OperationFailure as e:
+        if e.code != DUPLICATE_KEY:
+            raise
+        logger.error(
+            "duplicate submissions block the unique (homework_id, user_id) index; "
+            "run `python -m db.migrations dedupe_submissions` (try --dry-run first)"
+        )
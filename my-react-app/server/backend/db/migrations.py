@@ -0,0 +1,96 @@
+"""
+One-off data migrations, run by hand against a deployment:
+
+    python -m db.migrations dedupe_submissions [--dry-run]
+
+Each one is safe to run again; a second run finds nothing to do.
+"""
+import argparse
+import asyncio
+import logging
+from datetime import datetime
+
+from pymongo import ReplaceOne
+
+from core import completion
+from db.connection import submissions_archive_collection, submissions_collection
+
+logger = logging.getLogger(__name__)
+
+# Which duplicate submission survives: the furthest along, then the newest
+STATUS_RANK = {"graded": 3, "grading": 2, "submitted": 1}
+
+
+def _keep_order(doc: dict):
+    return (
+        STATUS_RANK.get(doc.get("status"), 0),
+        bool(doc.get("published")),
+        doc.get("updated_at") or datetime.min,
+    )
+
+
+async def dedupe_submissions(dry_run: bool = False) -> dict:
+    """
+    Merge duplicate (homework_id, user_id) submissions left by the old
+    read-then-insert path, so the unique index can be built. The most
+    advanced one is kept (graded > submitted > draft, then most recently
+    updated); the others move to submissions_archive.
+    """
+    pipeline = [
+        {"$group": {
+            "_id": {"homework_id": "$homework_id", "user_id": "$user_id"},
+            "ids": {"$push": "$_id"},
+            "count": {"$sum": 1},
+        }},
+        {"$match": {"count": {"$gt": 1}}},
+    ]
+    groups = archived = 0
+    homework_ids = set()
+    async for group in submissions_collection.aggregate(pipeline, allowDiskUse=True):
+        docs = await submissions_collection.find({"_id": {"$in": group["ids"]}}).to_list(None)
+        docs.sort(key=_keep_order, reverse=True)
+        kept, stale = docs[0], docs[1:]
+        logger.warning(
+            "homework %s / user %s: keeping %s (%s), archiving %s",
+            group["_id"].get("homework_id"), group["_id"].get("user_id"),
+            kept["_id"], kept.get("status"), [d["_id"] for d in stale],
+        )
+        groups += 1
+        archived += len(stale)
+        homework_ids.add(kept.get("homework_id"))
+        if dry_run:
+            continue
+
+        now = datetime.utcnow()
+        # Archive before deleting: an interrupted run leaves a copy, never a loss
+        await submissions_archive_collection.bulk_write([
+            ReplaceOne(
+                {"_id": d["_id"]},
+                {**d, "archived_at": now, "archived_reason": "duplicate", "kept_id": kept["_id"]},
+                upsert=True,
+            )
+            for d in stale
+        ], ordered=False)
+        await submissions_collection.delete_many({"_id": {"$in": [d["_id"] for d in stale]}})
+
+    if homework_ids and not dry_run:
+        await completion.recount_many(homework_ids)
+    return {"groups": groups, "archived": archived, "dry_run": dry_run}
+
+
+MIGRATIONS = {
+    "dedupe_submissions": dedupe_submissions,
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("migration", choices=sorted(MIGRATIONS))
+    parser.add_argument("--dry-run", action="store_true", help="report what would change without writing")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(levelname)s %(name)s: %(message)s")
+    print(asyncio.run(MIGRATIONS[args.migration](dry_run=args.dry_run)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,30 @@
+import logging
+from typing import Awaitable, Callable, TypeVar
+
+from pymongo.errors import OperationFailure
+
+from db.connection import client
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+# "Transaction numbers are only allowed on a replica set member or mongos"
+_NO_TRANSACTIONS = 20
+
+
+async def run_in_transaction(callback: Callable[..., Awaitable[T]]) -> T:
+    """
+    Run `callback(session)` inside a multi-document transaction.
+    Standalone servers cannot do transactions; there the callback runs
+    once more with session=None and callers fall back to compensating
+    cleanup themselves.
+    """
+    async with await client.start_session() as session:
+        try:
+            return await session.with_transaction(callback)
+        except OperationFailure as e:
+            if e.code != _NO_TRANSACTIONS:
+                raise
+            logger.warning("MongoDB does not support transactions here; writing without one")
+    return await callback(None)
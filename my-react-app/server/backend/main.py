@@ -3,12 +3,21 @@ from fastapi.middleware.cors import CORSMiddleware
 from db.connection import users_collection, approvals_collection, classrooms_collection
 import random
 import logging
-from pathlib import Path
 from datetime import datetime
 from core.security import hash_password
-from fastapi.staticfiles import StaticFiles
+from core.config import UPLOAD_TMP_ROOT, LOG_LEVEL
+from core.dicom import shutdown_pool, sweep_orphaned_studies
+from core import assignments, forum_events, forum_replies, forum_tags
+from core.jobs import job_heartbeat
+from core.scheduler import scheduler
+from core.drafts import drafts
+from core.search import search_index
+from core.uploads import upload_sweeper
+from db.indexes import ensure_indexes
 from routes import auth, admin, online, annotations, user, ws_routes, forum
-from routes import homeworks, submissions, ai, classroom, cases
+from routes import homeworks, submissions, ai, classroom, cases, uploads, media, dicom, student, jobs, search
+
+logging.basicConfig(level=LOG_LEVEL, format="%(levelname)s %(name)s: %(message)s")
 
 app = FastAPI()
 
@@ -32,9 +41,12 @@ app.include_router(submissions.router)
 app.include_router(ai.router)
 app.include_router(classroom.router)
 app.include_router(cases.router)
-
-
-app.mount("/uploads", StaticFiles(directory="uploads"), name="uploads")
+app.include_router(uploads.router)
+app.include_router(media.router)
+app.include_router(dicom.router)
+app.include_router(student.router)
+app.include_router(jobs.router)
+app.include_router(search.router)
 
 @app.on_event("startup")
 async def startup_event():
@@ -43,8 +55,9 @@ async def startup_event():
     #UPLOADS STARTUP
 
 
-    uploads_root = Path("uploads")
-    uploads_root.mkdir(parents=True, exist_ok=True)
+    # Upload keys are created on write by core.storage; only the local
+    # staging area for in-flight uploads is needed up front.
+    UPLOAD_TMP_ROOT.mkdir(parents=True, exist_ok=True)
 
 
     #ADMIN STARTUP
@@ -64,9 +77,6 @@ async def startup_event():
         result = await users_collection.insert_one(admin_user)
         admin_id = result.inserted_id
 
-        user_storage = uploads_root / str(admin_id)
-        user_storage.mkdir(parents=True, exist_ok=True)
-
         print(f"[OK] Admin account created: {admin_email}")
     else:
         print(f"[INFO] Admin account already exists: {admin_email}")
@@ -92,9 +102,6 @@ async def startup_event():
             result = await users_collection.insert_one(student)
             new_user_id = result.inserted_id
 
-            user_storage = uploads_root / str(new_user_id)
-            user_storage.mkdir(parents=True, exist_ok=True)
-
         print(f"[OK] Added {student_needed} random student accounts")
 
 
@@ -122,9 +129,6 @@ async def startup_event():
             result = await users_collection.insert_one(instructor)
             new_user_id = result.inserted_id
 
-            user_storage = uploads_root / str(new_user_id)
-            user_storage.mkdir(parents=True, exist_ok=True)
-
             existing_approval = await approvals_collection.find_one({"id": str(new_user_id)})
             if not existing_approval:
                 await approvals_collection.insert_one({"id": str(new_user_id), "status": status})
@@ -160,6 +164,46 @@ async def startup_event():
     else:
         print("[INFO] Classrooms already exist")
 
+
+    #INDEXES STARTUP
+
+
+    await ensure_indexes()
+    # Renews this worker's job leases; interrupts jobs of dead workers
+    await job_heartbeat.start()
+    synced = await assignments.rebuild()
+    if synced["added"] or synced["removed"]:
+        print(f"[OK] Class membership index synced: +{synced['added']} -{synced['removed']}")
+    moved = await forum_replies.migrate_embedded_replies()
+    if moved["threads"]:
+        print(f"[OK] Moved {moved['replies']} forum replies out of {moved['threads']} threads")
+    backfilled = await forum_tags.backfill_if_empty()
+    if backfilled:
+        print(f"[OK] Forum tag stats backfilled: {backfilled['tags']} tags")
+    swept = await sweep_orphaned_studies()
+    if swept:
+        print(f"[OK] Removed {swept} DICOM studies of deleted blobs")
+    # Built in the background; searches wait for the first build
+    await search_index.start()
+    # Expired resumable uploads and leftover temp files
+    await upload_sweeper.start()
+
+
+    #DEADLINE SCHEDULER STARTUP
+
+
+    await scheduler.start()
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    await scheduler.stop()
+    await search_index.stop()
+    await upload_sweeper.stop()
+    await job_heartbeat.stop()
+    await forum_events.broker.stop()
+    await drafts.flush_all()
+    shutdown_pool()
+
 @app.get("/")
 def home():
     return {"message": "Backend is running"}
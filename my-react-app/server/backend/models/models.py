@@ -1,6 +1,8 @@
-from pydantic import BaseModel, EmailStr, Field
+import json
+
+from pydantic import AliasChoices, BaseModel, ConfigDict, EmailStr, Field, field_validator
 from datetime import datetime
-from typing import Optional, Dict, Any, List, Literal, Union
+from typing import Optional, Dict, Any, List, Literal, Union, Annotated
 
 class User(BaseModel):
     firstName: str
@@ -58,6 +60,10 @@ class ForumThread(BaseModel):
     tags: List[str] = Field(default_factory=list)
     imageUrl: Optional[str] = None
     replies: List[ForumReply] = Field(default_factory=list)
+    # Replies are stored in forum_replies; the thread keeps a count and
+    # a summary of the latest one
+    reply_count: int = 0
+    last_reply: Optional[Dict[str, Any]] = None
     timestamp: datetime = Field(default_factory=datetime.now)
 
     class Config:
@@ -86,20 +92,48 @@ class SubmissionCreate(BaseModel):
     files: Optional[List[FileItem]] = None
     answers: Optional[List[AnswerItem]] = None
 
+class DraftPatch(BaseModel):
+    revision: Optional[int] = None   # revision the client last saw; None skips the check
+    notes: Optional[str] = None
+    files: Optional[List[FileItem]] = None
+    answers: Optional[List[AnswerItem]] = None  # only the answers that changed
+
+class DraftSubmit(BaseModel):
+    revision: Optional[int] = None
+
 class SubmissionOut(BaseModel):
     submission_id: str
-    status: Literal["none", "submitted", "grading", "graded"]
+    status: Literal["none", "draft", "submitted", "grading", "graded"]
     score: Optional[int] = None
     notes: Optional[str] = None
     files: Optional[List[FileItem]] = None
     answers: Optional[List[AnswerItem]] = None
     updated_at: Optional[str] = None
+    revision: Optional[int] = None
 
 class GradeRequest(BaseModel):
     score: int
     rubric: List[Dict[str, Any]]
     feedback: str | None = None
 
+class BulkGradeItem(GradeRequest):
+    submission_id: str
+
+class BulkGradeRequest(BaseModel):
+    items: List[BulkGradeItem]
+    background: bool = False
+
+class BulkSelection(BaseModel):
+    """Which submissions a bulk publish/return applies to: a homework, explicit ids, or both."""
+    homework_id: Optional[str] = None
+    submission_ids: Optional[List[str]] = None
+    status: Optional[List[str]] = None
+    class_id: Optional[str] = None
+    background: bool = False
+
+class BulkReturnRequest(BulkSelection):
+    feedback: Optional[str] = None
+
 #                      HOMEWORK
 
 class HWUpload(BaseModel):
@@ -168,4 +202,71 @@ class QNA(BaseModel):
 class Annot(BaseModel):
     case_id: str
     annotation_image: str = ""
-    reference_images: List[str] = Field(default_factory=list)
\ No newline at end of file
+    reference_images: List[str] = Field(default_factory=list)
+
+# ---- Bulk import ----
+class BulkHomeworkRow(BaseModel):
+    """
+    One manifest row: either an existing `case_id` or the fields of a new
+    case, plus the homework. CSV cells may hold JSON for `questions` and
+    ";"-separated lists for `classes`, `focus` and `reference_images`.
+    Focus labels are stored as {"label", "highlighted"} tags, the shape the
+    homework builder sends.
+    """
+    model_config = ConfigDict(populate_by_name=True)
+
+    case_id: Optional[str] = Field(None, validation_alias=AliasChoices("case_id", "caseId"))
+    title: Optional[str] = None
+    description: Optional[str] = None
+    case_type: Optional[str] = Field(None, validation_alias=AliasChoices("case_type", "caseType", "type"))
+    image_url: Optional[str] = Field(None, validation_alias=AliasChoices("image_url", "imageUrl"))
+    homework_type: Literal["Q&A", "Annotate"] = Field(
+        "Annotate", validation_alias=AliasChoices("homework_type", "homeworkType")
+    )
+    due_at: str = Field(validation_alias=AliasChoices("due_at", "dueAtISO", "dueAt"))
+    audience: str = "all"
+    # Classroom ids or "Name (Year)" labels
+    classes: List[str] = Field(
+        default_factory=list,
+        validation_alias=AliasChoices("classes", "classIds", "class_ids", "classLabels", "class_labels"),
+    )
+    instructions: Optional[str] = None
+    questions: List[Annotated[Question, Field(discriminator="type")]] = Field(default_factory=list)
+    max_points: Optional[int] = Field(None, validation_alias=AliasChoices("max_points", "maxPoints"))
+    visibility: Literal["public", "private"] = "public"
+    password: Optional[str] = None
+    focus: List[Dict[str, Any]] = Field(
+        default_factory=list,
+        validation_alias=AliasChoices("focus", "suggestedFocusTags", "autoChecklist"),
+    )
+    reference_images: List[str] = Field(
+        default_factory=list,
+        validation_alias=AliasChoices("reference_images", "referenceImages"),
+    )
+
+    @field_validator("questions", mode="before")
+    @classmethod
+    def _parse_questions(cls, value):
+        if isinstance(value, str):
+            return json.loads(value) if value.strip() else []
+        return value
+
+    @field_validator("classes", "reference_images", mode="before")
+    @classmethod
+    def _split_list(cls, value):
+        if isinstance(value, str):
+            return [part.strip() for part in value.split(";") if part.strip()]
+        return value
+
+    @field_validator("focus", mode="before")
+    @classmethod
+    def _focus_tags(cls, value):
+        value = cls._split_list(value)
+        if not isinstance(value, list):
+            return value
+        return [{"label": tag, "highlighted": True} if isinstance(tag, str) else tag for tag in value]
+
+    @field_validator("visibility", mode="before")
+    @classmethod
+    def _lower_visibility(cls, value):
+        return str(value).strip().lower() if value else "public"
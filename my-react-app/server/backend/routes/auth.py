@@ -2,7 +2,6 @@ from fastapi import APIRouter, HTTPException
 from db.connection import users_collection, approvals_collection
 from models.models import User, Approval
 from datetime import datetime
-from pathlib import Path
 from core.security import hash_password, verify_password, create_access_token
 
 router = APIRouter(prefix="/auth", tags=["Auth"])
@@ -21,9 +20,6 @@ async def signup(user: User):
     new_user_id = result.inserted_id
     new_user = await users_collection.find_one({"_id": new_user_id})
 
-    user_storage = Path("uploads/" + str(new_user_id))
-    user_storage.mkdir(parents=True, exist_ok=True)
-
     token_data = {
         "user_id": str(new_user_id),
         "firstName": new_user["firstName"],
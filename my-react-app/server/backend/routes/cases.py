@@ -1,5 +1,4 @@
 
-import os
 from pathlib import Path
 from datetime import datetime, timezone
 from typing import Optional
@@ -8,53 +7,63 @@ from fastapi import APIRouter, UploadFile, Form, HTTPException
 from bson import ObjectId
 
 from db.connection import cases_collection, homeworks_collection
+from core.blobstore import store_upload, release, release_refs, blob_refs
+from core.config import PUBLIC_BASE_URL
+from core.dicom import ingest_blob_if_dicom
+from core.storage import storage
+from core.case_bundles import invalidate_case_bundle
+from core.search import KIND_CASE, search_index
+from routes.homeworks import delete_case_homeworks
 
 router = APIRouter(prefix="/api/instructor", tags=["Cases"])
 
-BASE_UPLOAD_DIR = Path("uploads")
-
 def now_iso():
     return datetime.now(timezone.utc).isoformat()
 
+
+async def store_case_image(image: Optional[UploadFile], upload_id: Optional[str], owner_id: Optional[str] = None):
+    """
+    Store a case image as a blob. DICOM studies are decoded once and the
+    case points at a rendered preview, keeping the original as source_url.
+    Returns (blob, image_url, dicom summary or None).
+    """
+    blob = await store_upload(image, upload_id, owner_id=owner_id)
+    try:
+        dicom = await ingest_blob_if_dicom(blob, image.filename if image else None)
+    except HTTPException:
+        await release(blob["sha256"])
+        raise
+
+    image_url = dicom["preview_urls"]["default"] if dicom else blob["url"]
+    return blob, image_url, dicom
+
 @router.post("/cases")
 async def create_case(
     title: str = Form(...),
     description: Optional[str] = Form(None),
-    image: UploadFile = Form(...),
+    image: Optional[UploadFile] = Form(None),
     case_type: Optional[str] = Form(None),
     homework_type: Optional[str] = Form("Annotate"),
     author_id: str = Form(...),
+    upload_id: Optional[str] = Form(None),
 ):
     """
     Create a new Case (title + optional description + image).
-    Save image to uploads/{author_id}/cases/ and return case_id + image_url.
+    Store the image in the content-addressed blob store and return case_id + image_url.
+    - upload_id: a completed resumable upload (/api/uploads) used instead of `image`.
+    - image may be a raster image or a DICOM file (single- or multi-frame).
     - case_type: Medical specialty (Neurology, Cardiology, etc.)
     - homework_type: Type of homework (Q&A or Annotate). Defaults to Annotate.
     """
     if not title.strip():
         raise HTTPException(status_code=400, detail="Title is required")
 
-    if not image:
+    if not image and not upload_id:
         raise HTTPException(status_code=400, detail="Image file is required")
 
-    # ensure folder exists
-    user_cases_dir = BASE_UPLOAD_DIR / author_id / "cases"
-    user_cases_dir.mkdir(parents=True, exist_ok=True)
-
     case_id = str(ObjectId())
 
-    # file extension
-    _, ext = os.path.splitext(image.filename or "")
-    ext = ext.lower() if ext else ".png"
-
-    filename = f"{case_id}{ext}"
-    file_path = user_cases_dir / filename
-
-    # save file
-    with open(file_path, "wb") as f:
-        f.write(await image.read())
-
-    image_url = f"http://127.0.0.1:8000/uploads/{author_id}/cases/{filename}"
+    blob, image_url, dicom = await store_case_image(image, upload_id, author_id)
 
     doc = {
         "_id": ObjectId(case_id),
@@ -66,10 +75,14 @@ async def create_case(
         "author_id": author_id,
         "created_at": now_iso(),
         "updated_at": now_iso(),
-        "image_filename": filename,
+        "image_sha256": blob["sha256"],
     }
+    if dicom:
+        doc["source_url"] = blob["url"]
+        doc["dicom"] = dicom
 
     await cases_collection.insert_one(doc)
+    search_index.refresh_soon(KIND_CASE, case_id)
 
     return {
         "case_id": case_id,
@@ -79,6 +92,7 @@ async def create_case(
         "description": doc["description"],
         "case_type": doc["case_type"],
         "homework_type": doc["homework_type"],
+        "dicom": dicom,
     }
 
 @router.get("/cases")
@@ -120,7 +134,7 @@ async def list_cases(limit: int = 50):
         image_url = c.get("image_url")
         if image_url and not image_url.startswith("http") and not image_url.startswith("blob:"):
             # It's a relative URL, convert to full URL
-            image_url = f"http://127.0.0.1:8000{image_url}"
+            image_url = f"{PUBLIC_BASE_URL}{image_url}"
         
         out.append({
             "case_id": case_id,
@@ -129,6 +143,7 @@ async def list_cases(limit: int = 50):
             "description": c.get("description"),
             "image_url": image_url,
             "case_type": c.get("case_type"),
+            "dicom": c.get("dicom"),
             "homework_type": homework_type,
             "visibility": visibility,
             "homework_audience": homework.get("audience") if homework else None,
@@ -149,10 +164,12 @@ async def update_case(
     case_type: Optional[str] = Form(None),
     homework_type: Optional[str] = Form(None),
     author_id: Optional[str] = Form(None),
+    upload_id: Optional[str] = Form(None),
 ):
     """Update an existing case.
 
-    Supports updating metadata and replacing the case image.
+    Supports updating metadata and replacing the case image, either as a
+    multipart `image` or a completed resumable `upload_id`.
     """
     try:
         oid = ObjectId(case_id)
@@ -174,40 +191,44 @@ async def update_case(
     if homework_type is not None:
         update_doc["homework_type"] = homework_type.strip() or None
 
+    unset_doc = {}
+
     # Save new image if provided
-    if image:
-        # Determine author_id for storage
-        stored_author_id = author_id or case.get("author_id")
-        if not stored_author_id:
-            raise HTTPException(status_code=400, detail="author_id is required to update case image")
-
-        user_cases_dir = BASE_UPLOAD_DIR / stored_author_id / "cases"
-        user_cases_dir.mkdir(parents=True, exist_ok=True)
-
-        # Attempt to delete old image file if stored
-        old_filename = case.get("image_filename")
-        if old_filename:
-            old_path = user_cases_dir / old_filename
-            try:
-                if old_path.exists():
-                    old_path.unlink()
-            except Exception:
-                pass
-
-        # Save new image
-        _, ext = os.path.splitext(image.filename or "")
-        ext = ext.lower() if ext else ".png"
-        filename = f"{case_id}{ext}"
-        file_path = user_cases_dir / filename
-        with open(file_path, "wb") as f:
-            f.write(await image.read())
-
-        image_url = f"http://127.0.0.1:8000/uploads/{stored_author_id}/cases/{filename}"
+    if image or upload_id:
+        blob, image_url, dicom = await store_case_image(image, upload_id, author_id or case.get("author_id"))
         update_doc["image_url"] = image_url
-        update_doc["image_filename"] = filename
+        update_doc["image_sha256"] = blob["sha256"]
+        unset_doc["image_filename"] = ""
+        if dicom:
+            update_doc["source_url"] = blob["url"]
+            update_doc["dicom"] = dicom
+        else:
+            unset_doc["source_url"] = ""
+            unset_doc["dicom"] = ""
 
+    update_ops = {}
     if update_doc:
-        await cases_collection.update_one({"_id": oid}, {"$set": update_doc})
+        update_ops["$set"] = update_doc
+    if unset_doc:
+        update_ops["$unset"] = unset_doc
+
+    if update_ops:
+        await cases_collection.update_one({"_id": oid}, update_ops)
+        invalidate_case_bundle(case_id)
+        search_index.refresh_soon(KIND_CASE, case_id)
+
+    # Drop the previous image only once the case points at the new one
+    if "image_sha256" in update_doc:
+        if case.get("image_sha256"):
+            await release(case["image_sha256"])
+        elif case.get("image_filename"):
+            # Legacy per-author file: {author_id}/cases/{filename}
+            stored_author_id = author_id or case.get("author_id")
+            if stored_author_id:
+                try:
+                    await storage.delete(f"{stored_author_id}/cases/{case['image_filename']}")
+                except Exception:
+                    pass
 
     # Return updated case data
     updated_case = await cases_collection.find_one({"_id": oid})
@@ -217,47 +238,32 @@ async def update_case(
         "title": updated_case.get("title"),
         "description": updated_case.get("description"),
         "image_url": updated_case.get("image_url"),
+        "dicom": updated_case.get("dicom"),
         "case_type": updated_case.get("case_type"),
         "homework_type": updated_case.get("homework_type"),
         "created_at": updated_case.get("created_at"),
     }
 
 
-@router.delete("/cases/{case_id}")
-async def delete_case(case_id: str):
-    """
-    Delete a case by id, also delete its uploaded image file if exists.
-    """
-    try:
-        oid = ObjectId(case_id)
-    except Exception:
-        raise HTTPException(status_code=400, detail="Invalid case_id")
-
-    case = await cases_collection.find_one({"_id": oid})
-    if not case:
-        raise HTTPException(status_code=404, detail="Case not found")
-
-    # Remove DB doc first
-    await cases_collection.delete_one({"_id": oid})
-
-    # Try delete image file
+async def delete_legacy_case_image(case: dict, case_id: str):
+    """Remove a pre-blob-store case image stored under {author_id}/cases/."""
     author_id = case.get("author_id")
     if author_id:
-        user_cases_dir = BASE_UPLOAD_DIR / author_id / "cases"
         # Preferred: delete by stored filename
         filename = case.get("image_filename")
         if filename:
-            file_path = user_cases_dir / filename
             try:
-                if file_path.exists():
-                    file_path.unlink()
+                await storage.delete(f"{author_id}/cases/{filename}")
             except Exception as e:
                 # Don't fail deletion if file missing
                 print("Warning: failed to delete case image:", e)
         else:
-            # Fallback: delete any file matching {case_id}.*
-            pattern = str(user_cases_dir / f"{case_id}.*")
-            for p in glob(pattern):
+            # Fallback: delete any file matching {case_id}.* (only local
+            # storage predates the blob store, so there is a directory to scan)
+            user_cases_dir = storage.local_path(f"{author_id}/cases")
+            if user_cases_dir is None:
+                return
+            for p in glob(str(user_cases_dir / f"{case_id}.*")):
                 try:
                     Path(p).unlink()
                 except Exception as e:
@@ -265,5 +271,34 @@ async def delete_case(case_id: str):
     else:
         print("Warning: no author_id found for case, cannot delete image")
 
+
+@router.delete("/cases/{case_id}")
+async def delete_case(case_id: str):
+    """
+    Delete a case by id together with its homeworks and everything they
+    own (see routes.homeworks.delete_case_homeworks). Blob-backed files are
+    released; the bytes are only removed once nothing references them.
+    """
+    try:
+        oid = ObjectId(case_id)
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid case_id")
+
+    case = await cases_collection.find_one({"_id": oid})
+    if not case:
+        raise HTTPException(status_code=404, detail="Case not found")
+
+    # Remove DB docs first
+    await cases_collection.delete_one({"_id": oid})
+    await delete_case_homeworks(case_id)
+    invalidate_case_bundle(case_id)
+    search_index.remove(KIND_CASE, case_id)
+
+    await release_refs(blob_refs(case))
+
+    # Legacy cases keep their image under uploads/{author_id}/cases/
+    if not case.get("image_sha256"):
+        await delete_legacy_case_image(case, case_id)
+
     return {"ok": True, "deleted_case_id": case_id}
 
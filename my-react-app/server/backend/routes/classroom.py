@@ -1,6 +1,7 @@
 from fastapi import APIRouter, HTTPException
 from bson import ObjectId
 from db.connection import users_collection, classrooms_collection
+from core import assignments
 from datetime import datetime
 
 router = APIRouter(prefix="/api/classroom", tags=["Classroom"])
@@ -75,6 +76,7 @@ async def add_student_to_classroom(data: dict):
         {"_id": classroom_obj},
         {"$addToSet": {"members": student_obj}}
     )
+    await assignments.add_member(classroom_obj, student_obj)
 
     return {
         "message": "Student added",
@@ -192,6 +194,7 @@ async def delete_classroom(classroom_id: str):
     result = await classrooms_collection.delete_one({"_id": obj})
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Classroom not found")
+    await assignments.drop_class(obj)
     return {"message": "Classroom deleted"}
 
 
@@ -247,5 +250,6 @@ async def remove_student_from_classroom(data: dict):
         {"_id": classroom_obj},
         {"$pull": {"members": student_obj}}
     )
+    await assignments.remove_member(classroom_obj, student_obj)
 
     return {"message": "Student removed"}
\ No newline at end of file
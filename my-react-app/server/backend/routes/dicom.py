@@ -0,0 +1,53 @@
+from typing import Optional
+
+from fastapi import APIRouter, HTTPException, Query, Request
+from fastapi.responses import Response
+
+from core.dicom import get_study, resolve_window, frame_png, study_summary
+from core.media import IMMUTABLE_CACHE, etag_matches
+
+router = APIRouter(prefix="/api/dicom", tags=["DICOM"])
+
+
+# ===============================
+# Study Metadata
+# ===============================
+
+@router.get("/{sha256}")
+async def dicom_study(sha256: str):
+    meta = await get_study(sha256, ensure_decoded=False)
+    if not meta:
+        raise HTTPException(status_code=404, detail="DICOM study not found")
+    return study_summary(sha256, meta)
+
+
+# ===============================
+# Rendered Frames
+# ===============================
+
+@router.get("/{sha256}/frames/{frame}.png")
+async def dicom_frame(
+    sha256: str,
+    frame: int,
+    request: Request,
+    window: Optional[str] = Query(None),
+    wc: Optional[float] = Query(None),
+    ww: Optional[float] = Query(None),
+):
+    """
+    Render one frame at a window preset (`window=lung`) or an explicit
+    center/width (`wc`, `ww`). Output depends only on the study hash and
+    parameters, so it is cached by the browser as immutable.
+    """
+    meta = await get_study(sha256, ensure_decoded=False)
+    if not meta:
+        raise HTTPException(status_code=404, detail="DICOM study not found")
+
+    window_cw = resolve_window(meta, window, wc, ww)
+    etag = f'"{sha256}-{frame}-{window_cw[0]}-{window_cw[1]}"'
+    headers = {"ETag": etag, "Cache-Control": IMMUTABLE_CACHE}
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+
+    png = await frame_png(sha256, frame, window_cw)
+    return Response(content=png, media_type="image/png", headers=headers)
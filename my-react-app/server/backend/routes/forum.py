@@ -1,59 +1,47 @@
-import os
-from pathlib import Path
+import asyncio
 from datetime import datetime
-from typing import Optional
+from typing import List, Optional
 from fastapi.encoders import jsonable_encoder
 from bson import ObjectId
-import random
-from collections import Counter
+import base64
 from datetime import timedelta
 
-from fastapi import APIRouter, UploadFile, Form, HTTPException
-from fastapi.responses import JSONResponse
+from fastapi import APIRouter, UploadFile, Form, HTTPException, Query, Header, Request
+from fastapi.responses import JSONResponse, StreamingResponse
 
 from db.connection import users_collection, forum_collection
+from core.blobstore import store_upload
+from core import forum_events, forum_replies
+from core.forum_tags import record_thread_tags, tag_stats
+from core.search import KIND_THREAD, search_index
+from core.user_cards import avatar_url as user_avatar_url, get_cards
 from models.models import ForumThread, ForumReply, ForumAuthor 
 
 router = APIRouter(prefix="/forum", tags=["Forum"])
 
-BASE_UPLOAD_DIR = Path("uploads")
+# Replies embedded in each thread of a listing page (the latest ones)
+REPLY_PREVIEW = 3
 
-async def get_trending_tags(limit: int = 5):
-    """
-    Returns up to `limit` trending tags.
-    If all counts are equal or no tags exist → random selection.
-    """
-    cursor = forum_collection.find(
-        {}, {"tags": 1, "timestamp": 1}
-    )
-
-    tag_counter = Counter()
-
-    async for doc in cursor:
-        for tag in doc.get("tags", []):
-            tag_counter[tag] += 1
 
-    if not tag_counter:
-        return []
+def encode_cursor(timestamp: datetime, item_id) -> str:
+    raw = f"{timestamp.isoformat()}|{item_id}".encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
 
-    # Group tags by frequency
-    freq_map = {}
-    for tag, count in tag_counter.items():
-        freq_map.setdefault(count, []).append(tag)
 
-    # Sort frequencies desc
-    sorted_freqs = sorted(freq_map.keys(), reverse=True)
-
-    result = []
-    for freq in sorted_freqs:
-        tags = freq_map[freq]
-        random.shuffle(tags)
-        for tag in tags:
-            result.append(tag)
-            if len(result) == limit:
-                return result
+def decode_cursor(cursor: str):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        timestamp, item_id = raw.rsplit("|", 1)
+        return datetime.fromisoformat(timestamp), item_id
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
 
-    return result
+async def get_trending_tags(limit: int = 5):
+    """
+    Returns up to `limit` trending tags: time-decayed usage over the last
+    days, served from the in-process tag snapshot.
+    """
+    return await tag_stats.trending(limit)
 
 @router.get("/tags/trending")
 async def get_trending_tags_api():
@@ -62,35 +50,29 @@ async def get_trending_tags_api():
 
 @router.get("/tags")
 async def get_all_tags():
-    tags = set()
-    async for doc in forum_collection.find({}, {"tags": 1}):
-        tags.update(doc.get("tags", []))
-    return sorted(tags)
+    return await tag_stats.all_tags()
 
-async def resolve_forum_author(author):
-    """Return latest author info, falling back to stored values."""
-    if not author or not author.get("user_id"):
-        return author
+def author_ids(threads):
+    """Every author id across threads, their replies and last-reply summaries."""
+    ids = set()
+    for thread in threads:
+        for item in [thread, thread.get("last_reply")] + list(thread.get("replies") or []):
+            author = item.get("author") if isinstance(item, dict) else None
+            if isinstance(author, dict) and author.get("user_id"):
+                ids.add(str(author["user_id"]))
+    return ids
 
-    try:
-        user = await users_collection.find_one({"_id": ObjectId(author.get("user_id"))})
-    except Exception:
-        user = None
 
-    if not user:
+def resolve_forum_author(author, cards):
+    """Return latest author info from the prefetched cards, falling back to stored values."""
+    if not author or not author.get("user_id"):
         return author
 
-    avatar_url = None
-    if user.get("profile_photo"):
-        avatar_url = f"http://127.0.0.1:8000/api/user/profile-photo/{user['profile_photo']}" 
-
-    name = f"{user.get('firstName', '')} {user.get('lastName', '')}".strip() or author.get("name")
+    card = cards.get(str(author["user_id"]))
+    if not card:
+        return author
 
-    return {
-        "user_id": str(user.get("_id")),
-        "name": name,
-        "avatarUrl": avatar_url,
-    }
+    return {**card, "name": card["name"] or author.get("name")}
 
 
 def serialize_doc(doc):
@@ -107,33 +89,159 @@ def serialize_doc(doc):
                 reply["id"] = str(reply["id"])
     return doc
 
-async def hydrate_thread(thread):
-    if not thread:
-        return thread
+async def hydrate_threads(threads):
+    """Serialize threads and refresh every author from one batched card lookup."""
+    threads = [t for t in threads if t]
+    cards = await get_cards(author_ids(threads))
+
+    hydrated = []
+    for thread in threads:
+        thread = serialize_doc(thread)
 
-    thread = serialize_doc(thread)
+        if "author" in thread and isinstance(thread["author"], dict):
+            thread["author"] = resolve_forum_author(thread["author"], cards)
 
-    if "author" in thread and isinstance(thread["author"], dict):
-        thread["author"] = await resolve_forum_author(thread["author"])
+        if "replies" in thread and isinstance(thread["replies"], list):
+            for reply in thread["replies"]:
+                if "author" in reply and isinstance(reply["author"], dict):
+                    reply["author"] = resolve_forum_author(reply["author"], cards)
 
-    if "replies" in thread and isinstance(thread["replies"], list):
-        updated_replies = []
-        for reply in thread["replies"]:
-            if "author" in reply and isinstance(reply["author"], dict):
-                reply["author"] = await resolve_forum_author(reply["author"])
-            updated_replies.append(reply)
-        thread["replies"] = updated_replies
+        last = thread.get("last_reply")
+        if isinstance(last, dict) and isinstance(last.get("author"), dict):
+            last["author"] = resolve_forum_author(last["author"], cards)
 
-    return thread
+        hydrated.append(thread)
+    return hydrated
+
+async def hydrate_thread(thread):
+    if not thread:
+        return thread
+    return (await hydrate_threads([thread]))[0]
 
 @router.get("")
 async def get_all_threads():
-    """Fetch all forum threads sorted by latest first."""
-    threads = []
-    async for thread in forum_collection.find().sort("timestamp", -1):
-        hydrated = await hydrate_thread(thread)
-        threads.append(hydrated)
-    return threads
+    """Fetch all forum threads sorted by latest first (unpaginated; see /forum/threads)."""
+    threads = await forum_collection.find().sort("timestamp", -1).to_list(None)
+    replies = await forum_replies.replies_by_thread(t["_id"] for t in threads)
+    for thread in threads:
+        thread["replies"] = replies.get(str(thread["_id"]), [])
+    return await hydrate_threads(threads)
+
+
+@router.get("/threads")
+async def list_threads(
+    cursor: Optional[str] = Query(None),
+    limit: int = Query(20, ge=1, le=100),
+    tag: Optional[List[str]] = Query(None, description="Threads with any of these tags"),
+    replies: int = Query(REPLY_PREVIEW, ge=0, le=50, description="Latest replies to embed per thread"),
+):
+    """
+    Threads newest first, keyset-paged on (timestamp, id). Each thread
+    carries `reply_count` and only its latest `replies` replies; page
+    through the rest with /forum/{thread_id}/replies.
+    """
+    match = {}
+    tags = [t.strip() for value in (tag or []) for t in value.split(",") if t.strip()]
+    if tags:
+        match["tags"] = {"$in": tags}
+    if cursor:
+        timestamp, thread_id = decode_cursor(cursor)
+        try:
+            thread_oid = ObjectId(thread_id)
+        except Exception:
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+        match["$or"] = [
+            {"timestamp": {"$lt": timestamp}},
+            {"timestamp": timestamp, "_id": {"$lt": thread_oid}},
+        ]
+
+    docs = await forum_collection.find(match, {"replies": 0}).sort(
+        [("timestamp", -1), ("_id", -1)]
+    ).limit(limit + 1).to_list(limit + 1)
+
+    next_cursor = None
+    if len(docs) > limit:
+        docs = docs[:limit]
+        next_cursor = encode_cursor(docs[-1]["timestamp"], docs[-1]["_id"])
+
+    latest = await forum_replies.latest_replies((d["_id"] for d in docs), replies)
+    for doc in docs:
+        doc.setdefault("reply_count", 0)
+        doc["replies"] = latest.get(str(doc["_id"]), [])
+
+    return jsonable_encoder({"items": await hydrate_threads(docs), "next_cursor": next_cursor})
+
+
+@router.get("/{thread_id}/replies")
+async def list_replies(
+    thread_id: str,
+    cursor: Optional[str] = Query(None),
+    limit: int = Query(50, ge=1, le=200),
+):
+    """Replies of a thread oldest first, keyset-paged on (timestamp, id)."""
+    try:
+        thread_oid = ObjectId(thread_id)
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid thread id")
+
+    after = None
+    if cursor:
+        timestamp, reply_id = decode_cursor(cursor)
+        if not ObjectId.is_valid(reply_id):
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+        after = (timestamp, ObjectId(reply_id))
+
+    thread, items = await asyncio.gather(
+        forum_collection.find_one({"_id": thread_oid}, {"reply_count": 1}),
+        forum_replies.page_replies(thread_id, after, limit),
+    )
+    if not thread:
+        raise HTTPException(status_code=404, detail="Thread not found")
+
+    next_cursor = None
+    if len(items) > limit:
+        items = items[:limit]
+        next_cursor = encode_cursor(items[-1]["timestamp"], items[-1]["id"])
+
+    cards = await get_cards(author_ids([{"replies": items}]))
+    for reply in items:
+        if isinstance(reply.get("author"), dict):
+            reply["author"] = resolve_forum_author(reply["author"], cards)
+
+    return jsonable_encoder({
+        "items": items,
+        "reply_count": thread.get("reply_count", 0),
+        "next_cursor": next_cursor,
+    })
+
+
+@router.get("/events")
+async def stream_events(
+    request: Request,
+    thread: Optional[List[str]] = Query(None, description="Only replies to these threads"),
+    last_event_id: Optional[int] = Query(None, ge=0, description="Resume after this event id"),
+    last_event_id_header: Optional[str] = Header(None, alias="Last-Event-ID"),
+):
+    """
+    Server-sent events: `thread_created` and `reply_added` as they happen,
+    so clients apply deltas instead of refetching the listing. Browsers
+    resume with the Last-Event-ID header on reconnect; `reset` means the
+    missed events are gone and the listing must be reloaded.
+    """
+    after = last_event_id
+    if last_event_id_header:
+        try:
+            after = int(last_event_id_header)
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Invalid Last-Event-ID")
+
+    threads = [t.strip() for value in (thread or []) for t in value.split(",") if t.strip()]
+    sub = await forum_events.broker.subscribe(threads or None)
+    return StreamingResponse(
+        forum_events.stream(sub, after, request.is_disconnected),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
 
 
 @router.get("/{thread_id}")
@@ -143,6 +251,7 @@ async def get_thread(thread_id: str):
     if not thread:
         raise HTTPException(status_code=404, detail="Thread not found")
 
+    thread["replies"] = (await forum_replies.replies_by_thread([thread_id])).get(thread_id, [])
     return await hydrate_thread(thread)
 
 
@@ -161,17 +270,10 @@ async def create_thread(
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
 
-    user_folder = BASE_UPLOAD_DIR / str(user_id) / "forums"
-    user_folder.mkdir(parents=True, exist_ok=True)
-
     resolved_image_url = None
     if image:
-        ext = os.path.splitext(image.filename)[1]
-        filename = f"forum_post_{int(datetime.now().timestamp())}{ext}"
-        file_path = user_folder / filename
-        with open(file_path, "wb") as f:
-            f.write(await image.read())
-        resolved_image_url = f"http://127.0.0.1:8000/uploads/{user_id}/forums/{filename}"
+        blob = await store_upload(image)
+        resolved_image_url = blob["url"]
     elif image_url:
         resolved_image_url = image_url.strip() or None
 
@@ -182,9 +284,7 @@ async def create_thread(
     # remove that so posts can be tagless when user chooses none.
 
 
-    avatar_url = None
-    if user.get("profile_photo"):
-        avatar_url = f"http://127.0.0.1:8000/api/user/profile-photo/{user['profile_photo']}"
+    avatar_url = user_avatar_url(user)
 
     author = ForumAuthor(
         user_id=str(user["_id"]),
@@ -203,8 +303,10 @@ async def create_thread(
     )
 
     result = await forum_collection.insert_one(
-        thread.model_dump(by_alias=True, exclude_none=True)
+        thread.model_dump(by_alias=True, exclude_none=True, exclude={"replies"})
     )
+    await record_thread_tags(tags_list, at=thread.timestamp)
+    search_index.refresh_soon(KIND_THREAD, result.inserted_id)
 
 
     response_thread = thread.model_dump()
@@ -213,7 +315,12 @@ async def create_thread(
     if "_id" in response_thread:
         del response_thread["_id"]
 
-    return JSONResponse(status_code=200, content={"status": "success", "thread": jsonable_encoder(response_thread)})
+    response_thread = jsonable_encoder(response_thread)
+    await forum_events.publish(
+        forum_events.EVENT_THREAD_CREATED, {"thread": response_thread}, thread_id=result.inserted_id
+    )
+
+    return JSONResponse(status_code=200, content={"status": "success", "thread": response_thread})
 
 
 @router.post("/reply")
@@ -224,7 +331,7 @@ async def add_reply(
 ):
     """Add a reply to a thread."""
 
-    thread = await forum_collection.find_one({"_id": ObjectId(thread_id)})
+    thread = await forum_collection.find_one({"_id": ObjectId(thread_id)}, {"_id": 1})
     if not thread:
         raise HTTPException(status_code=404, detail="Thread not found")
 
@@ -232,9 +339,7 @@ async def add_reply(
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
 
-    avatar_url = None
-    if user.get("profile_photo"):
-        avatar_url = f"http://127.0.0.1:8000/api/user/profile-photo/{user['profile_photo']}"
+    avatar_url = user_avatar_url(user)
 
     reply_author = ForumAuthor(
         user_id=str(user["_id"]),
@@ -250,12 +355,15 @@ async def add_reply(
         timestamp=datetime.now(),
     )
 
-    await forum_collection.update_one(
-        {"_id": ObjectId(thread_id)},
-        {"$push": {"replies": reply.model_dump(by_alias=True, exclude_none=True)}},
+    await forum_replies.add_reply(thread["_id"], reply.model_dump(by_alias=True, exclude_none=True))
+    search_index.refresh_soon(KIND_THREAD, thread["_id"])
+
+    reply_json = jsonable_encoder(reply)
+    await forum_events.publish(
+        forum_events.EVENT_REPLY_ADDED, {"thread_id": thread_id, "reply": reply_json}, thread_id=thread_id
     )
 
     return JSONResponse(
         status_code=200,
-        content={"status": "success", "reply": jsonable_encoder(reply)}
+        content={"status": "success", "reply": reply_json}
     )
\ No newline at end of file
@@ -1,10 +1,12 @@
-from fastapi import APIRouter, HTTPException, Query, UploadFile, File
+import asyncio
+import logging
+
+from fastapi import APIRouter, HTTPException, Query, UploadFile, File, Request
 from bson import ObjectId
+from pymongo import ReturnDocument
 from datetime import datetime
 from typing import Optional
 from pathlib import Path
-import shutil
-import time
 
 from db.connection import (
     homeworks_collection,
@@ -13,16 +15,35 @@ from db.connection import (
     cases_collection,
     qna_collection,
     annot_collection,
+    submissions_collection,
+    submissions_archive_collection,
+    homework_events_collection,
 )
+from core.blobstore import store_upload, release, release_refs, blob_refs
+from core.dicom import ingest_blob_if_dicom
+from core import assignments, completion, similarity
+from core.case_bundles import load_case_bundle, invalidate_case_bundle
+from core.drafts import drafts
+from core.scheduler import normalize_due, scheduler
+from core.search import KIND_CASE, search_index
+from core.homework_import import import_homeworks, parse_manifest
 
 router = APIRouter(prefix="/api/instructor/homeworks", tags=["Homeworks"])
 
-UPLOAD_ROOT = Path("uploads")
+logger = logging.getLogger(__name__)
 
 def now():
     return datetime.utcnow()
 
 
+async def is_instructor_user(user_id: str) -> bool:
+    try:
+        user_doc = await users_collection.find_one({"_id": ObjectId(user_id)}, {"role": 1})
+    except Exception:
+        return False
+    return bool(user_doc) and str(user_doc.get("role", "")).lower() in ("instructor", "admin")
+
+
 # ====================================================
 # Instructor: Create Homework
 # ====================================================
@@ -79,10 +100,13 @@ async def create_homework(payload: dict):
         raise HTTPException(status_code=400, detail="Case title is required")
     if not due_at_iso:
         raise HTTPException(status_code=400, detail="Due date is required")
+    due_at_utc = normalize_due(due_at_iso)
+    if due_at_utc is None:
+        raise HTTPException(status_code=400, detail="Invalid due date")
 
     audience = "Classrooms" if audience_raw in ("classroom", "classrooms") else "All Students"
 
-    print(f"DEBUG CREATE: audience_raw={audience_raw}, audience={audience}, class_ids={class_ids}")
+    logger.debug("create_homework: audience_raw=%s audience=%s class_ids=%s", audience_raw, audience, class_ids)
 
     # Create case when payload uses `newCase`, otherwise attach homework to provided case_id.
     if not case_id:
@@ -113,6 +137,7 @@ async def create_homework(payload: dict):
         "audience": audience,
         "visibility": "private" if visibility_raw == "private" else "public",
         "due_at": due_at_iso,
+        "due_at_utc": due_at_utc,
         "status": "active",
         "max_points": int(max_points),
         "created_at": now(),
@@ -148,9 +173,58 @@ async def create_homework(payload: dict):
         }
         await annot_collection.insert_one(annot_doc)
 
+    # A new homework becomes the case's latest one
+    invalidate_case_bundle(case_id)
+    scheduler.schedule(homework_result.inserted_id, due_at_utc)
+    # The homework's visibility decides whether the case is searchable
+    search_index.refresh_soon(KIND_CASE, case_id)
+
     return {"case_id": case_id, "homework_id": str(homework_result.inserted_id)}
 
 
+# ====================================================
+# Instructor: Bulk Create Homeworks
+# ====================================================
+
+@router.post("/bulk", response_model=dict)
+async def bulk_create_homeworks(request: Request, dry_run: bool = Query(False)):
+    """
+    Create many homeworks from one manifest, either as a JSON body
+    ({"rows": [...]} or a list) or as multipart with a `manifest` file
+    (.csv or .json). Multipart requests may add one `image` (or a finished
+    resumable `upload_id`) that becomes the image of every new case without
+    an image_url. Valid rows are written together; invalid rows are
+    reported per row and skipped. `dry_run` only validates.
+    """
+    shared_blob = None
+    if request.headers.get("content-type", "").startswith("multipart/"):
+        form = await request.form()
+        manifest = form.get("manifest")
+        if not hasattr(manifest, "read"):
+            raise HTTPException(status_code=400, detail="Manifest file is required")
+        rows = parse_manifest(await manifest.read(), manifest.filename, manifest.content_type)
+
+        image, upload_id = form.get("image"), form.get("upload_id")
+        if not dry_run and (hasattr(image, "read") or upload_id):
+            shared_blob = await store_upload(
+                image if hasattr(image, "read") else None,
+                upload_id or None,
+                owner_id=form.get("userId"),
+            )
+    else:
+        rows = parse_manifest(await request.body(), content_type="application/json")
+
+    summary = await import_homeworks(rows, shared_blob=shared_blob, dry_run=dry_run)
+
+    for homework_id, case_id, due_at_utc in summary.pop("homeworks"):
+        invalidate_case_bundle(case_id)
+        scheduler.schedule(homework_id, due_at_utc)
+        search_index.refresh_soon(KIND_CASE, case_id)
+
+    logger.info("bulk homework import: %d created, %d failed", summary["created"], summary["failed"])
+    return summary
+
+
 # ====================================================
 # Student: Get Homework by Case
 # ====================================================
@@ -160,135 +234,45 @@ async def homework_by_case(
     caseId: str = Query(...),
     userId: str = Query(...)
 ):
-    # Get case for page context even when homework is inaccessible.
-    case = None
-    try:
-        case = await cases_collection.find_one({"_id": ObjectId(caseId)})
-    except Exception:
-        case = await cases_collection.find_one({"case_id": caseId})
-    if case:
-        case["_id"] = str(case["_id"])
-        case.pop("created_at", None)
-
-    # Get latest homework by case.
-    hw = await homeworks_collection.find_one(
-        {"case_id": caseId},
-        sort=[("created_at", -1)]
+    # Case context is returned even when the homework is inaccessible.
+    # The per-case bundle is shared (and cached) across students; only the
+    # role lookup and the assignment check depend on the caller.
+    bundle, is_instructor_like = await asyncio.gather(
+        load_case_bundle(caseId),
+        is_instructor_user(userId),
     )
+    case, hw = bundle["case"], bundle["homework"]
 
-    if not hw:
-        return {
-            "case": case,
-            "homework": None,
-            "qna": None,
-            "annot": None,
-            "assigned": False
-        }
-
-    # Get QNA if exists
-    qna = await qna_collection.find_one({"case_id": caseId})
-    if qna:
-        qna.pop("_id", None)
-
-    # Get Annot if exists
-    annot = await annot_collection.find_one({"case_id": caseId})
-    if annot:
-        annot.pop("_id", None)
-
-    # Assignment check
-    assigned = False
-    is_instructor_like = False
-    try:
-        user_doc = await users_collection.find_one({"_id": ObjectId(userId)})
-        if user_doc and str(user_doc.get("role", "")).lower() in ("instructor", "admin"):
-            is_instructor_like = True
-    except Exception:
-        pass
-
-    print(f"DEBUG: userId={userId}, is_instructor_like={is_instructor_like}")
+    hidden = {
+        "case": case,
+        "homework": None,
+        "qna": None,
+        "annot": None,
+        "assigned": False
+    }
 
-    if is_instructor_like:
-        assigned = True
+    if not hw:
+        return hidden
 
-    audience = (hw.get("audience") or "All Students")
-    audience_norm = str(audience).strip().lower()
     visibility_norm = str(hw.get("visibility") or "public").strip().lower()
-
-    print(f"DEBUG: audience={audience}, audience_norm={audience_norm}, visibility_norm={visibility_norm}")
-
     if not is_instructor_like and visibility_norm == "private":
-        return {
-            "case": case,
-            "homework": None,
-            "qna": None,
-            "annot": None,
-            "assigned": False
-        }
+        return hidden
 
-    if not assigned and audience_norm in ("all students", "all"):
-        assigned = True
-        print("DEBUG: assigned=True for all students")
-    elif not assigned and audience_norm in ("classrooms", "classroom"):
-        print("DEBUG: checking classrooms")
-        # Check if user is in any selected classroom.
-        class_ids = [str(x) for x in hw.get("class_ids", []) if x]
-        print(f"DEBUG: class_ids={class_ids}")
-        if class_ids:
-            valid_ids = []
-            for class_id in class_ids:
-                try:
-                    valid_ids.append(ObjectId(class_id))
-                except Exception:
-                    continue
-
-            print(f"DEBUG: valid_ids={valid_ids}")
-            if valid_ids:
-                cursor = classrooms_collection.find({"_id": {"$in": valid_ids}})
-                async for classroom in cursor:
-                    member_ids = [str(x) for x in classroom.get("members", [])]
-                    student_ids = [str(x) for x in classroom.get("students", [])]
-                    combined_ids = set(member_ids + student_ids)
-                    print(f"DEBUG: classroom {classroom.get('_id')}, members={member_ids}, students={student_ids}")
-                    if userId in combined_ids:
-                        assigned = True
-                        print("DEBUG: user in classroom, assigned=True")
-                        break
-
-        if not assigned:
-            print("DEBUG: checking fallback class_name")
-            classroom = await classrooms_collection.find_one({
-                "name": hw.get("class_name"),
-                "year": hw.get("year")
-            })
-            if classroom:
-                member_ids = [str(x) for x in classroom.get("members", [])]
-                student_ids = [str(x) for x in classroom.get("students", [])]
-                combined_ids = set(member_ids + student_ids)
-                print(f"DEBUG: fallback classroom members={member_ids}, students={student_ids}")
-                assigned = userId in combined_ids
-                if assigned:
-                    print("DEBUG: assigned via fallback")
-
-    print(f"DEBUG: final assigned={assigned}")
-
-    hw["_id"] = str(hw["_id"])
-    hw.pop("created_at", None)
+    assigned = is_instructor_like or await assignments.is_assigned(hw, userId)
+    logger.debug(
+        "homework_by_case: case_id=%s user_id=%s instructor=%s audience=%s assigned=%s",
+        caseId, userId, is_instructor_like, hw.get("audience"), assigned,
+    )
 
     # If not assigned to this homework, hide homework payload while still returning case.
     if not assigned:
-        return {
-            "case": case,
-            "homework": None,
-            "qna": None,
-            "annot": None,
-            "assigned": False
-        }
+        return hidden
 
     return {
         "case": case,
         "homework": hw,
-        "qna": qna,
-        "annot": annot,
+        "qna": bundle["qna"],
+        "annot": bundle["annot"],
         "assigned": assigned
     }
 
@@ -309,7 +293,16 @@ async def update_homework_by_case(case_id: str, payload: dict):
     if payload.get("instructions") is not None:
         update_doc["instructions"] = payload.get("instructions")
     if payload.get("due_at") is not None:
+        due_at_utc = normalize_due(payload.get("due_at"))
+        if due_at_utc is None:
+            raise HTTPException(status_code=400, detail="Invalid due date")
         update_doc["due_at"] = payload.get("due_at")
+        update_doc["due_at_utc"] = due_at_utc
+        # Extending a closed homework's deadline reopens it
+        if hw.get("status") == "closed" and due_at_utc > now():
+            update_doc["status"] = "active"
+            unset_doc["closed_at"] = ""
+            unset_doc["grading_status"] = ""
     if payload.get("max_points") is not None:
         try:
             update_doc["max_points"] = int(payload.get("max_points"))
@@ -391,9 +384,11 @@ async def update_homework_by_case(case_id: str, payload: dict):
             )
         except Exception:
             pass
+        search_index.refresh_soon(KIND_CASE, case_id)
 
     # Update Q&A content when provided from case edit flow.
     if payload.get("questions") is not None or payload.get("instructions") is not None:
+        qna_before = await qna_collection.find_one({"case_id": case_id})
         qna_update = {}
         if payload.get("instructions") is not None:
             qna_update["instructions"] = payload.get("instructions")
@@ -403,11 +398,25 @@ async def update_homework_by_case(case_id: str, payload: dict):
             qna_update["total_questions"] = len(questions)
 
         if qna_update:
-            await qna_collection.update_one(
+            qna_after = await qna_collection.find_one_and_update(
                 {"case_id": case_id},
                 {"$set": qna_update},
                 upsert=True,
+                return_document=ReturnDocument.AFTER,
             )
+            # Question images that were replaced or removed
+            await release_refs(blob_refs(qna_before) - blob_refs(qna_after))
+
+    invalidate_case_bundle(case_id)
+    if "due_at_utc" in update_doc:
+        scheduler.schedule(hw["_id"], update_doc["due_at_utc"])
+    if update_doc.get("status") == "active":
+        # Drafts frozen at the old deadline become editable again
+        await submissions_collection.update_many(
+            {"homework_id": str(hw["_id"]), "status": "draft", "frozen": True},
+            {"$unset": {"frozen": "", "frozen_at": ""}},
+        )
+        await completion.recount(str(hw["_id"]))
 
     return {"status": "ok", "homework_id": str(hw["_id"])}
 
@@ -419,39 +428,97 @@ async def upload_homework_file(
 ):
     """
     Upload an image file for annotation homework.
-    Path: uploads/{userId}/cases/{filename}
+    Stored content-addressed under uploads/blobs/, so re-uploading the same
+    reference image returns the same URL without writing it again.
+    DICOM files are decoded and `url` points at the default-window preview.
     """
     if not file:
         raise HTTPException(status_code=400, detail="File is required")
 
-    # Path: uploads/{userId}/cases/
-    cases_dir = UPLOAD_ROOT / userId / "cases"
-    cases_dir.mkdir(parents=True, exist_ok=True)
-
-    # Generate filename with timestamp to avoid conflicts
-    timestamp = int(time.time() * 1000)
     safe_name = Path(file.filename).name
-    filename = f"{timestamp}_{safe_name}"
-    file_path = cases_dir / filename
 
     try:
-        with open(file_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
+        blob = await store_upload(file)
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"File upload failed: {str(e)}")
 
+    try:
+        dicom = await ingest_blob_if_dicom(blob, safe_name)
+    except HTTPException:
+        await release(blob["sha256"])
+        raise
+
     # Return full URL and relative URL
-    full_url = f"http://127.0.0.1:8000/uploads/{userId}/cases/{filename}"
-    relative_url = f"/uploads/{userId}/cases/{filename}"
+    full_url = blob["url"]
+    relative_url = f"/uploads/{blob['key']}"
 
-    return {
-        "name": filename,
+    result = {
+        "name": safe_name,
         "url": full_url,
         "relative_url": relative_url,
         "type": file.content_type,
-        "size": file_path.stat().st_size,
-        "filename": filename
+        "size": blob["size"],
+        "filename": safe_name,
+        "sha256": blob["sha256"],
     }
+    if dicom:
+        result["url"] = dicom["preview_urls"]["default"]
+        result["source_url"] = full_url
+        result["dicom"] = dicom
+    return result
+
+
+async def delete_case_homeworks(case_id: str) -> list:
+    """
+    Delete the homeworks of a case with everything hanging off them:
+    qna/annot content, submissions (archived ones too), pending drafts,
+    lifecycle events, completion counters and similarity data. Blob
+    references they hold are released; the case's own image is not.
+    Returns the deleted homework documents.
+    """
+    homeworks = await homeworks_collection.find({"case_id": case_id}).to_list(None)
+    homework_ids = [str(hw["_id"]) for hw in homeworks]
+    qnas = await qna_collection.find({"case_id": case_id}).to_list(None)
+    annots = await annot_collection.find({"case_id": case_id}).to_list(None)
+    by_homework = {"homework_id": {"$in": homework_ids}}
+    subs = await submissions_collection.find(by_homework, {"files": 1}).to_list(None)
+    archived = await submissions_archive_collection.find(by_homework, {"files": 1}).to_list(None)
+
+    for homework_id in homework_ids:
+        scheduler.unschedule(homework_id)
+        drafts.discard_homework(homework_id)
+    await homeworks_collection.delete_many({"case_id": case_id})
+    await qna_collection.delete_many({"case_id": case_id})
+    await annot_collection.delete_many({"case_id": case_id})
+    if homework_ids:
+        await submissions_collection.delete_many(by_homework)
+        await submissions_archive_collection.delete_many(by_homework)
+        await homework_events_collection.delete_many(by_homework)
+    invalidate_case_bundle(case_id)
+    await completion.drop(homework_ids)
+    await similarity.drop(homework_ids)
+
+    # Copies of the case image in qna/annot hold no reference
+    await release_refs(blob_refs(homeworks, qnas, annots, subs, archived))
+    return homeworks
+
+
+@router.delete("/by-case/{case_id}", response_model=dict)
+async def delete_homework_by_case(case_id: str):
+    """
+    Delete the homework attached to a case along with its qna/annot content
+    and its submissions. Uploaded files are released unless something else
+    (e.g. the case itself) still uses them.
+    """
+    if not await homeworks_collection.find_one({"case_id": case_id}, {"_id": 1}):
+        raise HTTPException(status_code=404, detail="Homework not found for case")
+
+    homeworks = await delete_case_homeworks(case_id)
+    search_index.refresh_soon(KIND_CASE, case_id)
+
+    return {"ok": True, "deleted_homework_ids": [str(hw["_id"]) for hw in homeworks]}
 
 
 # ====================================================
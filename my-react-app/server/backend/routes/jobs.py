@@ -0,0 +1,14 @@
+from fastapi import APIRouter, HTTPException
+from fastapi.encoders import jsonable_encoder
+
+from core.jobs import get_job
+
+router = APIRouter(prefix="/api/instructor/jobs", tags=["Jobs"])
+
+
+@router.get("/{job_id}")
+async def job_status(job_id: str):
+    job = await get_job(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return jsonable_encoder(job)
@@ -0,0 +1,49 @@
+from typing import Optional
+
+from fastapi import APIRouter, HTTPException, Query, Request
+
+from core.blobstore import BLOB_PREFIX
+from core.storage import key_from_url, serve_key, storage
+
+router = APIRouter(tags=["Media"])
+
+
+# ===============================
+# Serve Uploaded Files
+# ===============================
+
+@router.api_route("/uploads/{path:path}", methods=["GET", "HEAD"])
+async def serve_upload(path: str, request: Request):
+    """
+    Replaces the plain StaticFiles mount: content-addressed blobs are cached
+    as immutable, other files revalidate against their content-hash ETag.
+    With remote storage this redirects to a presigned object URL.
+    """
+    immutable = path.startswith(f"{BLOB_PREFIX}/")
+    return await serve_key(request, path, immutable=immutable)
+
+
+# ===============================
+# Direct Download URLs
+# ===============================
+
+@router.get("/api/media/download-url")
+async def get_download_url(
+    url: Optional[str] = Query(None, description="Stored upload URL"),
+    key: Optional[str] = Query(None, description="Storage key, e.g. blobs/ab/<sha256>.png"),
+    expires: Optional[int] = Query(None, ge=60, le=7 * 24 * 3600),
+):
+    """
+    A URL the client can download from directly. For S3-compatible storage
+    this is a presigned GET URL, so large files skip the API server.
+    """
+    key = key or key_from_url(url)
+    if not key:
+        raise HTTPException(status_code=400, detail="A stored upload url or key is required")
+    if not await storage.exists(key):
+        raise HTTPException(status_code=404, detail="File not found")
+    return {
+        "url": await storage.download_url(key, expires),
+        "backend": storage.name,
+        "expires_in": None if storage.name == "local" else expires or storage.presign_expires,
+    }
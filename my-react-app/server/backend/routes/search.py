@@ -0,0 +1,46 @@
+from typing import List, Optional
+
+from fastapi import APIRouter, Query
+from fastapi.encoders import jsonable_encoder
+
+from core.search import KIND_CASE, KIND_THREAD, search_index
+
+router = APIRouter(prefix="/api/search", tags=["Search"])
+
+KIND_PATTERN = f"^({KIND_THREAD}|{KIND_CASE})$"
+
+
+def _split(values: Optional[List[str]]) -> List[str]:
+    return [v.strip() for value in (values or []) for v in value.split(",") if v.strip()]
+
+
+@router.get("")
+async def search(
+    q: str = Query(..., min_length=1, max_length=200),
+    kind: Optional[str] = Query(None, pattern=KIND_PATTERN, description="Only threads or only cases"),
+    tag: Optional[List[str]] = Query(None, description="Threads with any of these tags"),
+    case_type: Optional[List[str]] = Query(None, description="Cases of any of these types"),
+    prefix: bool = Query(True, description="Treat an unfinished last word as a prefix"),
+    offset: int = Query(0, ge=0),
+    limit: int = Query(20, ge=1, le=100),
+):
+    """
+    BM25-ranked forum threads (title, content, replies) and cases (title,
+    description, type). `facets` counts every match by kind, tag and case
+    type; page on with `next_offset`.
+    """
+    result = await search_index.search(
+        q, kind=kind, tags=_split(tag), case_types=_split(case_type),
+        prefix=prefix, offset=offset, limit=limit,
+    )
+    return jsonable_encoder(result)
+
+
+@router.get("/suggest")
+async def suggest(
+    q: str = Query(..., min_length=1, max_length=200),
+    kind: Optional[str] = Query(None, pattern=KIND_PATTERN),
+    limit: int = Query(10, ge=1, le=50),
+):
+    """Autocomplete: `q` with its last word completed, most common completions first."""
+    return await search_index.suggest(q, kind=kind, limit=limit)
@@ -0,0 +1,239 @@
+import base64
+import hashlib
+import json
+from datetime import datetime
+from typing import List, Optional
+
+from bson import ObjectId
+from fastapi import APIRouter, HTTPException, Query, Request
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse, Response
+
+from core.media import etag_matches
+from db.connection import homeworks_collection
+
+router = APIRouter(prefix="/api/student", tags=["Student"])
+
+DASHBOARD_STATUSES = ("pending", "overdue", "submitted", "graded")
+# Homeworks without a parseable due date sort after everything else
+NO_DUE_DATE = datetime(9999, 12, 31)
+
+
+def encode_cursor(due: datetime, homework_id) -> str:
+    raw = f"{due.isoformat()}|{homework_id}".encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        due, homework_id = raw.rsplit("|", 1)
+        return datetime.fromisoformat(due), ObjectId(homework_id)
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+def dashboard_pipeline(
+    user_id: str,
+    now: datetime,
+    statuses: Optional[List[str]] = None,
+    after=None,
+    limit: int = 20,
+) -> list:
+    """
+    Everything the student dashboard needs in one round trip: the
+    student's classrooms, the homeworks assigned to them, the case card and
+    their own submission, with a derived status and due-date keyset paging.
+    """
+    pipeline = [
+        {"$match": {"visibility": {"$ne": "private"}}},
+        # The student's classrooms; uncorrelated, so it runs once per query.
+        # Name and year resolve legacy homeworks that target a classroom by
+        # class_name/year instead of class_ids (as core.assignments does)
+        {"$lookup": {
+            "from": "class_memberships",
+            "pipeline": [
+                {"$match": {"user_id": user_id}},
+                {"$lookup": {
+                    "from": "classrooms",
+                    "let": {"cid": {"$convert": {"input": "$class_id", "to": "objectId", "onError": None, "onNull": None}}},
+                    "pipeline": [
+                        {"$match": {"$expr": {"$eq": ["$_id", "$$cid"]}}},
+                        {"$project": {"_id": 0, "name": 1, "year": {"$ifNull": ["$year", None]}}},
+                    ],
+                    "as": "_classroom",
+                }},
+                {"$project": {"_id": 0, "class_id": 1, "classroom": {"$first": "$_classroom"}}},
+            ],
+            "as": "_memberships",
+        }},
+        {"$match": {"$expr": {"$or": [
+            {"$in": [{"$toLower": {"$ifNull": ["$audience", "All Students"]}}, ["all students", "all"]]},
+            {"$gt": [
+                {"$size": {"$setIntersection": [{"$ifNull": ["$class_ids", []]}, "$_memberships.class_id"]}},
+                0,
+            ]},
+            {"$and": [
+                {"$eq": [{"$size": {"$ifNull": ["$class_ids", []]}}, 0]},
+                {"$ne": [{"$ifNull": ["$class_name", None]}, None]},
+                {"$in": [
+                    {"name": "$class_name", "year": {"$ifNull": ["$year", None]}},
+                    "$_memberships.classroom",
+                ]},
+            ]},
+        ]}}},
+        {"$lookup": {
+            "from": "submissions",
+            "let": {"hid": {"$toString": "$_id"}},
+            "pipeline": [
+                {"$match": {"user_id": user_id}},
+                {"$match": {"$expr": {"$eq": ["$homework_id", "$$hid"]}}},
+                {"$project": {
+                    "status": 1, "score": 1, "feedback": 1, "published": 1, "updated_at": 1,
+                }},
+                {"$limit": 1},
+            ],
+            "as": "_submission",
+        }},
+        {"$lookup": {
+            "from": "cases",
+            "let": {"cid": {"$convert": {"input": "$case_id", "to": "objectId", "onError": None, "onNull": None}}},
+            "pipeline": [
+                {"$match": {"$expr": {"$eq": ["$_id", "$$cid"]}}},
+                {"$project": {"title": 1, "description": 1, "image_url": 1, "case_type": 1, "dicom": 1}},
+            ],
+            "as": "_case",
+        }},
+        {"$set": {
+            "submission": {"$first": "$_submission"},
+            "case": {"$first": "$_case"},
+            # Normalized by the due-date scheduler (core.scheduler)
+            "_due": {"$ifNull": ["$due_at_utc", None]},
+        }},
+        {"$set": {
+            "_due_sort": {"$ifNull": ["$_due", NO_DUE_DATE]},
+            "student_status": {"$switch": {
+                "branches": [
+                    {"case": {"$eq": ["$submission.published", True]}, "then": "graded"},
+                    # An autosaved draft still counts as pending/overdue
+                    {"case": {"$and": [
+                        {"$ne": [{"$type": "$submission"}, "missing"]},
+                        {"$ne": ["$submission.status", "draft"]},
+                    ]}, "then": "submitted"},
+                    {"case": {"$or": [
+                        {"$eq": ["$status", "closed"]},
+                        {"$and": [{"$ne": ["$_due", None]}, {"$lt": ["$_due", now]}]},
+                    ]}, "then": "overdue"},
+                ],
+                "default": "pending",
+            }},
+        }},
+    ]
+
+    if statuses:
+        pipeline.append({"$match": {"student_status": {"$in": statuses}}})
+
+    if after:
+        due, homework_oid = after
+        pipeline.append({"$match": {"$or": [
+            {"_due_sort": {"$gt": due}},
+            {"_due_sort": due, "_id": {"$gt": homework_oid}},
+        ]}})
+
+    pipeline += [
+        {"$sort": {"_due_sort": 1, "_id": 1}},
+        {"$limit": limit + 1},
+        {"$project": {
+            "case_id": 1,
+            "homework_type": 1,
+            "due_at": 1,
+            "audience": 1,
+            "class_labels": 1,
+            "max_points": 1,
+            "status": 1,
+            "student_status": 1,
+            "case": 1,
+            "submission": 1,
+            "_due_sort": 1,
+        }},
+    ]
+    return pipeline
+
+
+def dashboard_item(doc: dict) -> dict:
+    case = doc.get("case") or {}
+    sub = doc.get("submission")
+    published = bool(sub and sub.get("published"))
+    return {
+        "homework_id": str(doc["_id"]),
+        "case_id": doc.get("case_id"),
+        "homework_type": doc.get("homework_type"),
+        "due_at": doc.get("due_at"),
+        "audience": doc.get("audience"),
+        "class_labels": doc.get("class_labels", []),
+        "max_points": doc.get("max_points"),
+        "homework_status": doc.get("status"),
+        "status": doc.get("student_status"),
+        "case": {
+            "title": case.get("title"),
+            "description": case.get("description"),
+            "image_url": case.get("image_url"),
+            "case_type": case.get("case_type"),
+            "dicom": case.get("dicom"),
+        },
+        "submission": {
+            "submission_id": str(sub["_id"]),
+            "status": sub.get("status"),
+            # Grades stay hidden until the instructor publishes them
+            "score": sub.get("score") if published else None,
+            "feedback": sub.get("feedback") if published else None,
+            "published": published,
+            "updated_at": sub.get("updated_at"),
+        } if sub else None,
+    }
+
+
+# ===============================
+# Student Dashboard
+# ===============================
+
+@router.get("/homeworks")
+async def my_homeworks(
+    request: Request,
+    userId: str = Query(...),
+    status: Optional[List[str]] = Query(None, description="pending, overdue, submitted or graded"),
+    cursor: Optional[str] = Query(None),
+    limit: int = Query(20, ge=1, le=100),
+):
+    """
+    Assigned homeworks for one student ordered by due date, with case card
+    data and the student's own submission status. Unchanged pages answer
+    If-None-Match with 304.
+    """
+    statuses = [s.strip().lower() for value in (status or []) for s in value.split(",") if s.strip()]
+    unknown = set(statuses) - set(DASHBOARD_STATUSES)
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown status: {', '.join(sorted(unknown))}")
+
+    after = decode_cursor(cursor) if cursor else None
+    pipeline = dashboard_pipeline(userId, datetime.utcnow(), statuses, after, limit)
+    docs = await homeworks_collection.aggregate(pipeline).to_list(limit + 1)
+
+    next_cursor = None
+    if len(docs) > limit:
+        docs = docs[:limit]
+        last = docs[-1]
+        next_cursor = encode_cursor(last["_due_sort"], last["_id"])
+
+    body = jsonable_encoder({
+        "items": [dashboard_item(doc) for doc in docs],
+        "next_cursor": next_cursor,
+    })
+
+    # Hash of the rendered page, so a pending -> overdue flip changes it too
+    digest = hashlib.sha256(json.dumps(body, sort_keys=True).encode()).hexdigest()
+    etag = f'"{digest}"'
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+    return JSONResponse(body, headers=headers)
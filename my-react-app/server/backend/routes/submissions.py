@@ -1,9 +1,12 @@
-from fastapi import APIRouter, HTTPException, Query, UploadFile, File, Body
-from fastapi.responses import FileResponse
+from fastapi import APIRouter, HTTPException, Query, UploadFile, File, Body, Request, Header
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+from pymongo import ReturnDocument, UpdateOne
+from pymongo.errors import DuplicateKeyError
 from bson import ObjectId
 from datetime import datetime
 from pathlib import Path
-import shutil
+from typing import Optional
 
 from db.connection import (
     submissions_collection,
@@ -13,13 +16,41 @@ from db.connection import (
     qna_collection,
     versions_collection,
 )
-from models.models import SubmissionCreate, SubmissionOut, GradeRequest
+from models.models import (
+    SubmissionCreate,
+    SubmissionOut,
+    GradeRequest,
+    DraftPatch,
+    DraftSubmit,
+    BulkGradeRequest,
+    BulkSelection,
+    BulkReturnRequest,
+)
+from core.blobstore import blob_refs, release_refs, store_upload
+from core.storage import serve_key
+from core import assignments
+from core.scheduler import is_past_due
+from core import idempotency
+from core.drafts import drafts
+from core import completion, similarity
+from core.grading import auto_grade_homework
+from core.analytics import homework_analytics
+from core.jobs import start_job
+from core.config import BULK_SYNC_LIMIT
+from core.gradebook import gradebook_header, iter_gradebook_rows
+from core.spreadsheets import CSV_MEDIA_TYPE, XLSX_MEDIA_TYPE, iter_csv, iter_xlsx
+from core.submission_archive import (
+    archive_fingerprint,
+    cached_archive,
+    iter_archive_entries,
+    serve_cached_archive,
+    tee_to_cache,
+)
+from core.zipstream import iter_zip
+from core.media import etag_matches
 
 router = APIRouter(prefix="/api", tags=["Submissions"])
 
-UPLOAD_ROOT = Path("uploads")
-UPLOAD_ROOT.mkdir(exist_ok=True)
-
 
 def now():
     return datetime.utcnow()
@@ -56,33 +87,37 @@ def build_model_answers(questions):
 async def upload_submission_file(
     file: UploadFile = File(...),
     homeworkId: str = Query(...),
-    userId: str = Query(...)
+    userId: str = Query(...),
+    idempotency_key: Optional[str] = Header(None, alias=idempotency.HEADER),
 ):
-    user_dir = UPLOAD_ROOT / userId / "submissions" / homeworkId
-    user_dir.mkdir(parents=True, exist_ok=True)
-
+    """
+    Store a submission file in the content-addressed blob store. The
+    reference taken here belongs to the submission that lists the returned
+    `url`, and is released when that file is replaced or removed.
+    """
     safe_name = Path(file.filename).name
-    file_path = user_dir / safe_name
 
-    with open(file_path, "wb") as buffer:
-        shutil.copyfileobj(file.file, buffer)
+    async def store():
+        blob = await store_upload(file)
+        return {
+            "url": blob["url"],
+            "relative_url": f"/uploads/{blob['key']}",
+            "name": safe_name,
+            "type": file.content_type or "application/octet-stream",
+            "size": blob["size"],
+        }
 
-    return {
-        "url": f"/uploads/{userId}/submissions/{homeworkId}/{safe_name}",
-        "name": safe_name,
-        "type": file.content_type or "application/octet-stream",
-        "size": file_path.stat().st_size,
-    }
+    return await idempotency.run_once(
+        f"submission-upload:{userId}",
+        idempotency_key,
+        idempotency.fingerprint(homeworkId, safe_name, file.size),
+        store,
+    )
 
 
 @router.get("/files/{userId}/homework/{filename}")
-async def download_submission_file(userId: str, filename: str):
-    file_path = UPLOAD_ROOT / userId / "homework" / filename
-
-    if not file_path.exists():
-        raise HTTPException(status_code=404, detail="File not found")
-
-    return FileResponse(file_path)
+async def download_submission_file(userId: str, filename: str, request: Request):
+    return await serve_key(request, f"{userId}/homework/{Path(filename).name}")
 
 
 @router.get("/submissions/mine", response_model=SubmissionOut)
@@ -90,6 +125,8 @@ async def my_submission(
     homeworkId: str = Query(...),
     userId: str = Query(...)
 ):
+    # Read your own autosaves
+    await drafts.flush((homeworkId, userId))
     sub = await submissions_collection.find_one({
         "homework_id": homeworkId,
         "user_id": userId
@@ -105,7 +142,8 @@ async def my_submission(
         notes=sub.get("notes"),
         files=sub.get("files"),
         answers=sub.get("answers"),
-        updated_at=to_iso(sub.get("updated_at"))
+        updated_at=to_iso(sub.get("updated_at")),
+        revision=sub.get("revision"),
     )
 
 
@@ -114,10 +152,51 @@ async def create_or_update_submission(
     homeworkId: str = Query(...),
     caseId: str = Query(...),
     userId: str = Query(...),
-    payload: SubmissionCreate = Body(...)
+    payload: SubmissionCreate = Body(...),
+    idempotency_key: Optional[str] = Header(None, alias=idempotency.HEADER),
 ):
-    timestamp = now()
+    """
+    Submit (or resubmit) a student's work. A retry carrying the same
+    Idempotency-Key gets the first response back without writing again.
+    """
+    return await idempotency.run_once(
+        f"submission:{userId}",
+        idempotency_key,
+        idempotency.fingerprint(homeworkId, caseId, payload),
+        lambda: _submit(homeworkId, caseId, userId, payload),
+    )
+
 
+async def _upsert_submission(homeworkId: str, userId: str, update: dict):
+    """
+    Upsert the student's submission; returns (_id, state before the write)
+    with the fields the completion counters need and the file list, None
+    when inserted.
+    """
+    # The unique (homework_id, user_id) index makes this one atomic write;
+    # two concurrent first submits can still race on the insert, and the
+    # loser simply retries as an update.
+    for attempt in range(2):
+        try:
+            before = await submissions_collection.find_one_and_update(
+                {"homework_id": homeworkId, "user_id": userId},
+                update,
+                upsert=True,
+                projection={**completion.PROJECTION, "files": 1},
+                return_document=ReturnDocument.BEFORE,
+            )
+            break
+        except DuplicateKeyError:
+            if attempt:
+                raise
+    if before:
+        return before["_id"], before
+    inserted = await submissions_collection.find_one({"homework_id": homeworkId, "user_id": userId}, {"_id": 1})
+    return inserted["_id"], None
+
+
+async def _open_homework(homeworkId: str, userId: str, timestamp: datetime) -> dict:
+    """The homework, if this student may still write to it."""
     try:
         hw = await homeworks_collection.find_one({"_id": ObjectId(homeworkId)})
     except Exception:
@@ -126,92 +205,60 @@ async def create_or_update_submission(
     if not hw:
         raise HTTPException(status_code=404, detail="Homework not found")
 
-    due_at = hw.get("due_at")
-    if due_at:
-        try:
-            due_dt = datetime.fromisoformat(str(due_at).replace("Z", "+00:00"))
-            if due_dt.replace(tzinfo=None) < timestamp:
-                raise HTTPException(status_code=400, detail="Deadline passed")
-        except HTTPException:
-            raise
-        except Exception:
-            pass
-
-    audience = hw.get("audience", "All Students")
-    assigned = False
-
-    if audience == "All Students":
-        assigned = True
-    elif audience == "Classrooms":
-        class_ids = [str(x) for x in (hw.get("class_ids") or []) if x]
-        if class_ids:
-            # Check membership across any selected classroom
-            valid_ids = []
-            for class_id in class_ids:
-                try:
-                    valid_ids.append(ObjectId(class_id))
-                except Exception:
-                    continue
-
-            if valid_ids:
-                cursor = classrooms_collection.find({"_id": {"$in": valid_ids}})
-                async for classroom in cursor:
-                    member_ids = [str(x) for x in classroom.get("members", [])]
-                    student_ids = [str(x) for x in classroom.get("students", [])]
-                    if userId in member_ids or userId in student_ids:
-                        assigned = True
-                        break
-        else:
-            # Legacy fallback for older homework docs that used class_name/year
-            classroom = await classrooms_collection.find_one({
-                "name": hw.get("class_name"),
-                "year": hw.get("year")
-            })
-            if classroom:
-                member_ids = [str(x) for x in classroom.get("members", [])]
-                student_ids = [str(x) for x in classroom.get("students", [])]
-                assigned = userId in member_ids or userId in student_ids
+    # status is flipped to "closed" by the due-date scheduler; due_at_utc
+    # covers the moment between the deadline and the event firing.
+    if is_past_due(hw, timestamp):
+        raise HTTPException(status_code=400, detail="Deadline passed")
+
+    assigned = await assignments.is_assigned(hw, userId)
 
     if not assigned:
         raise HTTPException(status_code=403, detail="Not assigned")
 
+    return hw
+
+
+def _class_fields(hw: dict) -> dict:
+    return {
+        "class_ids": [str(x) for x in (hw.get("class_ids") or []) if x],
+        "class_labels": [str(x) for x in (hw.get("class_labels") or []) if x],
+    }
+
+
+async def _submit(homeworkId: str, caseId: str, userId: str, payload: SubmissionCreate) -> SubmissionOut:
+    timestamp = now()
+    hw = await _open_homework(homeworkId, userId, timestamp)
+
     files_list = [f.model_dump() for f in payload.files] if payload.files else []
     answers_list = [a.model_dump() for a in payload.answers] if payload.answers else []
 
-    class_ids = [str(x) for x in (hw.get("class_ids") or []) if x]
-    class_labels = [str(x) for x in (hw.get("class_labels") or []) if x]
-
     update_doc = {
-        "homework_id": homeworkId,
         "case_id": caseId,
-        "user_id": userId,
         "notes": payload.notes,
         "files": files_list,
         "answers": answers_list,
         "status": "submitted",
-        "class_ids": class_ids,
-        "class_labels": class_labels,
+        **_class_fields(hw),
         "updated_at": timestamp,
+        "submitted_at": timestamp,
     }
 
-    existing = await submissions_collection.find_one({
-        "homework_id": homeworkId,
-        "user_id": userId,
+    # The full body supersedes any autosaves still waiting to be written
+    drafts.discard((homeworkId, userId))
+    sub_id, before = await _upsert_submission(homeworkId, userId, {
+        "$set": update_doc,
+        "$setOnInsert": {"created_at": timestamp},
+        "$inc": {"revision": 1},
     })
-
-    if existing:
-        await submissions_collection.update_one(
-            {"_id": existing["_id"]},
-            {"$set": update_doc}
-        )
-        submission_id = str(existing["_id"])
-    else:
-        update_doc["created_at"] = timestamp
-        result = await submissions_collection.insert_one(update_doc)
-        submission_id = str(result.inserted_id)
+    await completion.record_transition(
+        before, {**(before or {}), "homework_id": homeworkId, "user_id": userId, "status": "submitted"}, hw
+    )
+    similarity.index_submission_soon(homeworkId, userId)
+    # Files dropped from the list give up the reference their upload took
+    await release_refs(blob_refs((before or {}).get("files")) - blob_refs(files_list))
 
     return SubmissionOut(
-        submission_id=submission_id,
+        submission_id=str(sub_id),
         status="submitted",
         notes=payload.notes,
         files=files_list,
@@ -220,9 +267,87 @@ async def create_or_update_submission(
     )
 
 
+@router.patch("/submissions/draft")
+async def autosave_draft(
+    homeworkId: str = Query(...),
+    caseId: str = Query(...),
+    userId: str = Query(...),
+    payload: DraftPatch = Body(...),
+):
+    """
+    Autosave part of a draft: changed answers, notes and/or the file list.
+    Send the last `revision` you got back; a stale one is rejected with 409
+    and the current revision. Writes are debounced, so `pending` is true
+    until the draft is actually stored.
+    """
+    hw = await _open_homework(homeworkId, userId, now())
+    return await drafts.patch(
+        hw,
+        caseId,
+        userId,
+        base_revision=payload.revision,
+        notes=payload.notes,
+        files=[f.model_dump() for f in payload.files] if payload.files is not None else None,
+        answers=[a.model_dump() for a in payload.answers] if payload.answers else None,
+    )
+
+
+@router.post("/submissions/draft/submit", response_model=SubmissionOut)
+async def submit_draft(
+    homeworkId: str = Query(...),
+    userId: str = Query(...),
+    payload: DraftSubmit = Body(DraftSubmit()),
+):
+    """Turn the saved draft into the submission without resending it."""
+    timestamp = now()
+    hw = await _open_homework(homeworkId, userId, timestamp)
+    await drafts.flush((homeworkId, userId))
+
+    query = {"homework_id": homeworkId, "user_id": userId, "status": "draft", "frozen": {"$ne": True}}
+    if payload.revision is not None:
+        query["revision"] = payload.revision
+    sub = await submissions_collection.find_one_and_update(
+        query,
+        {
+            "$set": {"status": "submitted", "submitted_at": timestamp, "updated_at": timestamp, **_class_fields(hw)},
+            "$inc": {"revision": 1},
+        },
+        return_document=ReturnDocument.AFTER,
+    )
+    if not sub:
+        current = await submissions_collection.find_one(
+            {"homework_id": homeworkId, "user_id": userId}, {"status": 1, "frozen": 1, "revision": 1}
+        )
+        if not current:
+            raise HTTPException(status_code=404, detail="No draft to submit")
+        if current.get("frozen"):
+            detail = "Draft is frozen"
+        elif current.get("status") != "draft":
+            detail = "Submission already submitted"
+        else:
+            detail = "Draft was saved from somewhere else"
+        raise HTTPException(status_code=409, detail={"message": detail, "revision": current.get("revision")})
+    # An unfrozen draft counted for nothing
+    await completion.record_transition(None, sub, hw)
+    similarity.index_submission_soon(homeworkId, userId)
+
+    return SubmissionOut(
+        submission_id=str(sub["_id"]),
+        status="submitted",
+        notes=sub.get("notes"),
+        files=sub.get("files"),
+        answers=sub.get("answers"),
+        updated_at=timestamp.isoformat(),
+        revision=sub["revision"],
+    )
+
+
 @router.get("/instructor/submissions")
 async def instructor_submissions():
-    rows = await submissions_collection.find({}).sort("updated_at", -1).to_list(1000)
+    # Unsubmitted drafts are the student's business until they are frozen
+    rows = await submissions_collection.find(
+        {"$or": [{"status": {"$ne": "draft"}}, {"frozen": True}]}
+    ).sort("updated_at", -1).to_list(1000)
     out = []
 
     for sub in rows:
@@ -315,10 +440,137 @@ async def instructor_submissions():
     return out
 
 
+@router.post("/instructor/homeworks/{homework_id}/auto-grade")
+async def auto_grade(homework_id: str, regrade: bool = Query(False)):
+    """
+    Score the MCQ and short-answer questions of all submissions of a
+    homework. Essays are left for manual (or AI-assisted) grading.
+    """
+    return await auto_grade_homework(homework_id, regrade=regrade)
+
+
+@router.post("/instructor/homeworks/{homework_id}/similarity")
+async def run_answer_similarity(homework_id: str):
+    """
+    Rebuild the near-duplicate answer report of a homework as a background
+    job; submits keep it current afterwards.
+    """
+    try:
+        hw = await homeworks_collection.find_one({"_id": ObjectId(homework_id)}, {"_id": 1})
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid homework id")
+    if not hw:
+        raise HTTPException(status_code=404, detail="Homework not found")
+    job_id = await start_job(
+        similarity.JOB_KIND, {"homework_id": homework_id}, lambda: similarity.analyze_homework(homework_id)
+    )
+    return JSONResponse(status_code=202, content={"job_id": job_id, "status": "running"})
+
+
+@router.get("/instructor/homeworks/{homework_id}/similarity")
+async def answer_similarity_report(homework_id: str):
+    """Clusters and pairs of students with near-identical short/essay answers."""
+    return jsonable_encoder(await similarity.similarity_report(homework_id))
+
+
+@router.get("/instructor/homeworks/{homework_id}/completion")
+async def homework_completion(homework_id: str):
+    """
+    How many students have submitted, are awaiting review, were graded and
+    were published, overall and per classroom. Reads the maintained
+    counters instead of scanning submissions.
+    """
+    stats = await completion.completion(homework_id)
+    if stats is None:
+        raise HTTPException(status_code=404, detail="Homework not found")
+    return stats
+
+
+@router.post("/instructor/homeworks/completion/rebuild")
+async def rebuild_completion():
+    """Recount the completion counters of every homework as a background job."""
+    job_id = await start_job("rebuild_completion", {}, completion.rebuild)
+    return JSONResponse(status_code=202, content={"job_id": job_id, "status": "running"})
+
+
+@router.get("/instructor/homeworks/{homework_id}/analytics")
+async def homework_score_analytics(homework_id: str):
+    """
+    Score distribution, per-question difficulty and discrimination, MCQ
+    option counts and per-classroom breakdown for a homework.
+    """
+    return await homework_analytics(homework_id)
+
+
+@router.get("/instructor/homeworks/{homework_id}/gradebook")
+async def export_gradebook(
+    homework_id: str,
+    format: str = Query("csv", pattern="^(csv|xlsx)$"),
+    class_id: Optional[str] = Query(None),
+    include_answers: bool = Query(False),
+):
+    """
+    Stream a homework's grades as CSV or XLSX: one row per student with
+    profile, classroom, totals and a score column per question.
+    """
+    try:
+        hw = await homeworks_collection.find_one({"_id": ObjectId(homework_id)})
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid homework id")
+    if not hw:
+        raise HTTPException(status_code=404, detail="Homework not found")
+
+    qna = await qna_collection.find_one({"case_id": hw.get("case_id")}, {"questions": 1})
+    questions = ((qna or {}).get("questions") or []) if hw.get("homework_type") == "Q&A" else []
+
+    header = gradebook_header(questions, include_answers)
+    rows = iter_gradebook_rows(hw, questions, class_id=class_id, include_answers=include_answers)
+    filename = f"gradebook-{homework_id}.{format}"
+    if format == "xlsx":
+        body, media_type = iter_xlsx(header, rows, sheet_name="Gradebook"), XLSX_MEDIA_TYPE
+    else:
+        body, media_type = iter_csv(header, rows), CSV_MEDIA_TYPE
+    return StreamingResponse(
+        body,
+        media_type=media_type,
+        headers={
+            "Content-Disposition": f'attachment; filename="{filename}"',
+            "Cache-Control": "no-store",
+        },
+    )
+
+
+@router.get("/instructor/homeworks/{homework_id}/submission-files.zip")
+async def download_submission_files(homework_id: str, request: Request):
+    """
+    Every submission file of a homework in one ZIP, one folder per student.
+    The first download is streamed as it is built; a copy is kept, so
+    repeat downloads (and resumed ones, via Range) are served from disk
+    until a submission changes.
+    """
+    fingerprint = await archive_fingerprint(homework_id)
+    headers = {
+        "Content-Disposition": f'attachment; filename="submissions-{homework_id}.zip"',
+        # Student work: never in shared caches
+        "Cache-Control": "private, no-cache",
+    }
+
+    cached = cached_archive(homework_id, fingerprint)
+    if cached:
+        return await serve_cached_archive(request, cached, headers)
+
+    etag = f'"{fingerprint}"'
+    headers["ETag"] = etag
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+    body = tee_to_cache(iter_zip(iter_archive_entries(homework_id)), homework_id, fingerprint)
+    return StreamingResponse(body, media_type="application/zip", headers=headers)
+
+
 @router.post("/submissions/{submission_id}/grade")
 async def grade_submission(submission_id: str, payload: GradeRequest):
     graded_at = now()
-    result = await submissions_collection.update_one(
+    before = await submissions_collection.find_one_and_update(
         {"_id": ObjectId(submission_id)},
         {"$set": {
             "score": payload.score,
@@ -326,12 +578,15 @@ async def grade_submission(submission_id: str, payload: GradeRequest):
             "feedback": payload.feedback,
             "status": "graded",
             "graded_at": graded_at,
+            "graded_by": "instructor",
             "updated_at": graded_at,
-        }}
+        }},
+        projection=completion.PROJECTION,
     )
 
-    if result.matched_count == 0:
+    if before is None:
         raise HTTPException(status_code=404, detail="Submission not found")
+    await completion.record_transition(before, {**before, "status": "graded"})
 
     return {
         "status": "graded",
@@ -345,18 +600,20 @@ async def grade_submission(submission_id: str, payload: GradeRequest):
 @router.post("/submissions/{submission_id}/publish")
 async def publish_submission(submission_id: str):
     published_at = now()
-    result = await submissions_collection.update_one(
+    before = await submissions_collection.find_one_and_update(
         {"_id": ObjectId(submission_id)},
         {"$set": {
             "published": True,
             "published_at": published_at,
             "status": "graded",
             "updated_at": published_at,
-        }}
+        }},
+        projection=completion.PROJECTION,
     )
 
-    if result.matched_count == 0:
+    if before is None:
         raise HTTPException(status_code=404, detail="Submission not found")
+    await completion.record_transition(before, {**before, "published": True, "status": "graded"})
 
     return {
         "published": True,
@@ -375,15 +632,195 @@ async def return_submission_to_student(submission_id: str, payload: dict = Body(
     if feedback is not None:
         update_fields["feedback"] = feedback
 
-    result = await submissions_collection.update_one(
+    before = await submissions_collection.find_one_and_update(
         {"_id": ObjectId(submission_id)},
-        {"$set": update_fields}
+        {"$set": update_fields},
+        projection=completion.PROJECTION,
     )
 
-    if result.matched_count == 0:
+    if before is None:
         raise HTTPException(status_code=404, detail="Submission not found")
+    await completion.record_transition(before, {**before, "status": "graded"})
 
     return {
         "returned": True,
         "updated_at": updated_at.isoformat(),
     }
+
+
+# ====================================================
+# Bulk grade / publish / return
+# ====================================================
+
+def _parse_ids(ids):
+    valid, invalid = [], []
+    for sid in ids or []:
+        try:
+            valid.append(ObjectId(sid))
+        except Exception:
+            invalid.append(sid)
+    return valid, invalid
+
+
+def _selection_query(sel: BulkSelection, default_status=None):
+    if not sel.homework_id and not sel.submission_ids:
+        raise HTTPException(status_code=400, detail="homework_id or submission_ids is required")
+    query = {}
+    requested, invalid = _parse_ids(sel.submission_ids)
+    if sel.submission_ids is not None:
+        query["_id"] = {"$in": requested}
+    if sel.homework_id:
+        query["homework_id"] = sel.homework_id
+    statuses = sel.status if sel.status is not None else default_status
+    if statuses:
+        query["status"] = {"$in": statuses}
+    if sel.class_id:
+        query["class_ids"] = sel.class_id
+    return query, requested, invalid
+
+
+async def _item_results(requested, invalid, updated_ids, explicit: bool):
+    """Per-submission outcome: updated, skipped (filtered out), not_found or invalid_id."""
+    if not explicit:
+        return [{"submission_id": str(i), "result": "updated"} for i in updated_ids]
+    updated = set(updated_ids)
+    missing = [i for i in requested if i not in updated]
+    existing = set()
+    if missing:
+        existing = {d["_id"] async for d in submissions_collection.find({"_id": {"$in": missing}}, {"_id": 1})}
+    results = [
+        {
+            "submission_id": str(i),
+            "result": "updated" if i in updated else "skipped" if i in existing else "not_found",
+        }
+        for i in requested
+    ]
+    results += [{"submission_id": sid, "result": "invalid_id"} for sid in invalid]
+    return results
+
+
+async def _update_selection(sel: BulkSelection, update: dict, default_status=None) -> dict:
+    query, requested, invalid = _selection_query(sel, default_status)
+    # Resolve the targets first so the per-item report matches what changed
+    matched = [d["_id"] async for d in submissions_collection.find(query, {"_id": 1})]
+    result = await submissions_collection.update_many(
+        {"$and": [query, {"_id": {"$in": matched}}]}, update
+    ) if matched else None
+    if matched:
+        await completion.recount_many(
+            await submissions_collection.distinct("homework_id", {"_id": {"$in": matched}})
+        )
+    return {
+        "matched": result.matched_count if result else 0,
+        "modified": result.modified_count if result else 0,
+        "results": await _item_results(requested, invalid, matched, sel.submission_ids is not None),
+    }
+
+
+async def _selection_size(sel: BulkSelection) -> int:
+    if sel.submission_ids is not None:
+        return len(sel.submission_ids)
+    query, _, _ = _selection_query(sel)
+    return await submissions_collection.count_documents(query)
+
+
+async def _run_bulk(kind: str, params: dict, background: bool, size: int, work):
+    """Small batches answer directly; large ones (or on request) become a job to poll."""
+    if background or size > BULK_SYNC_LIMIT:
+        job_id = await start_job(kind, params, work)
+        return JSONResponse(status_code=202, content={"job_id": job_id, "status": "running"})
+    return await work()
+
+
+async def _bulk_grade(payload: BulkGradeRequest) -> dict:
+    graded_at = now()
+    ids, invalid = _parse_ids([item.submission_id for item in payload.items])
+    ops = [
+        UpdateOne({"_id": ObjectId(item.submission_id)}, {"$set": {
+            "score": item.score,
+            "rubric": item.rubric,
+            "feedback": item.feedback,
+            "status": "graded",
+            "graded_at": graded_at,
+            "graded_by": "instructor",
+            "updated_at": graded_at,
+        }})
+        for item in payload.items
+        if item.submission_id not in invalid
+    ]
+    found = []
+    if ids:
+        found = [d["_id"] async for d in submissions_collection.find({"_id": {"$in": ids}}, {"_id": 1})]
+    result = await submissions_collection.bulk_write(ops, ordered=True) if ops else None
+    if found:
+        await completion.recount_many(
+            await submissions_collection.distinct("homework_id", {"_id": {"$in": found}})
+        )
+    return {
+        "matched": result.matched_count if result else 0,
+        "modified": result.modified_count if result else 0,
+        "results": await _item_results(list(dict.fromkeys(ids)), invalid, found, True),
+    }
+
+
+@router.post("/instructor/submissions/bulk/grade")
+async def bulk_grade(payload: BulkGradeRequest):
+    """Grade many submissions in one ordered bulk_write (a repeated id: last one wins)."""
+    return await _run_bulk(
+        "bulk_grade",
+        {"count": len(payload.items)},
+        payload.background,
+        len(payload.items),
+        lambda: _bulk_grade(payload),
+    )
+
+
+@router.post("/instructor/submissions/bulk/publish")
+async def bulk_publish(payload: BulkSelection):
+    """
+    Publish the grades of a homework and/or listed submissions with one
+    update_many. Without a `status` filter only graded submissions are
+    published.
+    """
+    async def work():
+        published_at = now()
+        return await _update_selection(payload, {"$set": {
+            "published": True,
+            "published_at": published_at,
+            "status": "graded",
+            "updated_at": published_at,
+        }}, default_status=["graded"])
+
+    return await _run_bulk(
+        "bulk_publish", payload.model_dump(), payload.background, await _selection_size(payload), work
+    )
+
+
+# Only turned-in work can be returned; drafts stay with the student
+RETURNABLE_STATUSES = ["submitted", "graded"]
+
+
+@router.post("/instructor/submissions/bulk/return")
+async def bulk_return(payload: BulkReturnRequest):
+    """
+    Return many submissions to their students, optionally with shared
+    feedback. Only submitted or graded submissions are returned; a
+    `status` filter naming anything else is rejected.
+    """
+    if payload.status is not None:
+        not_returnable = sorted(set(payload.status) - set(RETURNABLE_STATUSES))
+        if not_returnable:
+            raise HTTPException(
+                status_code=400,
+                detail=f"Cannot return submissions with status: {', '.join(not_returnable)}",
+            )
+
+    async def work():
+        update_fields = {"status": "graded", "updated_at": now()}
+        if payload.feedback is not None:
+            update_fields["feedback"] = payload.feedback
+        return await _update_selection(payload, {"$set": update_fields}, default_status=RETURNABLE_STATUSES)
+
+    return await _run_bulk(
+        "bulk_return", payload.model_dump(), payload.background, await _selection_size(payload), work
+    )
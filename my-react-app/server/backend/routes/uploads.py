@@ -0,0 +1,114 @@
+import base64
+from typing import Optional
+
+from fastapi import APIRouter, HTTPException, Header, Query, Request, Response
+
+from core.uploads import create_session, get_session, check_owner, append_to_session, abort_session
+
+router = APIRouter(prefix="/api/uploads", tags=["Uploads"])
+
+TUS_VERSION = "1.0.0"
+
+
+def parse_upload_metadata(raw: Optional[str]) -> dict:
+    """Decode a tus `Upload-Metadata` header: `key b64value,key b64value`."""
+    out = {}
+    for pair in (raw or "").split(","):
+        parts = pair.strip().split(" ", 1)
+        if not parts[0]:
+            continue
+        value = None
+        if len(parts) == 2:
+            try:
+                value = base64.b64decode(parts[1]).decode("utf-8")
+            except Exception:
+                raise HTTPException(status_code=400, detail="Invalid Upload-Metadata")
+        out[parts[0]] = value
+    return out
+
+
+def offset_headers(session: dict) -> dict:
+    return {
+        "Tus-Resumable": TUS_VERSION,
+        "Upload-Offset": str(session["offset"]),
+        "Upload-Length": str(session["length"]),
+        "Cache-Control": "no-store",
+    }
+
+
+# ====================================================
+# Create Upload Session
+# ====================================================
+
+@router.post("", status_code=201)
+async def create_upload(
+    response: Response,
+    upload_length: int = Header(..., alias="Upload-Length"),
+    upload_metadata: Optional[str] = Header(None, alias="Upload-Metadata"),
+):
+    """
+    Start a resumable upload. The returned `upload_id` can be passed to the
+    case endpoints instead of a multipart `image` once all bytes are sent.
+    A `userId` in the metadata makes that user the owner: the session then
+    answers only requests carrying the same `userId`. Sessions expire
+    UPLOAD_SESSION_TTL_HOURS after their last chunk.
+    """
+    metadata = parse_upload_metadata(upload_metadata)
+    session = await create_session(
+        upload_length,
+        filename=metadata.get("filename"),
+        content_type=metadata.get("filetype") or metadata.get("content_type"),
+        owner_id=metadata.get("userId") or metadata.get("user_id"),
+    )
+
+    response.headers["Location"] = f"{router.prefix}/{session['_id']}"
+    response.headers.update(offset_headers(session))
+    return {"upload_id": session["_id"], "offset": 0, "length": session["length"]}
+
+
+# ====================================================
+# Query Offset
+# ====================================================
+
+@router.head("/{upload_id}")
+async def upload_offset(upload_id: str, userId: Optional[str] = Query(None)):
+    session = await get_session(upload_id)
+    check_owner(session, userId)
+    return Response(status_code=200, headers=offset_headers(session))
+
+
+@router.get("/{upload_id}")
+async def upload_status(upload_id: str, userId: Optional[str] = Query(None)):
+    session = await get_session(upload_id)
+    check_owner(session, userId)
+    return {
+        "upload_id": upload_id,
+        "offset": session["offset"],
+        "length": session["length"],
+        "status": session.get("status", "pending"),
+        "sha256": session.get("sha256"),
+    }
+
+
+# ====================================================
+# Append Chunk
+# ====================================================
+
+@router.patch("/{upload_id}")
+async def append_upload(
+    upload_id: str,
+    request: Request,
+    upload_offset: int = Header(..., alias="Upload-Offset"),
+    userId: Optional[str] = Query(None),
+):
+    """Append the raw request body at `Upload-Offset`, streamed to disk."""
+    session = await append_to_session(upload_id, upload_offset, request.stream(), owner_id=userId)
+    return Response(status_code=204, headers=offset_headers(session))
+
+
+@router.delete("/{upload_id}", status_code=204)
+async def delete_upload(upload_id: str, userId: Optional[str] = Query(None)):
+    session = await get_session(upload_id)
+    check_owner(session, userId)
+    await abort_session(upload_id)
+    return Response(status_code=204, headers={"Tus-Resumable": TUS_VERSION})
@@ -1,14 +1,13 @@
-from fastapi import APIRouter, HTTPException, UploadFile, File
-from fastapi.responses import FileResponse
+from fastapi import APIRouter, HTTPException, UploadFile, File, Request
 from bson import ObjectId
 from db.connection import users_collection, approvals_collection
 from core.security import decode_access_token, create_access_token
 from models.models import UserUpdate
+from core.storage import put_upload, serve_key, storage
+from core.user_cards import invalidate_user_card
 from datetime import datetime
 from pathlib import Path
 from uuid import uuid4
-import os
-import shutil
 
 router = APIRouter(prefix="/api/user", tags=["User"])
 
@@ -16,8 +15,6 @@ router = APIRouter(prefix="/api/user", tags=["User"])
 # Constants
 # ===============================
 
-BASE_DIR = Path(__file__).resolve().parent.parent
-UPLOAD_ROOT = BASE_DIR / "uploads"
 ALLOWED_IMAGE_TYPES = ["image/jpeg", "image/png", "image/webp"]
 MAX_FILE_SIZE_MB = 5
 
@@ -70,6 +67,7 @@ async def update_user_info(token: str, update_data: UserUpdate):
         {"_id": user_id},
         {"$set": update_fields}
     )
+    invalidate_user_card(user_id)
 
     updated_user = await users_collection.find_one({"_id": user_id})
 
@@ -107,23 +105,13 @@ async def upload_profile_photo(token: str, file: UploadFile = File(...)):
     if file.content_type not in ALLOWED_IMAGE_TYPES:
         raise HTTPException(status_code=400, detail="Invalid image type")
 
-    # Validate file size
-    contents = await file.read()
-    if len(contents) > MAX_FILE_SIZE_MB * 1024 * 1024:
-        raise HTTPException(status_code=400, detail="File too large (max 5MB)")
-
-    # Create folder: uploads/{userId}/profile_photos
-    user_folder = os.path.join(UPLOAD_ROOT, user_id_str, "profile_photos")
-    os.makedirs(user_folder, exist_ok=True)
-
-    # Secure filename
+    # Secure filename; stored under {userId}/profile_photos
     safe_name = Path(file.filename).name
     unique_name = f"{uuid4().hex}_{safe_name}"
-    file_path = os.path.join(user_folder, unique_name)
+    relative_path = f"{user_id_str}/profile_photos/{unique_name}"
 
-    # Save file
-    with open(file_path, "wb") as buffer:
-        buffer.write(contents)
+    # Save file (size is validated while streaming)
+    await put_upload(file, relative_path, max_bytes=MAX_FILE_SIZE_MB * 1024 * 1024, immutable=True)
 
     # Optional: delete old profile photo
     user = await users_collection.find_one({"_id": user_id})
@@ -131,15 +119,12 @@ async def upload_profile_photo(token: str, file: UploadFile = File(...)):
 
     if old_photo:
         old_path = old_photo.replace("/api/user/profile-photo/", "")
-        full_old_path = os.path.join(UPLOAD_ROOT, old_path)
-        if os.path.exists(full_old_path):
-            try:
-                os.remove(full_old_path)
-            except:
-                pass
+        try:
+            await storage.delete(old_path)
+        except Exception:
+            pass
 
     # Store relative path in DB
-    relative_path = f"{user_id_str}/profile_photos/{unique_name}"
 
     await users_collection.update_one(
         {"_id": user_id},
@@ -148,6 +133,7 @@ async def upload_profile_photo(token: str, file: UploadFile = File(...)):
             "updated_at": datetime.utcnow()
         }}
     )
+    invalidate_user_card(user_id)
 
     # After updating DB
 
@@ -175,12 +161,7 @@ async def upload_profile_photo(token: str, file: UploadFile = File(...)):
 # Serve Profile Photo
 # ===============================
 
-@router.get("/profile-photo/{path:path}")
-async def serve_profile_photo(path: str):
-    file_path = UPLOAD_ROOT / path
-
-    if not file_path.exists():
-        print("DEBUG PATH:", file_path)  # optional debug
-        raise HTTPException(status_code=404, detail="Image not found")
-
-    return FileResponse(str(file_path))
\ No newline at end of file
+@router.api_route("/profile-photo/{path:path}", methods=["GET", "HEAD"])
+async def serve_profile_photo(path: str, request: Request):
+    # Every upload gets a fresh uuid filename, so a given path never changes
+    return await serve_key(request, path, immutable=True)
\ No newline at end of file